@@ -0,0 +1,80 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+from src.config.config import Config
+from src.utlis.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+
+class BoundedExecutor:
+    """
+    Ограниченный пул потоков для блокирующих вызовов из async-обработчиков.
+
+    Задачи сверх max_workers ждут в очереди пула, а корутина - в await, так
+    что event loop продолжает обслуживать остальные запросы. Потоки, а не
+    процессы: модели и индексы загружены один раз в процессе, а torch, FAISS и
+    драйвер БД отпускают GIL на время тяжелой работы.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._running = 0
+        self._completed = 0
+
+    def _ensure_started(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix=self.name)
+        return self._executor
+
+    def _call(self, fn: Callable[[], T]) -> T:
+        with self._lock:
+            self._running += 1
+        try:
+            return fn()
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """await executor.run(fn, *args, **kwargs) - выполнить fn в пуле."""
+        executor = self._ensure_started()
+        with self._lock:
+            self._submitted += 1
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, self._call, functools.partial(fn, *args, **kwargs))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "running": self._running,
+                "queued": self._submitted - self._completed - self._running,
+                "completed": self._completed,
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# поиск и чтение индексов RAG (CPU: эмбеддинг запроса, FAISS, реранкер)
+rag_executor = BoundedExecutor("rag", Config.RAG_EXECUTOR_WORKERS)
+# синхронный SQLAlchemy и прочие блокирующие вызовы
+io_executor = BoundedExecutor("io", Config.IO_EXECUTOR_WORKERS)
+
+EXECUTORS = [rag_executor, io_executor]
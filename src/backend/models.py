@@ -76,6 +76,8 @@ class Query(BaseModel):
     user_id: int
     chat_id: int
     attachments: Optional[List[AttachmentCreate]] = None
+    # False - не ждать индексации новых документов (она продолжится в фоне)
+    wait_for_ingest: bool = True
 
 
 class QueryResponseContextItem(BaseModel):
@@ -88,6 +90,35 @@ class QueryResponse(BaseModel):
     context: List[QueryResponseContextItem]
     language: str
     summary: Optional[str] = None
+    # задачи индексации вложений, которые еще идут в фоне (GET /ingest/{job_id})
+    ingest_jobs: List[str] = []
+
+
+class QueryManyRequest(BaseModel):
+    user_id: int
+    chat_id: int
+    questions: List[str]
+
+
+class QueryManyResult(BaseModel):
+    question: str
+    context: List[QueryResponseContextItem]
+
+
+class QueryManyResponse(BaseModel):
+    results: List[QueryManyResult]
+
+
+class IngestJobStatus(BaseModel):
+    job_id: str
+    chat_id: int
+    file_name: str
+    status: str
+    stage: str
+    chunks: Optional[int] = None
+    error: Optional[str] = None
+    created_at: float
+    finished_at: Optional[float] = None
 
 
 class ContextLine(BaseModel):
@@ -0,0 +1,58 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from src.utlis.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+class StageGraph:
+    """
+    Небольшой граф зависимостей этапов обработки запроса.
+
+    Этап - async-функция, получающая результаты своих зависимостей
+    позиционными аргументами. Все этапы запускаются сразу и ждут только свои
+    зависимости, так что независимые этапы выполняются параллельно. Ошибка
+    любого этапа отменяет остальные и пробрасывается из run().
+    """
+
+    def __init__(self):
+        self._stages: Dict[str, Tuple[Callable[..., Awaitable[Any]], Tuple[str, ...]]] = {}
+        # длительность каждого завершенного этапа, секунды
+        self.timings: Dict[str, float] = {}
+
+    def add(self, name: str, func: Callable[..., Awaitable[Any]], *deps: str) -> None:
+        # зависимости объявляются раньше этапа - так в графе не бывает циклов
+        unknown = [dep for dep in deps if dep not in self._stages]
+        if unknown:
+            raise ValueError(f"Stage '{name}' depends on undeclared stages: {unknown}")
+        self._stages[name] = (func, deps)
+
+    async def run(self) -> Dict[str, Any]:
+        tasks: Dict[str, asyncio.Future] = {}
+
+        async def run_stage(name: str):
+            func, deps = self._stages[name]
+            args = [await tasks[dep] for dep in deps]
+            started = time.perf_counter()
+            try:
+                return await func(*args)
+            finally:
+                self.timings[name] = time.perf_counter() - started
+
+        for name in self._stages:
+            tasks[name] = asyncio.ensure_future(run_stage(name))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        return {name: task.result() for name, task in tasks.items()}
+
+    def server_timing(self) -> str:
+        """Значение заголовка Server-Timing: этап;dur=мс, в порядке объявления."""
+        return ", ".join(f"{name};dur={self.timings[name] * 1000:.1f}"
+                         for name in self._stages if name in self.timings)
@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import time
+from typing import Callable, Generic, Optional, TypeVar
+
+from src.utlis.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+
+class LazyService(Generic[T]):
+    """
+    Тяжелая подсистема (модели, клиенты LLM), которая создается при первом
+    обращении или фоновым прогревом, а не при импорте модуля.
+    Состояние ("cold", "warming", "warm", "failed") отдается в /health.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], T]):
+        self.name = name
+        self.factory = factory
+        self._instance: Optional[T] = None
+        self._lock = threading.Lock()
+        self._warming = False
+        self.load_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def is_warm(self) -> bool:
+        return self._instance is not None
+
+    def get(self) -> T:
+        if self._instance is not None:
+            return self._instance
+        with self._lock:
+            if self._instance is None:
+                self._warming = True
+                logger.info(f"Initializing {self.name} service.")
+                started = time.perf_counter()
+                try:
+                    self._instance = self.factory()
+                except Exception as e:
+                    self.error = str(e)
+                    logger.error(f"Failed to initialize {self.name} service: {e}")
+                    raise
+                finally:
+                    self._warming = False
+                self.error = None
+                self.load_seconds = time.perf_counter() - started
+                logger.info(f"{self.name} service ready in {self.load_seconds:.1f}s.")
+        return self._instance
+
+    async def aget(self) -> T:
+        """Как get(), но холодная инициализация идет в потоке, не блокируя event loop."""
+        if self._instance is not None:
+            return self._instance
+        return await asyncio.to_thread(self.get)
+
+    def status(self) -> dict:
+        if self._instance is not None:
+            state = "warm"
+        elif self._warming:
+            state = "warming"
+        elif self.error:
+            state = "failed"
+        else:
+            state = "cold"
+        return {"state": state, "load_seconds": self.load_seconds, "error": self.error}
+
+
+def _create_rag_service():
+    from src.rag.rag_service import RAGService
+    return RAGService()
+
+
+def _create_llm_interface():
+    from src.llm.llm import LLMInterface
+    return LLMInterface()
+
+
+rag_service: LazyService = LazyService("rag", _create_rag_service)
+llm_interface: LazyService = LazyService("llm", _create_llm_interface)
+
+SERVICES = [rag_service, llm_interface]
+
+
+async def warm_up():
+    """Фоновый прогрев подсистем после старта сервера; ошибки только логируются."""
+    for service in SERVICES:
+        try:
+            await service.aget()
+        except Exception:
+            # ошибка уже залогирована, сервис попробует инициализироваться при первом запросе
+            pass
@@ -53,6 +53,21 @@ class Config:
 
     FASTAPI_HOST = "0.0.0.0"
     FASTAPI_PORT = 8000
+    # Загружать модели RAG и LLM в фоне сразу после старта, а не на первом запросе
+    WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+    # Пулы потоков для блокирующей работы async-обработчиков: поиск по RAG
+    # (эмбеддинг, FAISS, реранкер) и ORM / прочие блокирующие вызовы
+    RAG_EXECUTOR_WORKERS = int(os.getenv("RAG_EXECUTOR_WORKERS", "4"))
+    IO_EXECUTOR_WORKERS = int(os.getenv("IO_EXECUTOR_WORKERS", "16"))
+    # Период замера задержки event loop (мс), 0 - не замерять
+    LOOP_LAG_INTERVAL_MS = int(os.getenv("LOOP_LAG_INTERVAL_MS", "100"))
+    # Отдавать длительности этапов /query в заголовке Server-Timing всегда
+    # (иначе - только по заголовку запроса X-Debug-Timings: 1)
+    QUERY_DEBUG_TIMINGS = os.getenv("QUERY_DEBUG_TIMINGS", "false").lower() == "true"
+    # Режим /query: "pipeline" - переформулировка, поиск, проверка релевантности
+    # и ответ отдельными шагами; "agent" - один проход агента с поиском по
+    # документам чата как инструментом (заголовок X-Query-Mode переопределяет)
+    QUERY_MODE = os.getenv("QUERY_MODE", "pipeline").lower()
 
     MAX_QUERY_LENGTH = 500
     ALLOWED_LANGUAGES = ["ru", "en"]
@@ -61,5 +76,90 @@ class Config:
     RAG_DIR = "rag_database"
     FT_DIR = "fine-tuning/dataset"
 
+    # RAG
+    # Бюджет памяти под загруженные FAISS-индексы чатов (на процесс)
+    RAG_INDEX_CACHE_MB = int(os.getenv("RAG_INDEX_CACHE_MB", "512"))
+    # Максимум записей в общем дисковом кэше эмбеддингов
+    RAG_EMBEDDING_CACHE_MAX_ENTRIES = int(
+        os.getenv("RAG_EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+    # Фоновая индексация документов: число процессов, размер очереди,
+    # сколько секунд хранить статус завершенной задачи
+    RAG_INGEST_WORKERS = int(os.getenv("RAG_INGEST_WORKERS", "2"))
+    RAG_INGEST_MAX_PENDING = int(os.getenv("RAG_INGEST_MAX_PENDING", "32"))
+    RAG_INGEST_JOB_TTL_S = int(os.getenv("RAG_INGEST_JOB_TTL_S", "3600"))
+    # Сколько секунд /query ждет индексации вложения; дальше она идет в фоне
+    RAG_INGEST_WAIT_TIMEOUT_S = float(os.getenv("RAG_INGEST_WAIT_TIMEOUT_S", "600"))
+    # Файлы от этого размера индексируются потоково, пачками по
+    # RAG_INGEST_BATCH_SIZE чанков с сохранением индекса каждые RAG_INGEST_COMMIT_EVERY пачек
+    RAG_STREAMING_MIN_BYTES = int(os.getenv("RAG_STREAMING_MIN_BYTES", str(5 * 1024 * 1024)))
+    RAG_INGEST_BATCH_SIZE = int(os.getenv("RAG_INGEST_BATCH_SIZE", "64"))
+    RAG_INGEST_COMMIT_EVERY = int(os.getenv("RAG_INGEST_COMMIT_EVERY", "10"))
+    # Если на первых страницах PDF меньше символов - считаем его сканом и
+    # отдаем Unstructured вместо pypdf
+    RAG_PDF_MIN_CHARS_PER_PAGE = int(os.getenv("RAG_PDF_MIN_CHARS_PER_PAGE", "100"))
+    # Сколько оценок пар (запрос, чанк) держать в кэше реранкера
+    RAG_RERANK_CACHE_SIZE = int(os.getenv("RAG_RERANK_CACHE_SIZE", "50000"))
+    # Бэкенд инференса эмбеддера и реранкера: "torch" или "onnx" (int8, CPU).
+    # Для "onnx" нужны зависимости из requirements-onnx.txt
+    RAG_INFERENCE_BACKEND = os.getenv("RAG_INFERENCE_BACKEND", "torch").lower()
+    RAG_ONNX_DIR = os.getenv("RAG_ONNX_DIR", "models/onnx")
+    # Микро-батчинг эмбеддингов: максимум текстов в батче и сколько ждать
+    # попутные запросы после первого
+    RAG_EMBED_MAX_BATCH = int(os.getenv("RAG_EMBED_MAX_BATCH", "64"))
+    RAG_EMBED_MAX_WAIT_MS = float(os.getenv("RAG_EMBED_MAX_WAIT_MS", "5"))
+    # Чаты, в которых векторов больше порога, переводятся с точного поиска на
+    # ANN ("hnsw" или "ivfpq"), если recall@10 на выборке не ниже RAG_ANN_MIN_RECALL
+    RAG_ANN_THRESHOLD = int(os.getenv("RAG_ANN_THRESHOLD", "20000"))
+    RAG_ANN_INDEX_TYPE = os.getenv("RAG_ANN_INDEX_TYPE", "hnsw").lower()
+    RAG_ANN_MIN_RECALL = float(os.getenv("RAG_ANN_MIN_RECALL", "0.9"))
+    RAG_ANN_RECALL_SAMPLES = int(os.getenv("RAG_ANN_RECALL_SAMPLES", "200"))
+    # ANN-индекс пересобирается (IVF-PQ - переобучается) и заново проверяется
+    # на recall, когда число векторов вырастет во столько раз с прошлой сборки
+    RAG_ANN_REBUILD_FACTOR = float(os.getenv("RAG_ANN_REBUILD_FACTOR", "2"))
+    RAG_HNSW_M = int(os.getenv("RAG_HNSW_M", "32"))
+    RAG_HNSW_EF_CONSTRUCTION = int(os.getenv("RAG_HNSW_EF_CONSTRUCTION", "200"))
+    RAG_HNSW_EF_SEARCH = int(os.getenv("RAG_HNSW_EF_SEARCH", "128"))
+    RAG_PQ_M = int(os.getenv("RAG_PQ_M", "48"))
+    RAG_IVF_NPROBE = int(os.getenv("RAG_IVF_NPROBE", "16"))
+    # Запросы читают индексы чатов через mmap (только чтение, общий page cache воркеров)
+    RAG_MMAP_INDEXES = os.getenv("RAG_MMAP_INDEXES", "true").lower() == "true"
+    # Размер чанка и перекрытие в токенах эмбеддера (окно модели - 128 токенов
+    # вместе со служебными); RAG_CHUNK_TOKENS=0 - старое деление по символам
+    RAG_CHUNK_TOKENS = int(os.getenv("RAG_CHUNK_TOKENS", "120"))
+    RAG_CHUNK_OVERLAP_TOKENS = int(os.getenv("RAG_CHUNK_OVERLAP_TOKENS", "20"))
+    # Удаление почти одинаковых чанков (колонтитулы, шаблонные слайды) внутри чата:
+    # MinHash по пословным n-граммам + LSH, дубликат - оценка Жаккара >= порога
+    RAG_DEDUP_ENABLED = os.getenv("RAG_DEDUP_ENABLED", "true").lower() == "true"
+    RAG_DEDUP_THRESHOLD = float(os.getenv("RAG_DEDUP_THRESHOLD", "0.9"))
+    RAG_DEDUP_NUM_PERM = int(os.getenv("RAG_DEDUP_NUM_PERM", "64"))
+    RAG_DEDUP_BANDS = int(os.getenv("RAG_DEDUP_BANDS", "16"))
+    RAG_DEDUP_SHINGLE_SIZE = int(os.getenv("RAG_DEDUP_SHINGLE_SIZE", "3"))
+    # Максимум вопросов в одном запросе /query_many
+    RAG_QUERY_MANY_MAX_QUESTIONS = int(os.getenv("RAG_QUERY_MANY_MAX_QUESTIONS", "64"))
+    # Обслуживание индексов: индексы удаленных чатов архивируются ("archive") или
+    # удаляются ("delete"), чаты с долей чанков удаленных документов не меньше
+    # RAG_COMPACT_MIN_DEAD_RATIO компактируются. Интервал 0 - без расписания
+    RAG_GC_MODE = os.getenv("RAG_GC_MODE", "archive").lower()
+    RAG_ARCHIVE_DIR = os.getenv("RAG_ARCHIVE_DIR", "rag_indexes_archive")
+    RAG_COMPACT_MIN_DEAD_RATIO = float(os.getenv("RAG_COMPACT_MIN_DEAD_RATIO", "0.2"))
+    RAG_MAINTENANCE_INTERVAL_S = int(os.getenv("RAG_MAINTENANCE_INTERVAL_S", str(6 * 3600)))
+    RAG_MAINTENANCE_DRY_RUN = os.getenv("RAG_MAINTENANCE_DRY_RUN", "false").lower() == "true"
+    # Снимки индекса: каждая запись публикует новую версию chat_{id}/v{N}; прежние
+    # удаляются не раньше, чем через столько секунд (их еще могут читать запросы)
+    RAG_SNAPSHOT_GRACE_S = int(os.getenv("RAG_SNAPSHOT_GRACE_S", "300"))
+    # Релевантность найденного контекста решается по оценке реранкера (0..1):
+    # >= ACCEPT - используем, < REJECT - нет, между ними - спрашиваем LLM (если
+    # включено). Откалиброванные пороги (python -m src.rag.calibrate_relevance)
+    # читаются из RAG_RELEVANCE_THRESHOLDS_FILE. Решения пишутся в RAG_RELEVANCE_LOG;
+    # доля RAG_RELEVANCE_LLM_SAMPLE_RATE однозначных решений тоже проверяется LLM -
+    # это разметка для калибровки
+    RAG_RELEVANCE_ACCEPT_SCORE = float(os.getenv("RAG_RELEVANCE_ACCEPT_SCORE", "0.5"))
+    RAG_RELEVANCE_REJECT_SCORE = float(os.getenv("RAG_RELEVANCE_REJECT_SCORE", "0.02"))
+    RAG_RELEVANCE_LLM_TIEBREAK = os.getenv("RAG_RELEVANCE_LLM_TIEBREAK", "true").lower() == "true"
+    RAG_RELEVANCE_LLM_SAMPLE_RATE = float(os.getenv("RAG_RELEVANCE_LLM_SAMPLE_RATE", "0.0"))
+    RAG_RELEVANCE_THRESHOLDS_FILE = os.getenv(
+        "RAG_RELEVANCE_THRESHOLDS_FILE", "relevance_thresholds.json")
+    RAG_RELEVANCE_LOG = os.getenv("RAG_RELEVANCE_LOG", "relevance_decisions.jsonl")
+
     # frontend network
     FRONTEND_ADDRESS = "http://localhost:5173"
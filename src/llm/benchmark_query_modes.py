@@ -0,0 +1,137 @@
+"""
+Сравнение режимов /query ("pipeline" и "agent") по числу вызовов LLM и
+сквозной задержке на запущенном сервере.
+
+Каждый вопрос отправляется в обоих режимах (заголовок X-Query-Mode) по
+очереди, порядок режимов чередуется, чтобы растущая история чата не давала
+преимущества одному из них. Число вызовов LLM сервер отдает в X-LLM-Calls
+(запросы идут с X-Debug-Timings: 1). Ответы сохраняются в историю чата, так
+что для замера лучше завести отдельный чат с загруженными документами.
+
+С --stream запросы идут в /query/stream, и главной метрикой становится время
+до первого токена ответа (TTFT), замеренное на клиенте.
+
+Вопросы - текстовый файл, по вопросу в строке, или JSONL с полем "question".
+
+Запуск:
+    python -m src.llm.benchmark_query_modes --chat-id 1 --user-id 1 --questions data/questions.txt [--stream]
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, List, Optional
+
+from src.utlis.stats import percentile
+
+MODES = ["pipeline", "agent"]
+
+
+def load_questions(path: str) -> List[str]:
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            questions.append(json.loads(line)["question"] if line.startswith("{") else line)
+    return questions
+
+
+async def _query(session, args, mode: str, payload: dict) -> Optional[dict]:
+    headers = {"X-Query-Mode": mode, "X-Debug-Timings": "1"}
+    started = time.perf_counter()
+    async with session.post(f"{args.url}/query", json=payload, headers=headers) as response:
+        body = await response.json()
+        if response.status != 200:
+            print(f"[{mode}] '{payload['question'][:40]}': HTTP {response.status} {body}")
+            return None
+        latency_ms = (time.perf_counter() - started) * 1000
+        return {
+            "latency_ms": latency_ms,
+            # без потока первый токен пользователь видит вместе со всем ответом
+            "ttft_ms": latency_ms,
+            "llm_calls": int(response.headers.get("X-LLM-Calls", 0)),
+            "with_context": bool(body.get("context")),
+        }
+
+
+async def _query_stream(session, args, mode: str, payload: dict) -> Optional[dict]:
+    started = time.perf_counter()
+    ttft_ms = None
+    event = None
+    async with session.post(f"{args.url}/query/stream", json=payload, headers={"X-Query-Mode": mode}) as response:
+        async for raw_line in response.content:
+            line = raw_line.decode("utf-8").rstrip("\n")
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+                if event == "token" and ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - started) * 1000
+            elif line.startswith("data: ") and event in ("done", "error"):
+                data = json.loads(line[len("data: "):])
+                if event == "error":
+                    print(f"[{mode}] '{payload['question'][:40]}': {data}")
+                    return None
+                return {
+                    "latency_ms": (time.perf_counter() - started) * 1000,
+                    "ttft_ms": ttft_ms if ttft_ms is not None else (time.perf_counter() - started) * 1000,
+                    "llm_calls": data["metrics"]["llm_calls"],
+                    "with_context": bool(data.get("context")),
+                }
+    print(f"[{mode}] '{payload['question'][:40]}': stream ended without a result")
+    return None
+
+
+async def _run(args, questions: List[str]) -> Dict[str, List[dict]]:
+    import aiohttp
+
+    send = _query_stream if args.stream else _query
+    results: Dict[str, List[dict]] = {mode: [] for mode in MODES}
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=args.timeout_s)) as session:
+        for i, question in enumerate(questions):
+            modes = MODES if i % 2 == 0 else MODES[::-1]
+            for mode in modes:
+                payload = {"chat_id": args.chat_id, "user_id": args.user_id, "question": question}
+                row = await send(session, args, mode, payload)
+                if row is None:
+                    continue
+                results[mode].append(row)
+                if args.verbose:
+                    print(f"[{mode}] ttft {row['ttft_ms']:8.0f} ms, total {row['latency_ms']:8.0f} ms, "
+                          f"{row['llm_calls']} LLM calls: {question[:60]}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--chat-id", type=int, required=True)
+    parser.add_argument("--user-id", type=int, required=True)
+    parser.add_argument("--questions", required=True)
+    parser.add_argument("--timeout-s", type=float, default=300)
+    parser.add_argument("--stream", action="store_true", help="замерять через /query/stream (TTFT)")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    results = asyncio.run(_run(args, questions))
+
+    print(f"\n{len(questions)} questions, {'/query/stream' if args.stream else '/query'}\n")
+    print(f"{'mode':<10}{'ok':>6}{'LLM calls':>11}{'max calls':>11}{'TTFT p50':>10}{'TTFT p95':>10}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{'context':>9}")
+    for mode in MODES:
+        rows = results[mode]
+        if not rows:
+            print(f"{mode:<10}{0:>6}")
+            continue
+        ttfts = [row["ttft_ms"] for row in rows]
+        latencies = [row["latency_ms"] for row in rows]
+        calls = [row["llm_calls"] for row in rows]
+        print(f"{mode:<10}{len(rows):>6}{sum(calls) / len(rows):>11.2f}{max(calls):>11}"
+              f"{percentile(ttfts, 0.5):>10.0f}{percentile(ttfts, 0.95):>10.0f}"
+              f"{percentile(latencies, 0.5):>10.0f}{percentile(latencies, 0.95):>10.0f}"
+              f"{sum(row['with_context'] for row in rows) / len(rows):>9.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+
+
+class LLMCallCounter(BaseCallbackHandler):
+    """Считает вызовы моделей (chat и completion) внутри count_llm_calls()."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.calls += 1
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.calls += 1
+
+
+_llm_call_counter: ContextVar[Optional[LLMCallCounter]] = ContextVar("llm_call_counter", default=None)
+# обработчик из contextvar LangChain добавляет ко всем запускам цепочек и
+# моделей в этом контексте (и в задачах asyncio, созданных из него)
+register_configure_hook(_llm_call_counter, inheritable=True)
+
+
+@contextmanager
+def count_llm_calls() -> Iterator[LLMCallCounter]:
+    counter = LLMCallCounter()
+    token = _llm_call_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _llm_call_counter.reset(token)
@@ -7,6 +7,7 @@ from sqlalchemy import and_
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_core.output_parsers.string import StrOutputParser
+from langchain_core.tools import BaseTool
 from langchain.agents import create_tool_calling_agent, AgentExecutor
 from langchain_mistralai import ChatMistralAI
 from langchain_ollama import ChatOllama
@@ -17,7 +18,8 @@ from src.backend.database import get_db, Message, UserCalendar
 from src.config.config import Config
 from src.google_calendar.google_calendar import list_calendar_events, create_calendar_event, delete_calendar_event, \
     update_calendar_event
-from src.llm.prompts import BASE_PROMPT, SYSTEM_PROMPT_CALENDAR, SYSTEM_PROMPT_OCR, SYSTEM_PROMPT_SPEED_TEST
+from src.llm.prompts import BASE_PROMPT, SYSTEM_PROMPT_CALENDAR, SYSTEM_PROMPT_OCR, SYSTEM_PROMPT_SPEED_TEST, \
+    SYSTEM_PROMPT_RAG
 from src.speed_tool.speed import get_speed_test_results
 from src.utlis.logging_config import get_logger
 import requests
@@ -78,7 +80,8 @@ class LLMInterface:
             api_key=self.config.MISTRAL_API_KEY, model="mistral-medium-latest")
 
     def _handle_llm_error(self, error: Exception,
-                          backup_llm: Optional[ChatMistralAI], prompt, messages: List) -> str:
+                          backup_llm: Optional[ChatMistralAI], prompt, messages: List,
+                          tools: Optional[list] = None) -> str:
         """Handle LLM-related errors with fallback to Mistral if available."""
         status_code = None
         if isinstance(error, RateLimitError):
@@ -92,7 +95,7 @@ class LLMInterface:
             self.llm = backup_llm
             try:
                 agent_executor = self.create_agent_executor(
-                    self.llm, self.tools, prompt)
+                    self.llm, tools or self.tools, prompt)
                 response = agent_executor.invoke({"messages": messages})
                 return response.get(
                     "output", "Sorry, I encountered an issue and couldn't provide a response.")
@@ -168,16 +171,27 @@ class LLMInterface:
             return f"An unexpected error occurred while processing your request: {str(e)}"
 
     async def agenerate(self, question: str, history: List[Type[Message]],
-                        user_id: int, context: List[dict], language: str) -> str:
-        """Асинхронная версия метода generate."""
+                        user_id: int, context: List[dict], language: str,
+                        retrieval_tool: Optional[BaseTool] = None) -> str:
+        """
+        Асинхронная версия метода generate.
+        retrieval_tool - поиск по документам чата (src.rag.retrieval_tool): агент
+        сам решает, искать ли и что, и отвечает за один проход без отдельных
+        вызовов LLM на переформулировку вопроса и проверку релевантности.
+        """
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S %Z")
 
-        formatted_system_prompt = (
+        system_prompt = (
             BASE_PROMPT +
             SYSTEM_PROMPT_CALENDAR +
             SYSTEM_PROMPT_OCR +
             SYSTEM_PROMPT_SPEED_TEST
-        ).format(now=now, user_id=user_id)
+        )
+        tools = self.tools
+        if retrieval_tool is not None:
+            system_prompt += SYSTEM_PROMPT_RAG
+            tools = self.tools + [retrieval_tool]
+        formatted_system_prompt = system_prompt.format(now=now, user_id=user_id)
 
         prompt = ChatPromptTemplate.from_messages([
             SystemMessage(content=formatted_system_prompt),
@@ -185,7 +199,7 @@ class LLMInterface:
             MessagesPlaceholder(variable_name="agent_scratchpad"),
         ])
         agent_executor = self.create_agent_executor(
-            self.llm, self.tools, prompt)
+            self.llm, tools, prompt)
 
         messages = convert_to_messages(history)
         messages.append(HumanMessage(content=question))
@@ -198,7 +212,7 @@ class LLMInterface:
 
         except (requests.exceptions.HTTPError, RateLimitError) as e:
             return self._handle_llm_error(
-                e, self.mistral_llm, prompt, messages)
+                e, self.mistral_llm, prompt, messages, tools)
 
         except Exception as e:
             logger.error(f"Unexpected error in agenerate: {e}")
@@ -72,3 +72,11 @@ SYSTEM_PROMPT_SPEED_TEST = """
                1. Timestamp: 2025-07-20T10:00:00, Stream Speed: 170 BPM, Unstable Rate: 125.4, Taps: 10, Time: 10 sec
                2. Timestamp: 2025-07-19T15:30:00, Stream Speed: 200 BPM, Unstable Rate: 150.2, Taps: 12, Time: 13 sec"
 """
+
+SYSTEM_PROMPT_RAG = """
+13. For questions that may be answered by the documents the user uploaded to this chat:
+            - Invoke the `search_chat_documents` tool with a standalone search query (resolve references like "it" or "that file" using the conversation).
+            - Answer based ONLY on the returned passages and mention the file names you used.
+            - If the tool finds nothing relevant, say that the documents do not contain the answer, then answer from general knowledge if appropriate and say so.
+            - Do not invoke the tool for small talk or for calendar, OCR and speed test requests.
+"""
@@ -1,6 +1,6 @@
 import base64
+import threading
 
-import easyocr
 from typing import List
 
 from dotenv import load_dotenv
@@ -15,6 +15,28 @@ from src.utlis.logging_config import get_logger
 
 logger = get_logger(__name__)
 
+# easyocr pulls in torch and loads models, so it is imported on first use only;
+# readers are cached per language set
+_easyocr_readers = {}
+_easyocr_lock = threading.Lock()
+
+
+def get_easyocr_reader(languages: List[str]):
+    key = tuple(languages)
+    with _easyocr_lock:
+        if key not in _easyocr_readers:
+            import easyocr
+
+            logger.info(f"Loading easyocr reader for languages {list(key)}")
+            _easyocr_readers[key] = easyocr.Reader(list(key))
+        return _easyocr_readers[key]
+
+
+def easyocr_status() -> dict:
+    with _easyocr_lock:
+        languages = [list(key) for key in _easyocr_readers]
+    return {"state": "warm" if languages else "cold", "readers": languages}
+
 
 def read_from_image_easyocr(image_path: str, languages: List[str] = ['en']):
     """
@@ -44,7 +66,7 @@ def read_from_image_easyocr(image_path: str, languages: List[str] = ['en']):
                 raise FileNotFoundError(f"Image not found at: {image_path}")
             image = Image.open(image_path).convert('RGB')
             image_np = np.array(image)
-        reader = easyocr.Reader(languages)
+        reader = get_easyocr_reader(languages)
         result = reader.readtext(image_np, paragraph=True, detail=1)
 
         if not result:
@@ -0,0 +1,150 @@
+import math
+from typing import Callable, Optional
+
+import faiss
+import numpy as np
+
+from src.config.config import Config
+from src.utlis.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# recall@RECALL_K считается относительно точного (flat) поиска
+RECALL_K = 10
+
+
+def is_flat(index) -> bool:
+    return isinstance(index, faiss.IndexFlat)
+
+
+def stores_exact_vectors(index) -> bool:
+    """Восстанавливает ли reconstruct исходные векторы: flat и HNSW - да, у IVF-PQ - только приближение."""
+    return isinstance(index, (faiss.IndexFlat, faiss.IndexHNSWFlat))
+
+
+def _pq_subquantizers(d: int, preferred: int) -> int:
+    # число подквантователей PQ должно делить размерность
+    for m in range(min(preferred, d), 0, -1):
+        if d % m == 0:
+            return m
+    return 1
+
+
+def build_ann_index(vectors: np.ndarray, metric: int, kind: str):
+    """Строит HNSW или IVF-PQ индекс по векторам, сохраняя их порядок (позиции)."""
+    n, d = vectors.shape
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(d, Config.RAG_HNSW_M, metric)
+        index.hnsw.efConstruction = Config.RAG_HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = Config.RAG_HNSW_EF_SEARCH
+        index.add(vectors)
+        return index
+    if kind == "ivfpq":
+        nlist = max(1, int(4 * math.sqrt(n)))
+        # кодбуку PQ на 2^nbits центроидов нужно ~39 точек обучения на центроид
+        nbits = min(8, max(1, int(math.log2(max(n // 39, 2)))))
+        quantizer = faiss.IndexFlat(d, metric)
+        index = faiss.IndexIVFPQ(
+            quantizer, d, nlist, _pq_subquantizers(d, Config.RAG_PQ_M), nbits, metric)
+        index.train(vectors)
+        index.add(vectors)
+        index.nprobe = Config.RAG_IVF_NPROBE
+        # прямое отображение позиция -> код нужно для reconstruct (поиск по файлу, компакция)
+        index.make_direct_map()
+        return index
+    raise ValueError(f"Unsupported RAG_ANN_INDEX_TYPE '{kind}'. Use 'hnsw' or 'ivfpq'.")
+
+
+def recall_queries(exact_index, vectors: np.ndarray, samples: int) -> np.ndarray:
+    """
+    Запросы для оценки recall: случайные сохраненные векторы, сдвинутые в
+    случайном направлении на расстояние до их ближайшего соседа. Сами
+    сохраненные векторы как запросы завышают recall: совпадающий с запросом
+    вектор находит любой индекс, а вопросы пользователей лежат между чанками.
+    """
+    rng = np.random.default_rng(0)
+    picked = rng.choice(len(vectors), size=min(samples, len(vectors)), replace=False)
+    sample = vectors[picked]
+    _, neighbors = exact_index.search(sample, 2)
+    # первый результат - обычно сам вектор
+    nearest = np.where(neighbors[:, 0] == picked, neighbors[:, 1], neighbors[:, 0])
+    nearest = np.where(nearest >= 0, nearest, picked)
+    distances = np.linalg.norm(sample - vectors[nearest], axis=1)
+    positive = distances[distances > 0]
+    fallback = float(np.median(positive)) if len(positive) else 1e-3 * float(np.linalg.norm(sample, axis=1).mean())
+    distances = np.where(distances > 0, distances, fallback)
+
+    directions = rng.standard_normal(sample.shape).astype(np.float32)
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    queries = (sample + directions * distances[:, None]).astype(np.float32)
+    # нормированные эмбеддинги (косинус) - нормированные и запросы
+    if np.allclose(np.linalg.norm(sample, axis=1), 1.0, atol=1e-3):
+        faiss.normalize_L2(queries)
+    return queries
+
+
+def measure_recall(exact_index, ann_index, queries: np.ndarray) -> float:
+    """Средний recall@RECALL_K ANN-индекса относительно точного на запросах queries."""
+    k = min(RECALL_K, exact_index.ntotal)
+    _, exact = exact_index.search(queries, k)
+    _, approx = ann_index.search(queries, k)
+    hits = [len(set(e) & set(a)) / k for e, a in zip(exact, approx)]
+    return float(np.mean(hits))
+
+
+def maybe_promote(vector_store, index_info: dict, exact_vectors: Callable[[], np.ndarray]) -> Optional[dict]:
+    """
+    Выбирает тип индекса FAISS-хранилища по его размеру:
+    - точный (flat) индекс больше RAG_ANN_THRESHOLD переводится на ANN, если
+      recall на выборке не ниже RAG_ANN_MIN_RECALL; после неудачной попытки
+      повторяем, только когда индекс вырос еще на 25%;
+    - ANN-индекс, выросший в RAG_ANN_REBUILD_FACTOR раз с прошлой сборки,
+      строится заново (IVF-PQ переобучается на текущих векторах) с новой
+      проверкой recall; если recall ниже порога, возвращается точный индекс.
+
+    index_info - описание индекса из манифеста (ann_attempt_ntotal - размер
+    при прошлой сборке или попытке). exact_vectors() возвращает исходные
+    векторы всех позиций: у IVF-PQ reconstruct дает лишь приближение.
+
+    Возвращает описание попытки для манифеста или None, если попытки не было.
+    """
+    index = vector_store.index
+    attempted_at = index_info.get("ann_attempt_ntotal")
+    if is_flat(index):
+        if index.ntotal < Config.RAG_ANN_THRESHOLD:
+            return None
+        if attempted_at and index.ntotal < attempted_at * 1.25:
+            return None
+        current = "flat"
+    else:
+        if not attempted_at or index.ntotal < attempted_at * Config.RAG_ANN_REBUILD_FACTOR:
+            return None
+        current = index_info.get("type", "ann")
+
+    kind = Config.RAG_ANN_INDEX_TYPE
+    try:
+        vectors = exact_vectors()
+        exact_index = index
+        if not is_flat(index):
+            exact_index = faiss.IndexFlat(index.d, index.metric_type)
+            exact_index.add(vectors)
+        ann_index = build_ann_index(vectors, index.metric_type, kind)
+        recall = measure_recall(exact_index, ann_index,
+                                recall_queries(exact_index, vectors, Config.RAG_ANN_RECALL_SAMPLES))
+    except Exception as e:
+        # неудачная попытка не должна ломать индексацию документа
+        logger.error(f"Failed to build {kind} index over {index.ntotal} vectors: {e}")
+        return {"type": current, "ann_attempt_ntotal": index.ntotal, "recall": None}
+
+    if recall < Config.RAG_ANN_MIN_RECALL:
+        logger.warning(
+            f"{kind} index over {index.ntotal} vectors has recall@{RECALL_K}={recall:.3f} "
+            f"< {Config.RAG_ANN_MIN_RECALL}. Using exact index.")
+        vector_store.index = exact_index
+        return {"type": "flat", "ann_attempt_ntotal": index.ntotal, "recall": recall}
+
+    vector_store.index = ann_index
+    action = "Promoted" if current == "flat" else f"Rebuilt {current}"
+    logger.info(
+        f"{action} index with {index.ntotal} vectors to {kind} (recall@{RECALL_K}={recall:.3f}).")
+    return {"type": kind, "ann_attempt_ntotal": index.ntotal, "recall": recall}
@@ -0,0 +1,122 @@
+"""
+Сравнение бэкендов инференса RAG (PyTorch vs int8 ONNX Runtime) по задержке и
+качеству на наборе для ретривала.
+
+Формат набора - JSONL, по строке на вопрос:
+    {"question": "...", "passages": ["...", "..."], "relevant": [0, 3]}
+
+Запуск:
+    python -m src.rag.benchmark_backends --dataset data/retrieval_set.jsonl [--output report.json]
+
+С --output метрики обоих бэкендов и их разница сохраняются в JSON.
+"""
+import argparse
+import json
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from src.rag.rag_service import RAGService
+
+BACKENDS = ["torch", "onnx"]
+
+
+def load_dataset(path: str) -> List[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9, None)
+
+
+def run_backend(backend: str, dataset: List[dict], k: int) -> Dict[str, object]:
+    started = time.perf_counter()
+    embedder, reranker = RAGService._create_models(backend)
+    load_s = time.perf_counter() - started
+
+    embed_s = 0.0
+    rerank_s = 0.0
+    texts = 0
+    pairs = 0
+    recall_hits = []
+    reciprocal_ranks = []
+    passage_vectors = []
+    rerank_scores = []
+
+    for item in dataset:
+        question, passages, relevant = item["question"], item["passages"], set(item["relevant"])
+
+        started = time.perf_counter()
+        vectors = np.array(embedder.embed_documents(passages), dtype=np.float32)
+        query = np.array(embedder.embed_query(question), dtype=np.float32)
+        embed_s += time.perf_counter() - started
+        texts += len(passages) + 1
+
+        similarities = _normalize(vectors) @ (query / max(np.linalg.norm(query), 1e-9))
+        top_k = set(np.argsort(-similarities)[:k].tolist())
+        recall_hits.append(len(top_k & relevant) / max(len(relevant), 1))
+        passage_vectors.append(vectors)
+
+        started = time.perf_counter()
+        scores = np.array(reranker.score([(question, p) for p in passages]), dtype=np.float32)
+        rerank_s += time.perf_counter() - started
+        pairs += len(passages)
+
+        ranking = np.argsort(-scores).tolist()
+        first_relevant = next((rank for rank, i in enumerate(ranking) if i in relevant), None)
+        reciprocal_ranks.append(1 / (first_relevant + 1) if first_relevant is not None else 0.0)
+        rerank_scores.append(scores)
+
+    return {
+        "load_s": load_s,
+        "embed_ms_per_text": 1000 * embed_s / max(texts, 1),
+        "rerank_ms_per_pair": 1000 * rerank_s / max(pairs, 1),
+        f"recall@{k}": float(np.mean(recall_hits)),
+        "rerank_mrr": float(np.mean(reciprocal_ranks)),
+        "_vectors": passage_vectors,
+        "_scores": rerank_scores,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", required=True)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--output", help="куда сохранить отчет в JSON")
+    args = parser.parse_args()
+
+    dataset = load_dataset(args.dataset)
+    results = {backend: run_backend(backend, dataset, args.k) for backend in BACKENDS}
+
+    metrics = [key for key in results[BACKENDS[0]] if not key.startswith("_")]
+    print(f"{'metric':<22}" + "".join(f"{b:>12}" for b in BACKENDS) + f"{'delta':>12}")
+    for metric in metrics:
+        values = [results[b][metric] for b in BACKENDS]
+        print(f"{metric:<22}" + "".join(f"{v:>12.4f}" for v in values) + f"{values[1] - values[0]:>+12.4f}")
+
+    # насколько квантованная модель расходится с исходной на тех же текстах
+    cosines = [np.sum(_normalize(a) * _normalize(b), axis=1).mean()
+               for a, b in zip(results["torch"]["_vectors"], results["onnx"]["_vectors"])]
+    score_diffs = [np.abs(a - b).mean()
+                   for a, b in zip(results["torch"]["_scores"], results["onnx"]["_scores"])]
+    print(f"\nmean cosine(torch, onnx) of passage embeddings: {np.mean(cosines):.4f}")
+    print(f"mean |torch - onnx| rerank score: {np.mean(score_diffs):.4f}")
+
+    if args.output:
+        report = {
+            "dataset": args.dataset,
+            "questions": len(dataset),
+            **{backend: {metric: results[backend][metric] for metric in metrics} for backend in BACKENDS},
+            "delta": {metric: results["onnx"][metric] - results["torch"][metric] for metric in metrics},
+            "mean_embedding_cosine": float(np.mean(cosines)),
+            "mean_rerank_score_diff": float(np.mean(score_diffs)),
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Report saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Калибровка порогов RelevanceGate по журналу решений (RAG_RELEVANCE_LOG).
+
+Метка строки журнала - поле "label" (true/false, ручная разметка), если оно
+есть, иначе ответ LLM ("llm_decision"). LLM спрашивается в неоднозначной
+полосе и на доле RAG_RELEVANCE_LLM_SAMPLE_RATE остальных запросов - без этой
+выборки разметка есть только внутри текущей полосы, и пороги сдвинуть наружу
+не получится.
+
+- reject: максимальный порог, ниже которого оказывается не больше
+  --max-false-reject релевантных запросов;
+- accept: минимальный порог, начиная с которого доля релевантных не меньше
+  --min-precision.
+
+Запуск:
+    python -m src.rag.calibrate_relevance [--log relevance_decisions.jsonl] [--write]
+"""
+import argparse
+import json
+from typing import List, Optional, Tuple
+
+from src.config.config import Config
+from src.rag.relevance_gate import ACCEPT, AMBIGUOUS, SCORE_SCALE, RelevanceGate
+
+
+def load_decisions(path: str) -> List[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def labeled_scores(records: List[dict]) -> List[Tuple[float, bool]]:
+    samples = []
+    for record in records:
+        # строки без шкалы записаны, когда torch-реранкер отдавал сырые логиты
+        if record.get("score_scale") != SCORE_SCALE:
+            continue
+        label = record.get("label", record.get("llm_decision"))
+        if label is not None and record.get("top_score") is not None:
+            samples.append((float(record["top_score"]), bool(label)))
+    return samples
+
+
+def reject_threshold(samples: List[Tuple[float, bool]], max_false_reject: float) -> float:
+    positives = sorted(score for score, label in samples if label)
+    if not positives:
+        return 0.0
+    # сколько релевантных можно отсечь, не превысив долю max_false_reject
+    allowed = int(max_false_reject * len(positives))
+    return positives[allowed]
+
+
+def accept_threshold(samples: List[Tuple[float, bool]], min_precision: float) -> Optional[float]:
+    ordered = sorted(samples, key=lambda s: -s[0])
+    best = None
+    positives = 0
+    for i, (score, label) in enumerate(ordered, start=1):
+        positives += label
+        # порог можно ставить только между разными оценками
+        if i < len(ordered) and ordered[i][0] == score:
+            continue
+        if positives / i >= min_precision:
+            best = score
+    return best
+
+
+def evaluate(gate: RelevanceGate, samples: List[Tuple[float, bool]], records: List[dict]) -> dict:
+    decisions = [gate.decide(score, tiebreak=False) == ACCEPT for score, _ in samples]
+    labels = [label for _, label in samples]
+    accepted = [label for decided, label in zip(decisions, labels) if decided]
+    return {
+        "accuracy": sum(d == l for d, l in zip(decisions, labels)) / len(samples) if samples else 0.0,
+        "precision": sum(accepted) / len(accepted) if accepted else 0.0,
+        "recall": sum(accepted) / sum(labels) if sum(labels) else 0.0,
+        # доля всех запросов, по которым все еще нужен вызов LLM
+        "llm_call_rate": sum(1 for r in records if r.get("top_score") is not None
+                             and gate.decide(r["top_score"]) == AMBIGUOUS) / max(len(records), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", default=Config.RAG_RELEVANCE_LOG)
+    parser.add_argument("--max-false-reject", type=float, default=0.02)
+    parser.add_argument("--min-precision", type=float, default=0.95)
+    parser.add_argument("--min-samples", type=int, default=50)
+    parser.add_argument("--output", default=Config.RAG_RELEVANCE_THRESHOLDS_FILE)
+    parser.add_argument("--write", action="store_true", help="сохранить пороги в --output")
+    args = parser.parse_args()
+
+    records = load_decisions(args.log)
+    samples = labeled_scores(records)
+    positives = sum(label for _, label in samples)
+    print(f"{len(records)} logged decisions, {len(samples)} labeled on the '{SCORE_SCALE}' scale "
+          f"({positives} relevant)")
+    if len(samples) < args.min_samples:
+        print(f"Not enough labeled decisions (need {args.min_samples}). "
+              f"Raise RAG_RELEVANCE_LLM_SAMPLE_RATE or label the log by hand.")
+        return
+
+    current = RelevanceGate.from_config()
+    reject = reject_threshold(samples, args.max_false_reject)
+    accept = accept_threshold(samples, args.min_precision)
+    if accept is None:
+        print(f"No threshold reaches precision {args.min_precision}; keeping accept at "
+              f"{current.accept_score:.4f}.")
+        accept = current.accept_score
+    accept = max(accept, reject)
+    calibrated = RelevanceGate(accept, reject)
+
+    print(f"\n{'':<12}{'accept':>10}{'reject':>10}{'accuracy':>10}{'precision':>10}"
+          f"{'recall':>10}{'llm rate':>10}")
+    for name, gate in (("current", current), ("calibrated", calibrated)):
+        stats = evaluate(gate, samples, records)
+        print(f"{name:<12}{gate.accept_score:>10.4f}{gate.reject_score:>10.4f}"
+              f"{stats['accuracy']:>10.3f}{stats['precision']:>10.3f}{stats['recall']:>10.3f}"
+              f"{stats['llm_call_rate']:>10.3f}")
+
+    if args.write:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"accept": accept, "reject": reject, "score_scale": SCORE_SCALE, "samples": len(samples),
+                       "min_precision": args.min_precision,
+                       "max_false_reject": args.max_false_reject}, f, indent=2)
+        print(f"\nSaved thresholds to '{args.output}'. Restart the server to apply them.")
+
+
+if __name__ == "__main__":
+    main()
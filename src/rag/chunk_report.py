@@ -0,0 +1,77 @@
+"""
+Отчет об обрезке чанков эмбеддером по уже проиндексированным чатам.
+
+Для каждого чата считается, сколько чанков не помещается в окно эмбеддера
+(EMBEDDING_MAX_TOKENS вместе со служебными токенами) и какая доля токенов не
+попала в вектор. Чаты с высокой долей стоит переиндексировать с делением
+по токенам (RAG_CHUNK_TOKENS).
+
+Запуск:
+    python -m src.rag.chunk_report [--min-rate 0.1]
+"""
+import argparse
+from typing import Dict, List
+
+from src.rag.chunk_store import ChunkStore
+from src.rag.maintenance import indexed_chat_ids
+from src.rag.rag_service import EMBEDDING_MAX_TOKENS, RAG_INDEXES_DIR, load_embedding_tokenizer
+from src.rag.snapshots import ChatSnapshots
+
+BATCH_SIZE = 256
+
+
+def chat_chunk_stores() -> Dict[int, ChunkStore]:
+    # текущее хранилище чанков каждого чата (после компакции оно меняется)
+    stores = {}
+    for chat_id in indexed_chat_ids(RAG_INDEXES_DIR):
+        chunk_store = ChunkStore(ChatSnapshots(RAG_INDEXES_DIR, chat_id).current().chunks_base)
+        if chunk_store.exists():
+            stores[chat_id] = chunk_store
+    return stores
+
+
+def truncation_stats(chunk_store: ChunkStore, tokenizer) -> dict:
+    chunks = truncated_chunks = tokens = truncated_tokens = 0
+    total = len(chunk_store)
+    for start in range(0, total, BATCH_SIZE):
+        texts = [chunk.page_content for chunk in
+                 chunk_store.read_range(start, min(start + BATCH_SIZE, total))]
+        lengths: List[int] = [len(ids) for ids in tokenizer(texts)["input_ids"]]
+        for length in lengths:
+            chunks += 1
+            tokens += length
+            if length > EMBEDDING_MAX_TOKENS:
+                truncated_chunks += 1
+                truncated_tokens += length - EMBEDDING_MAX_TOKENS
+    return {
+        "chunks": chunks,
+        "avg_tokens": tokens / chunks if chunks else 0.0,
+        "truncated_chunks": truncated_chunks,
+        "truncated_chunk_rate": truncated_chunks / chunks if chunks else 0.0,
+        "truncated_token_rate": truncated_tokens / tokens if tokens else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--min-rate", type=float, default=0.1,
+                        help="доля обрезанных токенов, начиная с которой чат стоит переиндексировать")
+    args = parser.parse_args()
+
+    tokenizer = load_embedding_tokenizer()
+    print(f"{'chat':>8}{'chunks':>10}{'avg tok':>10}{'trunc ch':>10}{'ch rate':>10}{'tok rate':>10}")
+    to_rechunk = []
+    for chat_id, chunk_store in chat_chunk_stores().items():
+        stats = truncation_stats(chunk_store, tokenizer)
+        print(f"{chat_id:>8}{stats['chunks']:>10}{stats['avg_tokens']:>10.1f}"
+              f"{stats['truncated_chunks']:>10}{stats['truncated_chunk_rate']:>10.3f}"
+              f"{stats['truncated_token_rate']:>10.3f}")
+        if stats["truncated_token_rate"] >= args.min_rate:
+            to_rechunk.append(chat_id)
+
+    print(f"\nwindow: {EMBEDDING_MAX_TOKENS} tokens; "
+          f"chats with truncated token rate >= {args.min_rate}: {to_rechunk or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import mmap
+import os
+import pickle
+import struct
+from typing import Iterable, Iterator, List, Tuple
+
+from langchain_core.documents import Document
+
+from src.utlis.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+class ChunkStore:
+    """
+    Append-only хранилище чанков чата.
+
+    - ``<base>.log`` - подряд записанные сериализованные чанки;
+    - ``<base>.idx`` - записи фиксированной длины (offset, length), номер записи
+      совпадает с порядковым id чанка (и с позицией вектора в FAISS).
+
+    Добавление документа дописывает только новые чанки, а чтение идет через
+    mmap и десериализует лишь запрошенные записи.
+    """
+
+    RECORD = struct.Struct("<QI")
+
+    def __init__(self, base_path: str):
+        self.log_path = base_path + ".log"
+        self.idx_path = base_path + ".idx"
+
+    def exists(self) -> bool:
+        return os.path.exists(self.idx_path)
+
+    def __len__(self) -> int:
+        try:
+            return os.path.getsize(self.idx_path) // self.RECORD.size
+        except FileNotFoundError:
+            return 0
+
+    def append(self, chunks: List[Document]) -> Tuple[int, int]:
+        """Дописывает чанки в конец хранилища и возвращает диапазон их id [start, end)."""
+        start = len(self)
+        if not chunks:
+            return start, start
+
+        records = []
+        with open(self.log_path, "ab") as log:
+            offset = log.tell()
+            for chunk in chunks:
+                data = pickle.dumps(chunk, protocol=pickle.HIGHEST_PROTOCOL)
+                log.write(data)
+                records.append(self.RECORD.pack(offset, len(data)))
+                offset += len(data)
+            log.flush()
+            os.fsync(log.fileno())
+
+        # индекс пишем после данных: читатель видит только полностью записанные чанки
+        with open(self.idx_path, "ab") as idx:
+            idx.write(b"".join(records))
+            idx.flush()
+            os.fsync(idx.fileno())
+
+        end = start + len(chunks)
+        logger.info(
+            f"Appended chunks [{start}, {end}) to chunk store '{self.log_path}'.")
+        return start, end
+
+    def truncate(self, count: int) -> int:
+        """
+        Отбрасывает чанки с id >= count (и недописанную запись индекса) -
+        хвост индексации, которая упала до публикации снимка. Возвращает
+        число отброшенных чанков.
+        """
+        if not self.exists():
+            return 0
+        total = len(self)
+        if total <= count and os.path.getsize(self.idx_path) == total * self.RECORD.size:
+            return 0
+        count = min(count, total)
+        log_end = 0
+        if count:
+            with open(self.idx_path, "rb") as idx:
+                idx.seek((count - 1) * self.RECORD.size)
+                offset, length = self.RECORD.unpack(idx.read(self.RECORD.size))
+                log_end = offset + length
+
+        # сначала индекс: читатель не должен увидеть запись без данных
+        for path, size in ((self.idx_path, count * self.RECORD.size), (self.log_path, log_end)):
+            with open(path, "r+b") as f:
+                f.truncate(size)
+                f.flush()
+                os.fsync(f.fileno())
+        logger.warning(
+            f"Truncated chunk store '{self.log_path}' from {total} to {count} chunks.")
+        return total - count
+
+    def read(self, ids: Iterable[int]) -> List[Document]:
+        ids = list(ids)
+        if not ids or not self.exists():
+            return []
+        reader = self.reader()
+        try:
+            return reader.read(ids)
+        finally:
+            reader.close()
+
+    def reader(self) -> "ChunkStoreReader":
+        """Постоянное отображение уже записанных чанков - для многих чтений подряд."""
+        return ChunkStoreReader(self)
+
+    def read_range(self, start: int, end: int) -> List[Document]:
+        return self.read(range(start, end))
+
+    def __iter__(self) -> Iterator[Document]:
+        total = len(self)
+        batch_size = 512
+        for start in range(0, total, batch_size):
+            yield from self.read_range(start, min(start + batch_size, total))
+
+
+class ChunkStoreReader:
+    """
+    Чтение хранилища через mmap .idx и .log, отображенные один раз при
+    открытии. Видны чанки, записанные до открытия: хранилище только
+    дописывается, а отбрасывается (truncate) лишь неопубликованный хвост,
+    который читатели опубликованного снимка не запрашивают.
+    """
+
+    def __init__(self, store: ChunkStore):
+        self.count = 0
+        self._idx = None
+        self._data = None
+        with open(store.idx_path, "rb") as idx, open(store.log_path, "rb") as log:
+            count = os.fstat(idx.fileno()).st_size // ChunkStore.RECORD.size
+            if count and os.fstat(log.fileno()).st_size:
+                # отображения остаются валидными и после закрытия файлов
+                self._idx = mmap.mmap(idx.fileno(), count * ChunkStore.RECORD.size, access=mmap.ACCESS_READ)
+                self._data = mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ)
+                self.count = count
+
+    def read(self, ids: Iterable[int]) -> List[Document]:
+        chunks = []
+        for chunk_id in ids:
+            if not 0 <= chunk_id < self.count:
+                raise IndexError(f"Chunk {chunk_id} is out of range [0, {self.count})")
+            offset, length = ChunkStore.RECORD.unpack_from(self._idx, chunk_id * ChunkStore.RECORD.size)
+            chunks.append(pickle.loads(self._data[offset:offset + length]))
+        return chunks
+
+    def close(self) -> None:
+        for mapping in (self._idx, self._data):
+            if mapping is not None:
+                mapping.close()
+        self._idx = self._data = None
+        self.count = 0
@@ -0,0 +1,180 @@
+import re
+import sqlite3
+import threading
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.utlis.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# простое число больше 2^32: хэши шинглов (crc32) меньше него
+_PRIME = np.uint64(4294967311)
+
+_stats = {"chunks": 0, "duplicates": 0, "bytes_saved": 0}
+_stats_lock = threading.Lock()
+
+
+def _shingles(text: str, size: int) -> np.ndarray:
+    """Хэши пословных n-грамм нормализованного текста."""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return np.array(sorted({zlib.crc32(gram.encode("utf-8")) for gram in grams}), dtype=np.uint64)
+
+
+class MinHasher:
+    """MinHash-сигнатуры текстов: num_perm хэш-функций вида (a*x + b) mod p."""
+
+    def __init__(self, num_perm: int, shingle_size: int, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        # a < 2^31, x < 2^32: произведение помещается в uint64
+        self.a = rng.integers(1, 2 ** 31, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 2 ** 31, size=num_perm, dtype=np.uint64)
+        self.shingle_size = shingle_size
+
+    def signature(self, text: str) -> np.ndarray:
+        shingles = _shingles(text, self.shingle_size)
+        hashes = (shingles[:, None] * self.a + self.b) % _PRIME
+        return hashes.min(axis=0).astype(np.uint32)
+
+
+class NearDuplicateIndex:
+    """
+    LSH-индекс MinHash-сигнатур чанков чата (SQLite).
+
+    Сигнатура режется на bands полос; чанки, совпавшие хотя бы в одной полосе,
+    становятся кандидатами, и дубликатом считается кандидат с оценкой
+    сходства Жаккара (доля совпавших значений сигнатуры) не ниже threshold.
+    """
+
+    def __init__(self, db_path: str, num_perm: int, bands: int, threshold: float,
+                 shingle_size: int):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+        self.db_path = db_path
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm, shingle_size)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS signatures (chunk_id INTEGER PRIMARY KEY, signature BLOB NOT NULL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (band INTEGER NOT NULL, bucket INTEGER NOT NULL, "
+                "chunk_id INTEGER NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS buckets_key ON buckets (band, bucket)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _band_keys(self, signature: np.ndarray) -> List[int]:
+        return [zlib.crc32(signature[band * self.rows:(band + 1) * self.rows].tobytes())
+                for band in range(self.bands)]
+
+    def _similarity(self, a: np.ndarray, b: np.ndarray) -> float:
+        return float(np.mean(a == b))
+
+    def deduplicate(self, texts: List[str], next_id: int) -> Tuple[List[int], List[bool], list]:
+        """
+        Сопоставляет новые тексты с уже сохраненными чанками чата и друг с другом.
+
+        Возвращает id чанка для каждого текста (существующий - для дубликата,
+        новый, начиная с next_id по порядку, - для оригинала), флаги "новый" и
+        сигнатуры новых чанков для add() после их сохранения.
+        """
+        signatures = [self.hasher.signature(text) for text in texts]
+        chunk_ids, is_new, new_signatures = [], [], []
+        # новые чанки этого вызова еще не в базе - ищем среди них в памяти
+        pending: Dict[Tuple[int, int], List[int]] = {}
+        pending_signatures: Dict[int, np.ndarray] = {}
+
+        with self._connect() as conn:
+            for signature in signatures:
+                keys = self._band_keys(signature)
+                duplicate = self._find(conn, signature, keys, pending, pending_signatures)
+                if duplicate is not None:
+                    chunk_ids.append(duplicate)
+                    is_new.append(False)
+                    continue
+                chunk_id = next_id + len(new_signatures)
+                for band, key in enumerate(keys):
+                    pending.setdefault((band, key), []).append(chunk_id)
+                pending_signatures[chunk_id] = signature
+                new_signatures.append((chunk_id, signature))
+                chunk_ids.append(chunk_id)
+                is_new.append(True)
+        return chunk_ids, is_new, new_signatures
+
+    def _find(self, conn, signature, keys, pending, pending_signatures) -> Optional[int]:
+        candidates = set()
+        for band, key in enumerate(keys):
+            candidates.update(pending.get((band, key), ()))
+            candidates.update(row[0] for row in conn.execute(
+                "SELECT chunk_id FROM buckets WHERE band = ? AND bucket = ?", (band, key)))
+
+        best, best_similarity = None, self.threshold
+        for chunk_id in sorted(candidates):
+            other = pending_signatures.get(chunk_id)
+            if other is None:
+                row = conn.execute(
+                    "SELECT signature FROM signatures WHERE chunk_id = ?", (chunk_id,)).fetchone()
+                if row is None:
+                    continue
+                other = np.frombuffer(row[0], dtype=np.uint32)
+            similarity = self._similarity(signature, other)
+            if similarity >= best_similarity:
+                best, best_similarity = chunk_id, similarity
+                if similarity == 1.0:
+                    break
+        return best
+
+    def add(self, signatures: list, replace_all: bool = False) -> None:
+        """
+        Сохраняет сигнатуры записанных чанков: [(chunk_id, signature), ...].
+        replace_all - в той же транзакции удалить все прежние (для компакции).
+        """
+        if not signatures and not replace_all:
+            return
+        with self._connect() as conn:
+            if replace_all:
+                conn.execute("DELETE FROM signatures")
+                conn.execute("DELETE FROM buckets")
+            conn.executemany(
+                "INSERT OR REPLACE INTO signatures (chunk_id, signature) VALUES (?, ?)",
+                [(chunk_id, signature.tobytes()) for chunk_id, signature in signatures])
+            conn.executemany(
+                "INSERT INTO buckets (band, bucket, chunk_id) VALUES (?, ?, ?)",
+                [(band, key, chunk_id) for chunk_id, signature in signatures
+                 for band, key in enumerate(self._band_keys(signature))])
+
+    def count(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT count(*) FROM signatures").fetchone()[0]
+
+    def truncate(self, count: int) -> int:
+        """Удаляет сигнатуры чанков с id >= count (не попавших в опубликованный снимок)."""
+        with self._connect() as conn:
+            deleted = conn.execute("DELETE FROM signatures WHERE chunk_id >= ?", (count,)).rowcount
+            conn.execute("DELETE FROM buckets WHERE chunk_id >= ?", (count,))
+        return deleted
+
+
+def record_dedup(chunks: int, duplicates: int, bytes_saved: int) -> None:
+    with _stats_lock:
+        _stats["chunks"] += chunks
+        _stats["duplicates"] += duplicates
+        _stats["bytes_saved"] += bytes_saved
+
+
+def dedup_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["duplicate_rate"] = stats["duplicates"] / stats["chunks"] if stats["chunks"] else 0.0
+    return stats
@@ -0,0 +1,151 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from src.utlis.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# SQLite ограничивает число параметров в одном запросе
+_SQL_BATCH_SIZE = 500
+
+
+class EmbeddingCache:
+    """
+    Дисковый кэш эмбеддингов (SQLite), общий для всех чатов.
+    Ключ - хэш (имя модели, текст чанка). При превышении max_entries
+    удаляются давно не использованные записи; размер проверяется не на каждой
+    записи, а раз в ~1% max_entries записанных векторов, так что кэш может
+    ненадолго превысить лимит на эту величину.
+    """
+
+    def __init__(self, db_path: str, max_entries: int):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._evict_every = max(1, max_entries // 100)
+        self._lock = threading.Lock()
+        # записано с последней проверки размера (в этом процессе); первая запись проверяет сразу
+        self._written = self._evict_every
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Соединение на одну транзакцию: коммит (или откат) и закрытие на выходе."""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        now = time.time()
+        with self._connect() as conn:
+            for i in range(0, len(keys), _SQL_BATCH_SIZE):
+                batch = keys[i:i + _SQL_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+                if rows:
+                    conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})",
+                        [now, *batch])
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                for key, vector in items.items()]
+        with self._lock:
+            self._written += len(rows)
+            check_size = self._written >= self._evict_every
+            if check_size:
+                self._written = 0
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                rows)
+            if not check_size:
+                return
+            total = conn.execute("SELECT count(*) FROM embeddings").fetchone()[0]
+            if total > self.max_entries:
+                conn.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    "SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (total - self.max_entries,))
+                logger.info(
+                    f"Evicted {total - self.max_entries} entries from embedding cache.")
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Обертка над моделью эмбеддингов: тексты, которые уже встречались
+    (в любом чате), берутся из EmbeddingCache, в модель уходят только промахи.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model_name: str):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(
+            f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        cached = self.cache.get_many(list(dict.fromkeys(keys)))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+
+        with self._lock:
+            self.hits += len(texts) - sum(1 for key in keys if key in missing)
+            self.misses += sum(1 for key in keys if key in missing)
+
+        if missing:
+            logger.info(
+                f"Embedding cache: {len(texts) - len(missing)} hits, "
+                f"{len(missing)} texts to embed.")
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(computed)
+            cached.update(computed)
+
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "max_entries": self.cache.max_entries,
+            }
@@ -0,0 +1,116 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from src.utlis.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+class _EmbedRequest:
+    __slots__ = ("texts", "future")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.future: Future = Future()
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Общий для процесса планировщик эмбеддингов с динамическим микро-батчингом.
+
+    Вызовы embed_documents/embed_query из разных потоков попадают в очередь;
+    один фоновый поток собирает их до max_batch_size текстов или до истечения
+    max_wait_ms с момента первого запроса, прогоняет модель одним батчем и
+    раздает результаты вызывающим. Модель всегда работает в одном потоке, так
+    что параллельные чаты не делят между собой потоки torch.
+
+    Предполагается, что у модели embed_query(text) == embed_documents([text])[0]
+    (так у sentence-transformers без инструкций).
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch_size: int, max_wait_ms: float):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000
+        self._queue: "queue.Queue[_EmbedRequest]" = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.texts = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self._submit(list(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._submit([text])[0]
+
+    def _submit(self, texts: List[str]) -> List[List[float]]:
+        if self._worker is None:
+            with self._start_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(
+                        target=self._run, name="embedding-scheduler", daemon=True)
+                    self._worker.start()
+        request = _EmbedRequest(texts)
+        self._queue.put(request)
+        return request.future.result()
+
+    def _collect_batch(self) -> List[_EmbedRequest]:
+        first = self._queue.get()
+        batch = [first]
+        size = len(first.texts)
+        deadline = time.monotonic() + self.max_wait_s
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            texts = [text for request in batch for text in request.texts]
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+            except Exception as e:
+                logger.error(f"Embedding batch of {len(texts)} texts failed: {e}")
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            offset = 0
+            for request in batch:
+                request.future.set_result(vectors[offset:offset + len(request.texts)])
+                offset += len(request.texts)
+
+            with self._stats_lock:
+                self.batches += 1
+                self.requests += len(batch)
+                self.texts += len(texts)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "batches": self.batches,
+                "requests": self.requests,
+                "texts": self.texts,
+                "avg_requests_per_batch": self.requests / self.batches if self.batches else 0.0,
+                "avg_batch_size": self.texts / self.batches if self.batches else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_s * 1000,
+            }
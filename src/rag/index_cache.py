@@ -0,0 +1,119 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from src.config.config import Config
+from src.utlis.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+def estimate_vector_store_size(vector_store) -> int:
+    """
+    Грубая оценка памяти, занимаемой загруженным FAISS-хранилищем (в байтах):
+    коды векторов + тексты чанков в docstore.
+    """
+    size = 0
+    index = getattr(vector_store, "index", None)
+    if index is not None:
+        try:
+            code_size = index.sa_code_size()
+        except Exception:
+            code_size = index.d * 4
+        size += index.ntotal * code_size
+
+    docstore = getattr(vector_store, "docstore", None)
+    docs = getattr(docstore, "_dict", None)
+    if docs:
+        for doc in docs.values():
+            # page_content + примерный оверхед на объект и metadata
+            size += len(doc.page_content) + 256
+    return size
+
+
+class IndexCache:
+    """
+    Процессный LRU-кэш загруженных FAISS-индексов, ключ - chat_id.
+
+    Каждая запись хранит токен версии (например, mtime файла индекса):
+    если индекс на диске изменился (в том числе другим воркером), запись
+    считается устаревшей и выбрасывается при следующем обращении.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, chat_id: Hashable, token: Any) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            vector_store, entry_token, size = entry
+            if entry_token != token:
+                self._drop(chat_id)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(chat_id)
+            self.hits += 1
+            return vector_store
+
+    def put(self, chat_id: Hashable, vector_store: Any, token: Any,
+            size: Optional[int] = None) -> None:
+        if size is None:
+            size = estimate_vector_store_size(vector_store)
+        with self._lock:
+            if chat_id in self._entries:
+                self._drop(chat_id)
+            if size > self.max_bytes:
+                logger.warning(
+                    f"Index for chat {chat_id} (~{size} bytes) exceeds cache budget "
+                    f"({self.max_bytes} bytes). Not caching.")
+                return
+            self._entries[chat_id] = (vector_store, token, size)
+            self._size += size
+            while self._size > self.max_bytes and self._entries:
+                evicted_id, _ = next(iter(self._entries.items()))
+                self._drop(evicted_id)
+                self.evictions += 1
+                logger.info(f"Evicted index for chat {evicted_id} from cache.")
+
+    def invalidate(self, chat_id: Hashable) -> None:
+        with self._lock:
+            if chat_id in self._entries:
+                self._drop(chat_id)
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _drop(self, chat_id: Hashable) -> None:
+        _, _, size = self._entries.pop(chat_id)
+        self._size -= size
+
+
+index_cache = IndexCache(max_bytes=Config.RAG_INDEX_CACHE_MB * 1024 * 1024)
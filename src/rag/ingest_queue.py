@@ -0,0 +1,244 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+import requests
+
+from src.config.config import Config
+from src.utlis.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+DOWNLOADS_DIR = "downloads"
+
+# RAGService внутри процесса-воркера (создается один раз в initializer)
+_worker_rag_service = None
+
+
+class IngestQueueFull(Exception):
+    """Очередь индексации переполнена, задачу нужно повторить позже."""
+
+
+class IngestJobFailed(Exception):
+    """Задача индексации завершилась с ошибкой."""
+
+
+def _init_worker():
+    global _worker_rag_service
+    from src.rag.rag_service import RAGService
+    _worker_rag_service = RAGService()
+
+
+def _run_ingest_job(job_id: str, chat_id: int, file_url: str, file_name: str, progress) -> list:
+    """Скачивает документ и индексирует его. Выполняется в процессе-воркере."""
+    progress[job_id] = {"stage": "downloading"}
+    download_dir = os.path.join(DOWNLOADS_DIR, f"chat_{chat_id}")
+    os.makedirs(download_dir, exist_ok=True)
+    file_path = os.path.join(download_dir, file_name)
+    # качаем во временный файл задачи: оборванная загрузка не оставит
+    # недописанный документ на месте готового
+    part_path = f"{file_path}.{job_id}.part"
+
+    logger.info(f"[ingest {job_id}] Submitting POST request to {file_url} to trigger download.")
+    try:
+        with requests.post(file_url, stream=True, timeout=120) as r:
+            r.raise_for_status()
+            with open(part_path, 'wb') as f:
+                for chunk in r.iter_content(chunk_size=8192):
+                    f.write(chunk)
+        os.replace(part_path, file_path)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+    progress[job_id] = {"stage": "indexing"}
+    logger.info(f"[ingest {job_id}] Saved document to {file_path}. Now indexing.")
+    new_chunks = _worker_rag_service.add_document_to_index(file_path, chat_id)
+    progress[job_id] = {"stage": "done", "chunks": len(new_chunks)}
+    return new_chunks
+
+
+class IngestionQueue:
+    """
+    Очередь фоновой индексации документов.
+
+    Задачи выполняются пулом отдельных процессов, поэтому тяжелая загрузка и
+    эмбеддинг больших файлов не занимают event loop и потоки API. Число
+    ожидающих задач ограничено max_pending. Если воркер умер (например, по
+    нехватке памяти), пул пересоздается при следующей задаче. Повторная
+    отправка документа, который еще индексируется, возвращает id уже идущей
+    задачи.
+
+    Статус задач хранится в памяти процесса API: при нескольких воркерах
+    uvicorn GET /ingest/{job_id} нужно направлять в тот же процесс.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, job_ttl_s: int, wait_timeout_s: float):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.job_ttl_s = job_ttl_s
+        self.wait_timeout_s = wait_timeout_s
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+        self._progress = None
+        self._jobs: Dict[str, dict] = {}
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # пул поднимается лениво, чтобы импорт модуля не порождал процессы
+        if self._executor is None:
+            ctx = multiprocessing.get_context("spawn")
+            if self._manager is None:
+                self._manager = ctx.Manager()
+                self._progress = self._manager.dict()
+            self._executor = self._create_executor(ctx)
+            logger.info(f"Started ingestion pool with {self.max_workers} workers.")
+
+    def _create_executor(self, ctx):
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers, mp_context=ctx, initializer=_init_worker)
+
+    def _submit_job(self, *args) -> Future:
+        try:
+            return self._executor.submit(_run_ingest_job, *args)
+        except BrokenProcessPool:
+            # воркер пула умер - такой пул больше не принимает задачи
+            logger.warning("Ingestion pool is broken. Starting a new one.")
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._ensure_started()
+            return self._executor.submit(_run_ingest_job, *args)
+
+    def submit(self, chat_id: int, file_url: str, file_name: str) -> str:
+        with self._lock:
+            self._prune_finished()
+            pending = [job for job in self._jobs.values() if job["status"] in ("queued", "running")]
+            for job in pending:
+                if job["chat_id"] == chat_id and job["file_name"] == file_name:
+                    logger.info(
+                        f"'{file_name}' in chat {chat_id} is already being indexed by job {job['job_id']}.")
+                    return job["job_id"]
+            if len(pending) >= self.max_pending:
+                raise IngestQueueFull(
+                    f"Ingestion queue is full ({len(pending)} pending jobs)")
+
+            self._ensure_started()
+            job_id = uuid.uuid4().hex
+            # задача появляется в очереди, только если пул ее принял
+            future = self._submit_job(job_id, chat_id, file_url, file_name, self._progress)
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "chat_id": chat_id,
+                "file_name": file_name,
+                "status": "queued",
+                "chunks": None,
+                "error": None,
+                "created_at": time.time(),
+                "finished_at": None,
+            }
+            self._futures[job_id] = future
+
+        future.add_done_callback(lambda f: self._on_done(job_id, f))
+        logger.info(f"Queued ingestion job {job_id} for '{file_name}' in chat {chat_id}.")
+        return job_id
+
+    def _on_done(self, job_id: str, future: Future):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["finished_at"] = time.time()
+            if future.cancelled():
+                job["status"] = "failed"
+                job["error"] = "cancelled on shutdown"
+                return
+            error = future.exception()
+            if error is not None:
+                job["status"] = "failed"
+                job["error"] = str(error)
+                logger.error(f"Ingestion job {job_id} failed: {error}")
+            else:
+                job["status"] = "done"
+                job["chunks"] = len(future.result())
+                logger.info(f"Ingestion job {job_id} finished with {job['chunks']} chunks.")
+
+    def get_status(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            status = dict(job)
+        progress = self._progress.get(job_id) if self._progress is not None else None
+        status["stage"] = progress["stage"] if progress else status["status"]
+        if status["status"] == "queued" and progress:
+            status["status"] = "running"
+        return status
+
+    async def wait(self, job_id: str, timeout: Optional[float] = None) -> List:
+        """
+        Ожидает завершения задачи (не дольше timeout, по умолчанию
+        wait_timeout_s) и возвращает новые чанки документа. По таймауту
+        бросает asyncio.TimeoutError, а задача продолжает выполняться.
+        """
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is None:
+            raise KeyError(job_id)
+        if timeout is None:
+            timeout = self.wait_timeout_s
+        try:
+            # shield: отмена ожидания не должна отменять саму задачу
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+        except asyncio.TimeoutError:
+            raise
+        except Exception as e:
+            raise IngestJobFailed(str(e)) from e
+
+    def shutdown(self, wait: bool = True):
+        """
+        Останавливает пул и процесс Manager. Задачи, еще стоящие в очереди,
+        отменяются; с wait=True дожидается уже выполняющихся.
+        """
+        with self._lock:
+            executor, manager = self._executor, self._manager
+            self._executor = self._manager = self._progress = None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+        if manager is not None:
+            manager.shutdown()
+        logger.info("Ingestion pool stopped.")
+
+    def stats(self) -> dict:
+        with self._lock:
+            statuses = [job["status"] for job in self._jobs.values()]
+        return {
+            "started": self._executor is not None,
+            "workers": self.max_workers,
+            "max_pending": self.max_pending,
+            **{status: statuses.count(status) for status in ("queued", "running", "done", "failed")},
+        }
+
+    def _prune_finished(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["finished_at"] and now - job["finished_at"] > self.job_ttl_s]
+        for job_id in expired:
+            self._jobs.pop(job_id, None)
+            self._futures.pop(job_id, None)
+            if self._progress is not None:
+                self._progress.pop(job_id, None)
+
+
+ingestion_queue = IngestionQueue(
+    max_workers=Config.RAG_INGEST_WORKERS,
+    max_pending=Config.RAG_INGEST_MAX_PENDING,
+    job_ttl_s=Config.RAG_INGEST_JOB_TTL_S,
+    wait_timeout_s=Config.RAG_INGEST_WAIT_TIMEOUT_S,
+)
@@ -0,0 +1,152 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from src.utlis.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class LexicalIndex:
+    """
+    Персистентный BM25-индекс чата поверх SQLite FTS5.
+
+    Чанки токенизируются один раз при добавлении, а запрос ранжируется
+    встроенной функцией bm25(), поэтому стоимость поиска не зависит от того,
+    сколько документов уже лежит в чате.
+
+    rowid строки - id чанка + 1 (rowid в SQLite по умолчанию начинается с 1),
+    так что по найденной строке известна позиция ее вектора в FAISS.
+
+    Объект открывает уже созданную базу (см. build) и держит по соединению
+    для чтения на поток, поэтому его стоит переиспользовать между запросами.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._readers = threading.local()
+
+    @staticmethod
+    def _create_schema(db_path: str) -> None:
+        conn = sqlite3.connect(db_path, timeout=30)
+        try:
+            # режим WAL хранится в файле базы - включать его на каждом соединении не нужно
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                conn.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5("
+                    "content, metadata UNINDEXED, "
+                    "tokenize = 'unicode61 remove_diacritics 2')")
+        finally:
+            conn.close()
+
+    @classmethod
+    def build(cls, db_path: str, documents: Iterable[Document]) -> "LexicalIndex":
+        """
+        Строит индекс из чанков (id с 0) во временном файле и атомарно кладет его
+        на место db_path: читатель не увидит полупостроенную базу.
+        """
+        tmp_path = db_path + ".tmp"
+        for path in (tmp_path, tmp_path + "-wal", tmp_path + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+        cls._create_schema(tmp_path)
+        # последнее закрытое соединение переносит WAL в сам файл базы и удаляет -wal
+        cls(tmp_path).add_documents(documents, 0)
+        os.replace(tmp_path, db_path)
+        return cls(db_path)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Соединение на одну транзакцию: коммит (или откат) и закрытие на выходе."""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _reader(self) -> sqlite3.Connection:
+        """Соединение потока для чтения: в WAL каждый запрос видит последние коммиты."""
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            self._readers.conn = conn
+        return conn
+
+    @staticmethod
+    def _rows(documents: Iterable[Document], start_id: int):
+        for chunk_id, doc in enumerate(documents, start=start_id):
+            yield chunk_id + 1, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False, default=str)
+
+    def add_documents(self, documents: Iterable[Document], start_id: int) -> None:
+        """Добавляет чанки с id start_id, start_id + 1, ..."""
+        rows = list(self._rows(documents, start_id))
+        if not rows:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO chunks (rowid, content, metadata) VALUES (?, ?, ?)", rows)
+        logger.info(f"Added {len(rows)} chunks to lexical index '{self.db_path}'.")
+
+    def replace_all(self, documents: Iterable[Document]) -> None:
+        """Заменяет все содержимое индекса одной транзакцией (для компакции)."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM chunks")
+            conn.executemany(
+                "INSERT INTO chunks (rowid, content, metadata) VALUES (?, ?, ?)", self._rows(documents, 0))
+
+    def count(self) -> int:
+        return self._reader().execute("SELECT count(*) FROM chunks").fetchone()[0]
+
+    def truncate(self, count: int) -> int:
+        """Удаляет чанки с id >= count."""
+        with self._connect() as conn:
+            deleted = conn.execute("DELETE FROM chunks WHERE rowid > ?", (count,)).rowcount
+        if deleted:
+            logger.warning(f"Removed {deleted} unpublished chunks from lexical index '{self.db_path}'.")
+        return deleted
+
+    def search(self, query: str, k: int = 4) -> List[Document]:
+        return [doc for _, doc in self.search_with_ids(query, k)]
+
+    def search_with_ids(self, query: str, k: int = 4) -> List[Tuple[int, Document]]:
+        """Как search, но вместе с id чанков: [(chunk_id, чанк), ...]."""
+        match = self._build_match_query(query)
+        if not match:
+            return []
+        rows = self._reader().execute(
+            "SELECT rowid, content, metadata FROM chunks WHERE chunks MATCH ? "
+            "ORDER BY bm25(chunks) LIMIT ?", (match, k)).fetchall()
+        return [(rowid - 1, Document(page_content=content, metadata=json.loads(metadata)))
+                for rowid, content, metadata in rows]
+
+    @staticmethod
+    def _build_match_query(query: str) -> str:
+        # Каждый токен берем в кавычки, чтобы FTS5 не воспринимал
+        # пользовательский текст как собственный синтаксис (AND, NEAR, * ...)
+        tokens = dict.fromkeys(token.lower() for token in _TOKEN_RE.findall(query))
+        return " OR ".join(f'"{token}"' for token in tokens)
+
+
+class LexicalRetriever(BaseRetriever):
+    """Обертка LexicalIndex для использования внутри EnsembleRetriever."""
+
+    index: LexicalIndex
+    k: int = 4
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def _get_relevant_documents(
+            self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.index.search(query, k=self.k)
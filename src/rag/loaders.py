@@ -0,0 +1,178 @@
+import re
+import threading
+import time
+import zipfile
+from typing import Callable, Dict, Iterator, List, Optional
+
+from langchain_core.documents import Document
+
+from src.config.config import Config
+from src.utlis.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# размер блока (в символах), которым отдается простой текст
+TEXT_SECTION_CHARS = 64 * 1024
+# сколько первых страниц PDF проверяется на наличие текстового слоя
+PDF_PROBE_PAGES = 3
+
+LoaderFn = Callable[[str], Iterator[Document]]
+ProbeFn = Callable[[str], bool]
+
+
+class _RegisteredLoader:
+    def __init__(self, name: str, load: LoaderFn, probe: Optional[ProbeFn]):
+        self.name = name
+        self.load = load
+        self.probe = probe
+
+
+# расширение -> загрузчики в порядке приоритета (последний - запасной)
+_REGISTRY: Dict[str, List[_RegisteredLoader]] = {}
+_stats: Dict[str, dict] = {}
+_stats_lock = threading.Lock()
+
+
+def register_loader(name: str, extensions: List[str], probe: Optional[ProbeFn] = None):
+    """
+    Регистрирует загрузчик для расширений. Если задан probe, загрузчик
+    используется только когда probe(file_path) вернул True, иначе очередь
+    переходит к следующему зарегистрированному загрузчику.
+    """
+    def decorator(load: LoaderFn) -> LoaderFn:
+        for extension in extensions:
+            _REGISTRY.setdefault(extension, []).append(
+                _RegisteredLoader(name, load, probe))
+        return load
+    return decorator
+
+
+def supported_extensions() -> List[str]:
+    return list(_REGISTRY)
+
+
+def _select_loader(file_path: str, extension: str) -> _RegisteredLoader:
+    for loader in _REGISTRY[extension]:
+        if loader.probe is None:
+            return loader
+        try:
+            if loader.probe(file_path):
+                return loader
+        except Exception as e:
+            logger.warning(f"Probe of loader '{loader.name}' failed for {file_path}: {e}")
+    raise ValueError(f"No loader accepted {file_path}")
+
+
+def iter_documents(file_path: str) -> Iterator[Document]:
+    """
+    Лениво читает файл подходящим загрузчиком из реестра и пишет в лог и
+    статистику, сколько заняла загрузка. Считается только время самого
+    загрузчика (выбор и чтение секций), без обработки секций потребителем;
+    статистика пишется, даже если потребитель остановился раньше или упал.
+    """
+    extension = "." + file_path.rsplit(".", 1)[-1].lower()
+    if extension not in _REGISTRY:
+        raise ValueError(f"Unsupported file type: {file_path}")
+
+    started = time.perf_counter()
+    loader = _select_loader(file_path, extension)
+    elapsed = time.perf_counter() - started
+    sections = 0
+    completed = False
+    try:
+        started = time.perf_counter()
+        documents = iter(loader.load(file_path))
+        elapsed += time.perf_counter() - started
+        while True:
+            started = time.perf_counter()
+            try:
+                document = next(documents)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - started
+            sections += 1
+            yield document
+        completed = True
+    finally:
+        with _stats_lock:
+            stats = _stats.setdefault(loader.name, {"files": 0, "sections": 0, "seconds": 0.0})
+            stats["files"] += 1
+            stats["sections"] += sections
+            stats["seconds"] += elapsed
+        if completed:
+            logger.info(
+                f"Loaded '{file_path}' with '{loader.name}' loader: {sections} sections in {elapsed:.2f}s.")
+        else:
+            logger.warning(
+                f"Loading '{file_path}' with '{loader.name}' loader stopped after {sections} sections "
+                f"({elapsed:.2f}s).")
+
+
+def loader_stats() -> Dict[str, dict]:
+    with _stats_lock:
+        return {name: dict(stats) for name, stats in _stats.items()}
+
+
+def _pdf_has_text_layer(file_path: str) -> bool:
+    from pypdf import PdfReader
+
+    reader = PdfReader(file_path)
+    pages = reader.pages[:PDF_PROBE_PAGES]
+    if not pages:
+        return False
+    chars = sum(len((page.extract_text() or "").strip()) for page in pages)
+    return chars / len(pages) >= Config.RAG_PDF_MIN_CHARS_PER_PAGE
+
+
+def _docx_is_simple(file_path: str) -> bool:
+    # таблицы, текстовые блоки и встроенные объекты docx2txt теряет или
+    # склеивает - такие документы отдаем Unstructured
+    with zipfile.ZipFile(file_path) as archive:
+        xml = archive.read("word/document.xml").decode("utf-8", errors="ignore")
+    return not re.search(r"<w:tbl[ >]|<w:txbxContent|<m:oMath|<w:object", xml)
+
+
+@register_loader("plain_text", [".txt"])
+def _load_text(file_path: str) -> Iterator[Document]:
+    block = []
+    block_size = 0
+    with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            block.append(line)
+            block_size += len(line)
+            if block_size >= TEXT_SECTION_CHARS:
+                yield Document(page_content="".join(block), metadata={"source": file_path})
+                block, block_size = [], 0
+    if block:
+        yield Document(page_content="".join(block), metadata={"source": file_path})
+
+
+@register_loader("pypdf", [".pdf"], probe=_pdf_has_text_layer)
+def _load_pdf_text_layer(file_path: str) -> Iterator[Document]:
+    from pypdf import PdfReader
+
+    reader = PdfReader(file_path)
+    for page_number, page in enumerate(reader.pages):
+        text = page.extract_text() or ""
+        if text.strip():
+            yield Document(page_content=text,
+                           metadata={"source": file_path, "page": page_number})
+
+
+@register_loader("docx2txt", [".docx"], probe=_docx_is_simple)
+def _load_simple_docx(file_path: str) -> Iterator[Document]:
+    import docx2txt
+
+    text = docx2txt.process(file_path)
+    if text.strip():
+        yield Document(page_content=text, metadata={"source": file_path})
+
+
+@register_loader("unstructured", [".pdf", ".docx"])
+def _load_unstructured(file_path: str) -> Iterator[Document]:
+    # сложная верстка, сканы без текстового слоя и т.п.
+    from langchain_community.document_loaders import UnstructuredFileLoader
+
+    yield from UnstructuredFileLoader(
+        file_path, mode="paged", encoding="utf-8").lazy_load()
@@ -0,0 +1,104 @@
+import asyncio
+import os
+import re
+from typing import List, Set
+
+from src.config.config import Config
+from src.rag.snapshots import LOCKS_DIR, FileLock
+from src.utlis.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+_CHAT_FILE_RE = re.compile(r"^chat_(\d+)(?:[_.]|$)")
+
+
+def indexed_chat_ids(indexes_dir: str) -> List[int]:
+    """id чатов, у которых есть хоть какие-то файлы в папке индексов."""
+    if not os.path.isdir(indexes_dir):
+        return []
+    ids = {int(match.group(1)) for name in os.listdir(indexes_dir)
+           if (match := _CHAT_FILE_RE.match(name))}
+    return sorted(ids)
+
+
+def deleted_chat_ids(chat_ids: List[int]) -> Set[int]:
+    """Чаты, помеченные в БД удаленными или отсутствующие в ней вовсе."""
+    if not chat_ids:
+        return set()
+    from src.backend.database import Chat, PostgresSessionLocal
+
+    db = PostgresSessionLocal()
+    try:
+        alive = {chat_id for (chat_id,) in db.query(Chat.id).filter(
+            Chat.id.in_(chat_ids), Chat.is_deleted == False).all()}
+    finally:
+        db.close()
+    return set(chat_ids) - alive
+
+
+def run_maintenance(rag_service, dry_run: bool = True) -> dict:
+    """
+    Обслуживание папки индексов:
+    - индексы удаленных чатов удаляются или архивируются (RAG_GC_MODE);
+    - индексы живых чатов, где доля чанков удаленных документов не меньше
+      RAG_COMPACT_MIN_DEAD_RATIO, компактируются;
+    - устаревшие снимки индексов живых чатов удаляются.
+
+    При dry_run ничего не меняется - возвращается отчет о том, что было бы сделано.
+    """
+    from src.rag.rag_service import RAG_INDEXES_DIR
+
+    report = {"dry_run": dry_run, "gc_mode": Config.RAG_GC_MODE,
+              "purged": [], "compacted": [], "pruned_files": 0, "errors": []}
+    # между воркерами uvicorn обслуживание выполняет только один процесс
+    lock = FileLock.for_path(os.path.join(RAG_INDEXES_DIR, LOCKS_DIR, "maintenance.lock"))
+    if not dry_run and not lock.acquire(blocking=False):
+        logger.info("Index maintenance is already running in another process. Skipping.")
+        report["skipped"] = "locked"
+        return report
+
+    try:
+        chat_ids = indexed_chat_ids(RAG_INDEXES_DIR)
+        deleted = deleted_chat_ids(chat_ids)
+        archive_dir = Config.RAG_ARCHIVE_DIR if Config.RAG_GC_MODE == "archive" else None
+
+        for chat_id in chat_ids:
+            try:
+                if chat_id in deleted:
+                    report["purged"].append(rag_service.purge_chat_index(
+                        chat_id, archive_dir=archive_dir, dry_run=dry_run))
+                    continue
+                if not dry_run:
+                    report["pruned_files"] += len(rag_service.prune_snapshots(chat_id))
+                compaction = rag_service.compaction_report(chat_id)
+                if not compaction["dead_chunks"] and not compaction["tombstoned"]:
+                    continue
+                if compaction["dead_ratio"] < Config.RAG_COMPACT_MIN_DEAD_RATIO and compaction["chunks"]:
+                    compaction["skipped"] = "below RAG_COMPACT_MIN_DEAD_RATIO"
+                elif not dry_run:
+                    compaction = rag_service.compact_index(chat_id)
+                report["compacted"].append(compaction)
+            except Exception as e:
+                logger.error(f"Index maintenance failed for chat {chat_id}: {e}")
+                report["errors"].append({"chat_id": chat_id, "error": str(e)})
+    finally:
+        if not dry_run:
+            lock.release()
+
+    report["bytes_reclaimed"] = sum(item["bytes"] for item in report["purged"])
+    logger.info(
+        f"Index maintenance{' (dry run)' if dry_run else ''}: {len(report['purged'])} chats purged, "
+        f"{len(report['compacted'])} chats to compact, {len(report['errors'])} errors.")
+    return report
+
+
+async def maintenance_loop(get_rag_service, interval_s: int):
+    """Периодическое обслуживание индексов в фоне (запускается из lifespan)."""
+    while True:
+        await asyncio.sleep(interval_s)
+        try:
+            rag_service = await get_rag_service()
+            await asyncio.to_thread(
+                run_maintenance, rag_service, dry_run=Config.RAG_MAINTENANCE_DRY_RUN)
+        except Exception as e:
+            logger.error(f"Scheduled index maintenance failed: {e}")
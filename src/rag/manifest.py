@@ -0,0 +1,130 @@
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+from src.utlis.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+class DocumentManifest:
+    """
+    Манифест документов чата: имя файла -> хэш содержимого, диапазоны id
+    чанков в ChunkStore и id векторов в docstore FAISS.
+
+    Манифест - источник истины для проверки "есть ли файл в индексе":
+    это чтение одного небольшого JSON вместо загрузки всего индекса.
+
+    Удаленный документ остается в манифесте с меткой deleted_at (tombstone),
+    пока компакция не перепишет индекс чата без его чанков.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._data = self._load()
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {"documents": {}}
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(self) -> None:
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    @property
+    def documents(self) -> Dict[str, dict]:
+        return self._data["documents"]
+
+    @property
+    def live_documents(self) -> Dict[str, dict]:
+        return {name: entry for name, entry in self.documents.items()
+                if not entry.get("deleted_at")}
+
+    @property
+    def index_info(self) -> dict:
+        """Тип векторного индекса чата (flat/hnsw/ivfpq) и результат последней попытки ANN."""
+        return self._data.setdefault("index", {"type": "flat"})
+
+    @index_info.setter
+    def index_info(self, info: dict) -> None:
+        self._data["index"] = info
+
+    def contains(self, file_name: str) -> bool:
+        """Документ проиндексирован целиком (недописанный потоковый не считается)."""
+        entry = self.live_documents.get(file_name)
+        return entry is not None and entry.get("complete", True)
+
+    def find_by_hash(self, content_hash: str) -> Optional[str]:
+        """Возвращает имя уже проиндексированного файла с таким же содержимым."""
+        for file_name, entry in self.live_documents.items():
+            if entry.get("sha256") == content_hash and entry.get("complete", True):
+                return file_name
+        return None
+
+    def get_chunk_ids(self, file_name: str) -> List[int]:
+        entry = self.live_documents.get(file_name)
+        if not entry:
+            return []
+        return self._entry_chunk_ids(entry)
+
+    @staticmethod
+    def _entry_chunk_ids(entry: dict) -> List[int]:
+        ids = []
+        for start, end in entry["chunks"]:
+            ids.extend(range(start, end))
+        return ids
+
+    def live_chunk_ids(self) -> Set[int]:
+        """id чанков, на которые ссылается хотя бы один неудаленный документ."""
+        ids = set()
+        for entry in self.live_documents.values():
+            ids.update(self._entry_chunk_ids(entry))
+        return ids
+
+    def tombstone(self, file_name: str) -> bool:
+        entry = self.live_documents.get(file_name)
+        if entry is None:
+            return False
+        entry["deleted_at"] = datetime.now().isoformat()
+        return True
+
+    def tombstone_incomplete(self) -> List[str]:
+        """
+        Помечает удаленными недописанные документы - остатки потоковой
+        индексации, прерванной падением процесса. Вызывать под блокировкой
+        чата: пока ее держит писатель, других незаконченных индексаций нет.
+        """
+        names = [name for name, entry in self.live_documents.items() if not entry.get("complete", True)]
+        for name in names:
+            self.tombstone(name)
+        return names
+
+    def tombstoned(self) -> List[str]:
+        return [name for name, entry in self.documents.items() if entry.get("deleted_at")]
+
+    def dead_chunk_ids(self, total: int) -> Set[int]:
+        """
+        id чанков из [0, total), на которые не ссылается ни один живой документ
+        (удаленные и откаченные): до компакции они отфильтровываются из выдачи.
+        """
+        return set(range(total)).difference(self.live_chunk_ids())
+
+    def add_document(self, file_name: str, content_hash: Optional[str],
+                     chunk_ranges: List[List[int]], vector_ids: List[str],
+                     complete: bool = True) -> None:
+        # complete=False - документ еще индексируется потоково, часть чанков уже доступна
+        self.documents[file_name] = {
+            "sha256": content_hash,
+            "chunks": chunk_ranges,
+            "vector_ids": vector_ids,
+            "complete": complete,
+            "added_at": datetime.now().isoformat(),
+        }
@@ -0,0 +1,116 @@
+import os
+import threading
+from typing import Optional, Union
+
+import faiss
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from src.rag.chunk_store import ChunkStore, ChunkStoreReader
+from src.utlis.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# IO_FLAG_MMAP отображает в память инвертированные списки IVF, IO_FLAG_MMAP_IFC -
+# коды векторов flat-индексов (в т.ч. хранилище HNSW). Вместе они работают не для
+# всех типов индексов, поэтому флаги пробуются по очереди
+_MMAP_FLAGS = [
+    faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY,
+    faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY,
+]
+
+
+class ChunkStoreDocstore(Docstore):
+    """
+    Docstore только для чтения поверх хранилища чанков: id документа - его
+    позиция в индексе, чанк читается из ChunkStore при обращении. В отличие от
+    InMemoryDocstore из index.pkl, ничего не десериализуется заранее.
+    Как и он, на отсутствующий id возвращает строку-сообщение (контракт Docstore).
+    """
+
+    def __init__(self, chunk_store: ChunkStore):
+        self.chunk_store = chunk_store
+        # файлы снимка отображаются один раз, при первом поиске, а не на каждый чанк
+        self._reader: Optional[ChunkStoreReader] = None
+        self._lock = threading.Lock()
+
+    def _get_reader(self) -> ChunkStoreReader:
+        if self._reader is None:
+            with self._lock:
+                if self._reader is None:
+                    self._reader = self.chunk_store.reader()
+        return self._reader
+
+    def search(self, search: Union[int, str]) -> Union[str, Document]:
+        position = int(search)
+        reader = self._get_reader()
+        if position < 0 or position >= reader.count:
+            return f"ID {search} not found."
+        return reader.read([position])[0]
+
+
+class PositionMapping:
+    """Отображение позиция в индексе -> id документа (тождественное, до ntotal)."""
+
+    def __init__(self, size: int):
+        self.size = size
+
+    def __getitem__(self, position: int) -> int:
+        position = int(position)
+        if not 0 <= position < self.size:
+            raise KeyError(position)
+        return position
+
+    def get(self, position: int, default=None):
+        try:
+            return self[position]
+        except KeyError:
+            return default
+
+    def __contains__(self, position) -> bool:
+        return self.get(position) is not None
+
+    def __len__(self) -> int:
+        return self.size
+
+
+def read_index_mmap(index_file: str):
+    """
+    Читает FAISS-индекс с отображением векторов в память (только чтение):
+    страницы подгружаются по мере поиска и делятся между воркерами через page
+    cache. Если mmap не поддерживается, индекс читается целиком.
+    """
+    for flags in _MMAP_FLAGS:
+        try:
+            return faiss.read_index(index_file, flags)
+        except RuntimeError as e:
+            logger.debug(f"mmap read of '{index_file}' with flags {flags} failed: {e}")
+    logger.warning(f"Could not memory-map '{index_file}'. Reading it into memory.")
+    return faiss.read_index(index_file)
+
+
+def estimate_resident_size(index, index_file: str) -> int:
+    """
+    Оценка памяти процесса под mmap-индекс: размер файла минус отображенные
+    коды векторов (их страницы лежат в page cache и не считаются в бюджет кэша).
+    """
+    if isinstance(index, faiss.IndexIVF):
+        mapped = index.ntotal * (index.code_size + 8)
+    else:
+        mapped = index.ntotal * index.d * 4
+    return max(os.path.getsize(index_file) - mapped, 0)
+
+
+def load_mmap_vector_store(index_path: str, chunk_store: ChunkStore,
+                           embeddings: Embeddings) -> FAISS:
+    """
+    Открывает FAISS-хранилище чата только для чтения: индекс через mmap, тексты
+    чанков - из ChunkStore по позициям. index.pkl (docstore) не читается.
+
+    В такой индекс нельзя добавлять векторы: для записи его нужно загружать
+    через FAISS.load_local.
+    """
+    index = read_index_mmap(os.path.join(index_path, "index.faiss"))
+    return FAISS(embeddings, index, ChunkStoreDocstore(chunk_store), PositionMapping(index.ntotal))
@@ -0,0 +1,117 @@
+import os
+from typing import List, Tuple
+
+import numpy as np
+from langchain_community.cross_encoders import BaseCrossEncoder
+from langchain_core.embeddings import Embeddings
+
+from src.config.config import Config
+from src.utlis.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+QUANTIZED_FILE_NAME = "model_quantized.onnx"
+
+
+def _model_dir(model_name: str) -> str:
+    return os.path.join(Config.RAG_ONNX_DIR, model_name.replace("/", "__"))
+
+
+def export_quantized(model_name: str, task: str) -> str:
+    """
+    Экспортирует модель HuggingFace в ONNX и квантует веса в int8 (динамическая
+    квантизация). Результат кладется в RAG_ONNX_DIR и переиспользуется.
+
+    task: "feature-extraction" (эмбеддер) или "text-classification" (реранкер).
+    """
+    output_dir = _model_dir(model_name)
+    if os.path.exists(os.path.join(output_dir, QUANTIZED_FILE_NAME)):
+        return output_dir
+
+    from optimum.onnxruntime import (ORTModelForFeatureExtraction, ORTModelForSequenceClassification,
+                                     ORTQuantizer)
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    logger.info(f"Exporting '{model_name}' to ONNX and quantizing to int8.")
+    model_cls = (ORTModelForFeatureExtraction if task == "feature-extraction"
+                 else ORTModelForSequenceClassification)
+    model = model_cls.from_pretrained(model_name, export=True)
+    model.save_pretrained(output_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(output_dir)
+
+    quantizer = ORTQuantizer.from_pretrained(output_dir)
+    qconfig = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+    quantizer.quantize(save_dir=output_dir, quantization_config=qconfig)
+    logger.info(f"Quantized ONNX model saved to '{output_dir}'.")
+    return output_dir
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Эмбеддер sentence-transformers на int8 ONNX Runtime (CPU): mean pooling
+    по последнему слою, как у исходной модели.
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 32, max_length: int = 128):
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        model_dir = export_quantized(model_name, "feature-extraction")
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            model_dir, file_name=QUANTIZED_FILE_NAME)
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = texts[i:i + self.batch_size]
+            inputs = self.tokenizer(batch, padding=True, truncation=True,
+                                    max_length=self.max_length, return_tensors="np")
+            hidden = self.model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            vectors.extend(pooled.tolist())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class OnnxCrossEncoder(BaseCrossEncoder):
+    """
+    Cross-encoder на int8 ONNX Runtime. Как и CrossEncoder из
+    sentence-transformers с одним выходом, возвращает sigmoid(logit).
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 32, max_length: int = 512):
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+        from transformers import AutoTokenizer
+
+        model_dir = export_quantized(model_name, "text-classification")
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.model = ORTModelForSequenceClassification.from_pretrained(
+            model_dir, file_name=QUANTIZED_FILE_NAME)
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+    def score(self, text_pairs: List[Tuple[str, str]]) -> List[float]:
+        scores = []
+        for i in range(0, len(text_pairs), self.batch_size):
+            batch = text_pairs[i:i + self.batch_size]
+            inputs = self.tokenizer([q for q, _ in batch], [d for _, d in batch],
+                                    padding=True, truncation=True,
+                                    max_length=self.max_length, return_tensors="np")
+            logits = np.asarray(self.model(**inputs).logits)[:, 0]
+            scores.extend((1 / (1 + np.exp(-logits))).tolist())
+        return scores
+
+
+if __name__ == "__main__":
+    # предварительный экспорт, чтобы первый запрос не ждал конвертации
+    from src.rag.rag_service import EMBEDDING_MODEL, RERANKER_MODEL
+
+    print(export_quantized(EMBEDDING_MODEL, "feature-extraction"))
+    print(export_quantized(RERANKER_MODEL, "text-classification"))
@@ -1,13 +1,36 @@
+import glob
+import hashlib
+import importlib.util
 import os
 import pickle
+import shutil
+import tarfile
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import UnstructuredFileLoader
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain.retrievers import EnsembleRetriever
-from langchain_community.retrievers import BM25Retriever
-from langchain_community.cross_encoders import HuggingFaceCrossEncoder
-import torch
+from langchain_core.documents import Document
+from src.config.config import Config
+from src.rag.ann_index import is_flat, maybe_promote, stores_exact_vectors
+from src.rag.chunk_store import ChunkStore
+from src.rag.dedup import NearDuplicateIndex, dedup_stats, record_dedup
+from src.rag.embedding_cache import CachedEmbeddings, EmbeddingCache
+from src.rag.embedding_scheduler import BatchingEmbeddings
+from src.rag.index_cache import index_cache
+from src.rag.lexical_index import LexicalIndex, LexicalRetriever
+from src.rag.loaders import iter_documents, loader_stats, supported_extensions
+from src.rag.manifest import DocumentManifest
+from src.rag.mmap_index import estimate_resident_size, load_mmap_vector_store
+from src.rag.rerank_cache import CachedCrossEncoder
+from src.rag.snapshots import ChatSnapshots, Snapshot
+from src.rag.torch_backend import TorchCrossEncoder
 from src.utlis.logging_config import get_logger
 
 logger = get_logger(__name__)
@@ -15,6 +38,24 @@ logger = get_logger(__name__)
 RAG_INDEXES_DIR = "rag_indexes"
 EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
 RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+# max_seq_length эмбеддера: все, что длиннее, модель молча обрезает
+EMBEDDING_MAX_TOKENS = 128
+# сколько кандидатов берут BM25 и FAISS для слияния; если в чате есть мертвые
+# чанки, берется вдвое больше, чтобы после их отсева осталось столько же
+HYBRID_K = 4
+
+# chat_id -> ((токен снимка, ntotal), id мертвых чанков): манифест разбирается
+# один раз на версию индекса, а не на каждый запрос
+_dead_chunk_ids_cache: Dict[int, tuple] = {}
+# chat_id -> ((путь, (st_dev, st_ino) файла), LexicalIndex): открытый BM25-индекс
+# переиспользуется, пока файл базы не заменен (сборка, удаление чата)
+_lexical_index_cache: Dict[int, tuple] = {}
+
+
+def load_embedding_tokenizer():
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(EMBEDDING_MODEL)
 
 
 class RAGService:
@@ -24,161 +65,575 @@ class RAGService:
             logger.info(
                 f"Created directory for RAG indexes: {RAG_INDEXES_DIR}")
 
+        embedder, reranker = self._create_models(Config.RAG_INFERENCE_BACKEND)
+        # эмбеддинги одинаковых чанков переиспользуются между чатами; векторы
+        # int8 ONNX немного отличаются от PyTorch, поэтому у них свой ключ в кэше
+        cache_model_name = EMBEDDING_MODEL
+        if Config.RAG_INFERENCE_BACKEND == "onnx":
+            cache_model_name += "@onnx-int8"
+        # все вызовы модели (эмбеддинг запросов и промахи кэша при индексации)
+        # идут через общий планировщик, склеивающий параллельные запросы в батчи
+        self.embedding_scheduler = BatchingEmbeddings(
+            embedder,
+            max_batch_size=Config.RAG_EMBED_MAX_BATCH,
+            max_wait_ms=Config.RAG_EMBED_MAX_WAIT_MS
+        )
+        self.embedding_model = CachedEmbeddings(
+            self.embedding_scheduler,
+            EmbeddingCache(
+                os.path.join(RAG_INDEXES_DIR, "embedding_cache.sqlite"),
+                max_entries=Config.RAG_EMBEDDING_CACHE_MAX_ENTRIES
+            ),
+            model_name=cache_model_name
+        )
+
+        self.text_splitter = self._create_text_splitter()
+
+        # реранкер (с кэшем оценок уже виденных пар запрос-чанк)
+        self.reranker = CachedCrossEncoder(
+            reranker, max_entries=Config.RAG_RERANK_CACHE_SIZE)
+
+        logger.info("RAGService initialized successfully.")
+
+    @staticmethod
+    def _create_models(backend: str):
+        """
+        Создает эмбеддер и реранкер для выбранного бэкенда инференса:
+        "torch" (по умолчанию) или "onnx" (int8 ONNX Runtime, только CPU).
+        """
+        if backend == "onnx":
+            from src.rag.onnx_backend import OnnxCrossEncoder, OnnxEmbeddings
+
+            if importlib.util.find_spec("optimum") is None:
+                raise RuntimeError(
+                    "RAG_INFERENCE_BACKEND=onnx requires optimum[onnxruntime]. "
+                    "Install it with 'pip install -r requirements-onnx.txt'.")
+            logger.info("Using quantized ONNX Runtime backend for embeddings and reranker.")
+            return OnnxEmbeddings(EMBEDDING_MODEL), OnnxCrossEncoder(RERANKER_MODEL)
+        if backend != "torch":
+            raise ValueError(
+                f"Unsupported RAG_INFERENCE_BACKEND '{backend}'. Use 'torch' or 'onnx'.")
+
+        import torch
+
         device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        self.embedding_model = HuggingFaceEmbeddings(
+        embedder = HuggingFaceEmbeddings(
             model_name=EMBEDDING_MODEL,
             model_kwargs={'device': device}
         )
+        # оценки - вероятности 0..1, как у ONNX-бэкенда (пороги RelevanceGate)
+        reranker = TorchCrossEncoder(RERANKER_MODEL, model_kwargs={'device': device})
+        return embedder, reranker
 
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len
-        )
+    @staticmethod
+    def _create_text_splitter() -> RecursiveCharacterTextSplitter:
+        """
+        Сплиттер, считающий длину чанка в токенах эмбеддера, чтобы чанк целиком
+        помещался в окно модели и не обрезался при эмбеддинге.
+        """
+        if Config.RAG_CHUNK_TOKENS <= 0:
+            return RecursiveCharacterTextSplitter(
+                chunk_size=1000,
+                chunk_overlap=200,
+                length_function=len
+            )
 
-        # реранкер
-        self.reranker = HuggingFaceCrossEncoder(
-            model_name=RERANKER_MODEL,
-            model_kwargs={'device': device}
+        # [CLS] и [SEP] тоже занимают место в окне
+        max_chunk_tokens = EMBEDDING_MAX_TOKENS - 2
+        if Config.RAG_CHUNK_TOKENS > max_chunk_tokens:
+            logger.warning(
+                f"RAG_CHUNK_TOKENS={Config.RAG_CHUNK_TOKENS} exceeds the embedder window "
+                f"({max_chunk_tokens} tokens). Chunks will be truncated when embedded.")
+        return RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+            load_embedding_tokenizer(),
+            chunk_size=Config.RAG_CHUNK_TOKENS,
+            chunk_overlap=Config.RAG_CHUNK_OVERLAP_TOKENS
         )
 
-        logger.info("RAGService initialized successfully.")
-
-    def _get_index_path(self, chat_id: int) -> str:
-        return os.path.join(RAG_INDEXES_DIR, f"chat_{chat_id}")
+    def _snapshots(self, chat_id: int) -> ChatSnapshots:
+        """Версии индекса чата и межпроцессная блокировка его писателей."""
+        return ChatSnapshots(RAG_INDEXES_DIR, chat_id)
 
     def _get_chunks_path(self, chat_id: int) -> str:
-        """Возвращает путь к файлу, где хранятся сериализованные чанки."""
+        """Возвращает путь к старому (pickle) файлу с чанками чата."""
         return os.path.join(RAG_INDEXES_DIR, f"chat_{chat_id}_chunks.pkl")
 
-    def is_document_in_index(self, chat_id: int, filename: str) -> bool:
+    def _get_chunk_store(self, chat_id: int, snapshot: Optional[Snapshot] = None) -> ChunkStore:
         """
-        Проверяет, содержатся ли в индексе чата чанки из файла с указанным именем.
+        Открывает append-only хранилище чанков чата (текущее или снимка snapshot).
+        Если у чата остался старый pickle-файл, однократно переносит его содержимое.
         """
-        index_path = self._get_index_path(chat_id)
-        if not os.path.exists(index_path):
-            return False
+        snapshot = snapshot or self._snapshots(chat_id).current()
+        chunk_store = ChunkStore(snapshot.chunks_base)
 
-        try:
-            logger.info(
-                f"Checking for '{filename}' in existing index for chat {chat_id}.")
+        chunks_path = self._get_chunks_path(chat_id)
+        if chunk_store.exists() or not os.path.exists(chunks_path):
+            return chunk_store
+        # переносит один процесс; остальные дождутся блокировки и увидят готовое хранилище
+        with self._snapshots(chat_id).lock.hold():
+            if not chunk_store.exists() and os.path.exists(chunks_path):
+                logger.info(
+                    f"Migrating chunks of chat {chat_id} from '{chunks_path}' to chunk store.")
+                with open(chunks_path, "rb") as f:
+                    chunks = pickle.load(f)
+                # пишем рядом и подменяем: прерванный перенос не оставит
+                # недописанное хранилище, из-за которого pickle больше не читался бы
+                tmp_store = ChunkStore(snapshot.chunks_base + ".migrating")
+                for path in (tmp_store.log_path, tmp_store.idx_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                if chunks:
+                    tmp_store.append(chunks)
+                    os.replace(tmp_store.log_path, chunk_store.log_path)
+                    os.replace(tmp_store.idx_path, chunk_store.idx_path)
+                os.remove(chunks_path)
+        return chunk_store
+
+    def _get_lexical_index_path(self, chat_id: int) -> str:
+        """Возвращает путь к SQLite-базе с BM25 (FTS5) индексом чата."""
+        return os.path.join(RAG_INDEXES_DIR, f"chat_{chat_id}_bm25.sqlite")
+
+    def _get_lexical_index(self, chat_id: int) -> LexicalIndex:
+        """
+        Открывает BM25-индекс чата (из процессного кэша, пока файл базы тот же).
+        Для чатов, проиндексированных до его появления, однократно строит его
+        из сохраненных чанков.
+        """
+        db_path = self._get_lexical_index_path(chat_id)
+        if not os.path.exists(db_path):
+            with self._snapshots(chat_id).lock.hold():
+                if not os.path.exists(db_path):
+                    chunk_store = self._get_chunk_store(chat_id)
+                    if len(chunk_store):
+                        logger.info(
+                            f"Building lexical index for chat {chat_id} from existing chunks.")
+                    LexicalIndex.build(db_path, chunk_store)
+
+        stat = os.stat(db_path)
+        key = (db_path, (stat.st_dev, stat.st_ino))
+        cached = _lexical_index_cache.get(chat_id)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        lexical_index = LexicalIndex(db_path)
+        _lexical_index_cache[chat_id] = (key, lexical_index)
+        return lexical_index
+
+    def _get_dedup_index(self, chat_id: int) -> Optional[NearDuplicateIndex]:
+        """
+        Открывает LSH-индекс MinHash-сигнатур чанков чата (None, если дедупликация
+        выключена). Для старых чатов однократно считает сигнатуры сохраненных чанков.
+        """
+        if not Config.RAG_DEDUP_ENABLED:
+            return None
+        db_path = os.path.join(RAG_INDEXES_DIR, f"chat_{chat_id}_minhash.sqlite")
+        needs_migration = not os.path.exists(db_path)
+        dedup_index = NearDuplicateIndex(
+            db_path,
+            num_perm=Config.RAG_DEDUP_NUM_PERM,
+            bands=Config.RAG_DEDUP_BANDS,
+            threshold=Config.RAG_DEDUP_THRESHOLD,
+            shingle_size=Config.RAG_DEDUP_SHINGLE_SIZE
+        )
+
+        if needs_migration:
+            chunk_store = self._get_chunk_store(chat_id)
+            if len(chunk_store):
+                logger.info(
+                    f"Building near-duplicate index for chat {chat_id} from existing chunks.")
+                dedup_index.add([(chunk_id, dedup_index.hasher.signature(chunk.page_content))
+                                 for chunk_id, chunk in enumerate(chunk_store)])
+        return dedup_index
+
+    @staticmethod
+    def _align_side_stores(chat_id: int, count: int, chunk_store: ChunkStore, lexical_index: LexicalIndex,
+                           dedup_index: Optional[NearDuplicateIndex]) -> None:
+        """
+        Приводит хранилище чанков, BM25 и LSH к опубликованному снимку: в каждом
+        ровно по записи на вектор FAISS, то есть count (ntotal индекса снимка).
+
+        Лишний хвост - чанки индексации, упавшей до публикации, - отрезается,
+        иначе id следующих чанков разошлись бы с позициями векторов. Если
+        записей меньше (компакция прервалась между заменой BM25 / LSH и
+        публикацией), индекс пересобирается из хранилища чанков.
+        Вызывать под блокировкой чата.
+        """
+        chunk_store.truncate(count)
+        if len(chunk_store) != count:
+            raise RuntimeError(
+                f"Chunk store of chat {chat_id} has {len(chunk_store)} chunks, index has {count} vectors.")
+
+        rows = lexical_index.count()
+        if rows > count:
+            lexical_index.truncate(count)
+        elif rows < count:
+            logger.warning(f"Lexical index of chat {chat_id} has {rows} of {count} chunks. Rebuilding it.")
+            lexical_index.replace_all(chunk_store)
+
+        if dedup_index is not None:
+            signatures = dedup_index.count()
+            if signatures > count:
+                dedup_index.truncate(count)
+            elif signatures < count:
+                logger.warning(
+                    f"Near-duplicate index of chat {chat_id} has {signatures} of {count} chunks. Rebuilding it.")
+                dedup_index.add([(chunk_id, dedup_index.hasher.signature(chunk.page_content))
+                                 for chunk_id, chunk in enumerate(chunk_store)], replace_all=True)
+
+    def _get_manifest(self, chat_id: int, snapshot: Optional[Snapshot] = None) -> DocumentManifest:
+        """
+        Открывает манифест документов чата (текущий или снимка snapshot). Для
+        чатов, проиндексированных до появления манифеста, однократно
+        восстанавливает его по хранилищу чанков и docstore FAISS.
+        """
+        snapshot = snapshot or self._snapshots(chat_id).current()
+        manifest = DocumentManifest(snapshot.manifest_path)
+        if manifest.exists() or not snapshot.exists():
+            return manifest
+
+        # строит один процесс; остальные дождутся блокировки и прочитают готовый манифест
+        with self._snapshots(chat_id).lock.hold():
+            manifest = DocumentManifest(snapshot.manifest_path)
+            if manifest.exists():
+                return manifest
+
+            logger.info(f"Building document manifest for chat {chat_id}.")
+            # нужны настоящие id из docstore, поэтому грузим полный индекс, а не mmap
             vector_store = FAISS.load_local(
-                index_path,
-                self.embedding_model,
+                snapshot.index_path, self.embedding_model,
                 allow_dangerous_deserialization=True)
+            ranges = {}
+            for chunk_id, chunk in enumerate(self._get_chunk_store(chat_id, snapshot)):
+                name = os.path.basename(chunk.metadata.get("source", ""))
+                doc_ranges = ranges.setdefault(name, [])
+                if doc_ranges and doc_ranges[-1][1] == chunk_id:
+                    doc_ranges[-1][1] = chunk_id + 1
+                else:
+                    doc_ranges.append([chunk_id, chunk_id + 1])
 
-            if not hasattr(vector_store, 'docstore') or not hasattr(
-                    vector_store.docstore, '_dict'):
-                logger.warning(
-                    f"Docstore not found or in unexpected format for chat {chat_id}.")
-                return False
+            for name, doc_ranges in ranges.items():
+                vector_ids = [vector_store.index_to_docstore_id[i]
+                              for start, end in doc_ranges for i in range(start, end)
+                              if i in vector_store.index_to_docstore_id]
+                manifest.add_document(name, None, doc_ranges, vector_ids)
+            manifest.save()
+        return manifest
 
-            for doc in vector_store.docstore._dict.values():
-                source = doc.metadata.get('source')
-                if source and os.path.basename(source) == filename:
-                    logger.info(
-                        f"Found matching document '{filename}' in index for chat {chat_id}.")
-                    return True
+    @staticmethod
+    def _hash_file(file_path: str) -> str:
+        sha256 = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(block)
+        return sha256.hexdigest()
+
+    def _load_vector_store(self, chat_id: int, snapshot: Optional[Snapshot] = None):
+        """
+        Возвращает FAISS-индекс чата (текущего снимка или snapshot) из
+        процессного кэша, загружая его с диска только при промахе или если
+        на диске опубликован новый снимок.
+
+        При RAG_MMAP_INDEXES индекс открывается через mmap только для чтения,
+        а чанки читаются из хранилища чанков - писать в такой объект нельзя.
+        """
+        snapshot = snapshot or self._snapshots(chat_id).current()
+        if not snapshot.exists():
+            return None
+
+        vector_store = index_cache.get(chat_id, snapshot.token)
+        if vector_store is not None:
+            return vector_store
+
+        logger.info(f"Index cache miss for chat {chat_id}. Loading snapshot v{snapshot.version} from disk.")
+        if Config.RAG_MMAP_INDEXES:
+            vector_store = load_mmap_vector_store(
+                snapshot.index_path, self._get_chunk_store(chat_id, snapshot), self.embedding_model)
+            index_cache.put(chat_id, vector_store, snapshot.token, size=estimate_resident_size(
+                vector_store.index, os.path.join(snapshot.index_path, "index.faiss")))
+            return vector_store
+
+        vector_store = FAISS.load_local(
+            snapshot.index_path,
+            self.embedding_model,
+            allow_dangerous_deserialization=True)
+        index_cache.put(chat_id, vector_store, snapshot.token)
+        return vector_store
 
+    def get_stats(self) -> dict:
+        return {
+            "index_cache": index_cache.stats(),
+            "embedding_cache": self.embedding_model.stats(),
+            "embedding_scheduler": self.embedding_scheduler.stats(),
+            "rerank_cache": self.reranker.stats(),
+            "dedup": dedup_stats(),
+            "loaders": loader_stats(),
+        }
+
+    def is_document_in_index(self, chat_id: int, filename: str) -> bool:
+        """
+        Проверяет по манифесту чата, был ли уже проиндексирован файл с указанным именем.
+        """
+        try:
+            found = self._get_manifest(chat_id).contains(filename)
             logger.info(
-                f"No matching document '{filename}' found in index for chat {chat_id}.")
-            return False
+                f"Document '{filename}' {'found' if found else 'not found'} in manifest of chat {chat_id}.")
+            return found
         except Exception as e:
             logger.error(f"Error checking index for chat {chat_id}: {e}")
             return False
 
     def add_document_to_index(self, file_path: str, chat_id: int) -> list:
+        """
+        Индексирует документ в чате. Возвращает его новые чанки; для больших
+        файлов (потоковая индексация) чанки не накапливаются и возвращается
+        пустой список - проверять результат нужно через is_document_in_index.
+        Ошибку индексации пробрасывает, чтобы задача очереди считалась упавшей.
+        """
         try:
             logger.info(
                 f"Starting to process document '{file_path}' for chat_id {chat_id}.")
 
             file_extension = os.path.splitext(file_path)[1].lower()
-            if file_extension not in [".txt", ".pdf", ".docx"]:  # TODO
+            if file_extension not in supported_extensions():
                 logger.warning(
                     f"Unsupported file type for RAG: {file_path}. Skipping.")
                 return []
 
-            loader = UnstructuredFileLoader(file_path, encoding="utf-8")
-            documents = loader.load()
+            file_name = os.path.basename(file_path)
+            content_hash = self._hash_file(file_path)
+            # большие файлы читаем постранично и индексируем пачками, не держа
+            # весь текст документа в памяти; маленькие - как раньше, целиком
+            streaming = os.path.getsize(file_path) >= Config.RAG_STREAMING_MIN_BYTES
 
-            new_chunks = self.text_splitter.split_documents(documents)
-            logger.info(f"Document split into {len(new_chunks)} new chunks.")
+            # писатели одного чата (в том числе из других воркеров) идут по
+            # очереди; читатели блокировку не берут и видят последний снимок
+            snapshots = self._snapshots(chat_id)
+            with snapshots.lock.hold():
+                manifest = self._get_manifest(chat_id)
 
-            index_path = self._get_index_path(chat_id)
-            chunks_path = self._get_chunks_path(chat_id)
-            all_chunks = []
+                # тот же файл уже лежит в чате под другим именем - переиспользуем его чанки
+                same_file = manifest.find_by_hash(content_hash)
+                if same_file:
+                    logger.info(
+                        f"Document '{file_name}' has the same content as already indexed '{same_file}'.")
+                    entry = manifest.documents[same_file]
+                    manifest.add_document(
+                        file_name, content_hash, entry["chunks"], entry["vector_ids"])
+                    snapshots.publish(manifest)
+                    if streaming:
+                        return []
+                    return self._get_chunk_store(chat_id).read(
+                        manifest.get_chunk_ids(file_name))
 
-            if os.path.exists(chunks_path):
-                logger.info(
-                    f"Chunks file for chat {chat_id} exists. Loading and appending.")
-                with open(chunks_path, "rb") as f:
-                    all_chunks = pickle.load(f)
+                if streaming:
+                    logger.info(f"Using streaming ingestion for '{file_name}'.")
+                    sections = iter_documents(file_path)
+                else:
+                    sections = list(iter_documents(file_path))
 
-            all_chunks.extend(new_chunks)
+                new_chunks = self._index_sections(
+                    chat_id, file_name, content_hash, sections, keep_chunks=not streaming)
+                return new_chunks
 
-            with open(chunks_path, "wb") as f:
-                pickle.dump(all_chunks, f)
-            logger.info(
-                f"Saved {len(all_chunks)} total chunks to '{chunks_path}'.")
+        except Exception as e:
+            logger.error(
+                f"Failed to add document to index for chat {chat_id}: {e}")
+            raise
 
-            if os.path.exists(index_path):
-                logger.info(
-                    f"FAISS index for chat {chat_id} already exists. Loading and updating.")
-                vector_store = FAISS.load_local(
-                    index_path, self.embedding_model, allow_dangerous_deserialization=True)
-                vector_store.add_documents(new_chunks)
-            else:
-                logger.info(f"Creating a new FAISS index for chat {chat_id}.")
-                vector_store = FAISS.from_documents(
-                    new_chunks, self.embedding_model)
-
-            vector_store.save_local(index_path)
+    def _index_sections(self, chat_id: int, file_name: str, content_hash: str,
+                        sections: Iterable[Document], keep_chunks: bool) -> list:
+        """
+        Режет части документа на чанки и индексирует их пачками по
+        RAG_INGEST_BATCH_SIZE: эмбеддинг -> хранилище чанков -> BM25 -> FAISS.
+        Каждые RAG_INGEST_COMMIT_EVERY пачек индекс и манифест сохраняются на
+        диск, так что большой документ становится доступен для поиска по мере загрузки.
+        Из самого документа в памяти держится только текущая пачка, но FAISS
+        индекс чата вместе с docstore растет целиком, а каждый промежуточный
+        коммит пишет полный снимок, поэтому старые снимки удаляются сразу после
+        него (с учетом RAG_SNAPSHOT_GRACE_S). Если индексация упала после
+        промежуточного коммита, документ откатывается к прежней записи
+        манифеста или помечается удаленным.
+
+        Почти одинаковые чанки (RAG_DEDUP_*) не сохраняются повторно: документ
+        ссылается на уже лежащий в чате чанк-оригинал.
+
+        Возвращает чанки документа без повторов, если keep_chunks, иначе пустой список.
+        Вызывается под блокировкой чата.
+        """
+        snapshots = self._snapshots(chat_id)
+        snapshot = snapshots.current()
+        # открываем (и при необходимости мигрируем) до записи новых чанков
+        lexical_index = self._get_lexical_index(chat_id)
+        dedup_index = self._get_dedup_index(chat_id)
+        chunk_store = self._get_chunk_store(chat_id, snapshot)
+        manifest = self._get_manifest(chat_id, snapshot)
+
+        vector_store = None
+        if snapshot.exists():
             logger.info(
-                f"Successfully saved FAISS index for chat {chat_id} to '{index_path}'.")
+                f"FAISS index for chat {chat_id} already exists. Loading and updating.")
+            # Пишем в свежую копию, а не в закэшированный объект: его в это
+            # время могут читать параллельные запросы
+            vector_store = FAISS.load_local(
+                snapshot.index_path, self.embedding_model, allow_dangerous_deserialization=True)
+        # сколько чанков во всех хранилищах видят читатели последнего снимка
+        # и успел ли попасть в снимок недописанный документ
+        published = {"count": vector_store.index.ntotal if vector_store is not None else 0, "partial": False}
+        previous_entry = manifest.documents.get(file_name)
+        self._align_side_stores(chat_id, published["count"], chunk_store, lexical_index, dedup_index)
 
-            return new_chunks
+        chunk_ranges = []
+        vector_ids = []
+        kept_chunks = []
+        doc_chunk_ids = set()
+        duplicates = {"chunks": 0, "bytes": 0}
 
-        except Exception as e:
-            logger.error(
-                f"Failed to add document to index for chat {chat_id}: {e}")
-            return []
+        def flush(batch: list):
+            nonlocal vector_store
+            # id чанка == позиция вектора: следующий id берем из индекса
+            next_id = vector_store.index.ntotal if vector_store is not None else 0
+            if len(chunk_store) != next_id:
+                raise RuntimeError(
+                    f"Chunk store of chat {chat_id} has {len(chunk_store)} chunks, index has {next_id} vectors.")
+            chunk_ids = list(range(next_id, next_id + len(batch)))
+            is_new = [True] * len(batch)
+            signatures = []
+            if dedup_index is not None:
+                chunk_ids, is_new, signatures = dedup_index.deduplicate(
+                    [chunk.page_content for chunk in batch], next_id)
+            new_batch = [chunk for chunk, new in zip(batch, is_new) if new]
 
-    def query_index(self, question: str, chat_id: int) -> list:
-        index_path = self._get_index_path(chat_id)
-        chunks_path = self._get_chunks_path(chat_id)
+            dropped_bytes = sum(len(chunk.page_content.encode("utf-8"))
+                                for chunk, new in zip(batch, is_new) if not new)
+            duplicates["chunks"] += len(batch) - len(new_batch)
+            duplicates["bytes"] += dropped_bytes
+            record_dedup(len(batch), len(batch) - len(new_batch), dropped_bytes)
 
-        if not os.path.exists(index_path) or not os.path.exists(chunks_path):
+            if new_batch:
+                texts = [chunk.page_content for chunk in new_batch]
+                embeddings = self.embedding_model.embed_documents(texts)
+                ids = [str(uuid.uuid4()) for _ in new_batch]
+                metadatas = [chunk.metadata for chunk in new_batch]
+
+                chunk_store.append(new_batch)
+                lexical_index.add_documents(new_batch, next_id)
+                if vector_store is None:
+                    logger.info(f"Creating a new FAISS index for chat {chat_id}.")
+                    vector_store = FAISS.from_embeddings(
+                        list(zip(texts, embeddings)), self.embedding_model,
+                        metadatas=metadatas, ids=ids)
+                else:
+                    vector_store.add_embeddings(
+                        list(zip(texts, embeddings)), metadatas=metadatas, ids=ids)
+                if dedup_index is not None:
+                    dedup_index.add(signatures)
+                vector_ids.extend(ids)
+
+            # дубликат добавляет в документ ссылку на чанк-оригинал
+            for chunk, chunk_id in zip(batch, chunk_ids):
+                if chunk_id in doc_chunk_ids:
+                    continue
+                doc_chunk_ids.add(chunk_id)
+                if chunk_ranges and chunk_ranges[-1][1] == chunk_id:
+                    chunk_ranges[-1][1] = chunk_id + 1
+                else:
+                    chunk_ranges.append([chunk_id, chunk_id + 1])
+                if keep_chunks:
+                    kept_chunks.append(chunk)
+
+        def commit(complete: bool):
+            if complete:
+                # большие чаты переводим с точного поиска на HNSW / IVF-PQ
+                promotion = maybe_promote(
+                    vector_store, manifest.index_info,
+                    lambda: self._exact_vectors(vector_store, chunk_store, range(vector_store.index.ntotal)))
+                if promotion:
+                    manifest.index_info = promotion
+            # манифест попадает в снимок вместе с индексом: документ считается
+            # проиндексированным только после того, как все хранилища записаны
+            manifest.add_document(
+                file_name, content_hash, chunk_ranges, vector_ids, complete=complete)
+            snapshot = snapshots.publish(manifest, vector_store)
+            published["count"] = vector_store.index.ntotal
+            published["partial"] = not complete
+            # после промежуточного коммита объект продолжит меняться - кэшируем
+            # только законченный индекс
+            if complete and not Config.RAG_MMAP_INDEXES:
+                index_cache.put(chat_id, vector_store, snapshot.token)
             logger.info(
-                f"Index or chunks file not found for chat {chat_id}. Returning empty context.")
-            return []
+                f"Committed {len(vector_ids)} chunks of '{file_name}' to index of chat {chat_id}.")
 
         try:
-            vector_store = FAISS.load_local(
-                index_path,
-                self.embedding_model,
-                allow_dangerous_deserialization=True)
-            faiss_retriever = vector_store.as_retriever(search_kwargs={"k": 4})
-            logger.info("FAISS retriever loaded.")
+            batch = []
+            batches_since_commit = 0
+            for section in sections:
+                for chunk in self.text_splitter.split_documents([section]):
+                    batch.append(chunk)
+                    if len(batch) < Config.RAG_INGEST_BATCH_SIZE:
+                        continue
+                    flush(batch)
+                    batch = []
+                    batches_since_commit += 1
+                    if batches_since_commit >= Config.RAG_INGEST_COMMIT_EVERY:
+                        commit(complete=False)
+                        snapshots.prune(Config.RAG_SNAPSHOT_GRACE_S)
+                        batches_since_commit = 0
+            if batch:
+                flush(batch)
 
-            with open(chunks_path, "rb") as f:
-                all_chunks = pickle.load(f)
+            if vector_store is None or not chunk_ranges:
+                logger.warning(f"Document '{file_name}' produced no chunks.")
+                return []
+            commit(complete=True)
+        except Exception:
+            # хранилища дописываются до публикации снимка - убираем то, что
+            # не попало в опубликованный индекс
+            self._align_side_stores(chat_id, published["count"], chunk_store, lexical_index, dedup_index)
+            if published["partial"]:
+                # его чанки остаются в индексе мертвыми до компакции
+                if previous_entry is not None:
+                    manifest.documents[file_name] = previous_entry
+                else:
+                    manifest.tombstone(file_name)
+                snapshots.publish(manifest)
+                logger.warning(f"Rolled back partially indexed document '{file_name}' of chat {chat_id}.")
+            raise
+        snapshots.prune(Config.RAG_SNAPSHOT_GRACE_S)
+        logger.info(f"Document '{file_name}' split into {len(vector_ids)} new chunks.")
+        if duplicates["chunks"]:
+            logger.info(
+                f"Skipped {duplicates['chunks']} near-duplicate chunks "
+                f"({duplicates['bytes']} bytes) of '{file_name}'.")
+        return kept_chunks
 
-            if not all_chunks:
-                logger.warning(
-                    f"No chunks loaded from {chunks_path}. Skipping BM25.")
-                return faiss_retriever.invoke(question)
+    def query_index(self, question: str, chat_id: int, with_scores: bool = False) -> list:
+        """
+        Гибридный поиск (BM25 + FAISS) с переранжированием, топ-3 чанка.
+        with_scores - вернуть пары (чанк, оценка реранкера) для RelevanceGate.
+        """
+        # индекс и манифест берем из одного снимка: параллельная запись его не меняет
+        snapshot = self._snapshots(chat_id).current()
 
-            bm25_retriever = BM25Retriever.from_documents(all_chunks, k=4)
-            logger.info("BM25 retriever initialized.")
+        if not snapshot.exists():
+            logger.info(
+                f"Index not found for chat {chat_id}. Returning empty context.")
+            return []
+
+        try:
+            vector_store = self._load_vector_store(chat_id, snapshot)
+            lexical_index = self._get_lexical_index(chat_id)
+            ensemble = self._hybrid_ensemble(vector_store, lexical_index)
+            dead_ids = self._dead_chunk_ids(chat_id, snapshot, vector_store.index.ntotal)
 
-            ensemble_retriever = EnsembleRetriever(
-                retrievers=[bm25_retriever, faiss_retriever],
-                weights=[0.5, 0.5]
-            )
             logger.info(
-                f"Querying EnsembleRetriever for chat {chat_id} with question: '{question[:50]}...'")
+                f"Querying hybrid index for chat {chat_id} with question: '{question[:50]}...'")
+            query_vector = np.array(
+                [self.embedding_model.embed_query(question)], dtype=np.float32)
+            if vector_store._normalize_L2:
+                faiss.normalize_L2(query_vector)
+            _, indices = vector_store.index.search(query_vector, self._fetch_k(dead_ids))
 
-            retrieved_docs = ensemble_retriever.invoke(question)
+            retrieved_docs = self._hybrid_candidates(
+                ensemble, vector_store, lexical_index, question, indices[0], dead_ids)
 
             # Этап переранжирования
             if not retrieved_docs:
@@ -202,6 +657,8 @@ class RAGService:
                 doc_scores, key=lambda x: x[1], reverse=True)
 
             # Возвращаем только топ-3 документа после переранжирования
+            if with_scores:
+                return [(doc, float(score)) for doc, score in sorted_doc_scores[:3]]
             reranked_docs = [doc for doc, score in sorted_doc_scores[:3]]
 
             logger.info(
@@ -212,26 +669,73 @@ class RAGService:
             logger.error(f"Failed to query index for chat {chat_id}: {e}")
             return []
 
+    def query_many(self, questions: List[str], chat_id: int) -> List[list]:
+        """
+        Пакетный вариант query_index для нескольких вопросов к одному чату:
+        индекс открывается один раз, все вопросы эмбеддятся одним батчем и ищутся
+        одним вызовом FAISS, а все пары (вопрос, чанк) идут в реранкер одним батчем.
+        Гибридное слияние (RRF) и топ-3 - как в query_index.
+        """
+        if not questions:
+            return []
+        snapshot = self._snapshots(chat_id).current()
+        if not snapshot.exists():
+            logger.info(
+                f"Index not found for chat {chat_id}. Returning empty context.")
+            return [[] for _ in questions]
+
+        try:
+            vector_store = self._load_vector_store(chat_id, snapshot)
+            lexical_index = self._get_lexical_index(chat_id)
+            ensemble = self._hybrid_ensemble(vector_store, lexical_index)
+            dead_ids = self._dead_chunk_ids(chat_id, snapshot, vector_store.index.ntotal)
+
+            query_vectors = np.array(
+                self.embedding_scheduler.embed_documents(list(questions)), dtype=np.float32)
+            if vector_store._normalize_L2:
+                faiss.normalize_L2(query_vectors)
+            _, indices = vector_store.index.search(query_vectors, self._fetch_k(dead_ids))
+
+            candidates = [self._hybrid_candidates(ensemble, vector_store, lexical_index, question, positions, dead_ids)
+                          for question, positions in zip(questions, indices)]
+
+            doc_pairs = [(question, doc.page_content)
+                         for question, docs in zip(questions, candidates) for doc in docs]
+            logger.info(
+                f"Reranking {len(doc_pairs)} documents for {len(questions)} questions in chat {chat_id}.")
+            scores = self.reranker.score(doc_pairs) if doc_pairs else []
+
+            results = []
+            offset = 0
+            for docs in candidates:
+                doc_scores = list(zip(docs, scores[offset:offset + len(docs)]))
+                offset += len(docs)
+                sorted_doc_scores = sorted(doc_scores, key=lambda x: x[1], reverse=True)
+                results.append([doc for doc, score in sorted_doc_scores[:3]])
+            return results
+
+        except Exception as e:
+            logger.error(f"Failed to query index for chat {chat_id}: {e}")
+            return [[] for _ in questions]
+
     def get_document_chunks(self, question: str, chat_id: int, file_name: str) -> list:
-        index_path = self._get_index_path(chat_id)
-        chunks_path = self._get_chunks_path(chat_id)
+        snapshot = self._snapshots(chat_id).current()
 
-        if not os.path.exists(index_path) or not os.path.exists(chunks_path):
+        if not snapshot.exists():
             logger.info(
-                f"Index or chunks file not found for chat {chat_id}. Returning empty context.")
+                f"Index not found for chat {chat_id}. Returning empty context.")
             return []
-        with open(chunks_path, "rb") as f:
-            all_chunks = pickle.load(f)
-
-        # фильтруем чанки по имени файла
-        focused_chunks = [chunk for chunk in all_chunks if
-                          os.path.basename(chunk.metadata.get('source', '')) == file_name]
 
-        # создаем временный FAISS-индекс только для скинутого файла
-        temp_vector_store = FAISS.from_documents(focused_chunks, self.embedding_model)
-        temp_retriever = temp_vector_store.as_retriever(search_kwargs={"k": 4})
+        # позиции векторов файла в индексе чата совпадают с id его чанков;
+        # манифест и индекс - из одного снимка, иначе компакция между ними сдвинула бы id
+        chunk_ids = self._get_manifest(chat_id, snapshot).get_chunk_ids(file_name)
+        if not chunk_ids:
+            logger.info(f"No chunks found for '{file_name}' in chat {chat_id}.")
+            return []
 
-        retrieved_docs = temp_retriever.invoke(question)
+        vector_store = self._load_vector_store(chat_id, snapshot)
+        retrieved_docs = self._search_positions(
+            vector_store, question, chunk_ids, k=4)
         logger.info(f"Retrieved {len(retrieved_docs)} documents from {file_name}.")
 
         if retrieved_docs:  # TODO: maybe BM25
@@ -244,4 +748,302 @@ class RAGService:
 
         return retrieved_docs
 
-        return []
\ No newline at end of file
+    def _search_positions(self, vector_store, question: str, positions: list, k: int) -> list:
+        """
+        Ищет ближайшие к вопросу векторы только среди указанных позиций индекса
+        (IDSelector), используя уже сохраненные векторы - эмбеддится только сам вопрос.
+        """
+        query_vector = np.array(
+            [self.embedding_model.embed_query(question)], dtype=np.float32)
+        if vector_store._normalize_L2:
+            faiss.normalize_L2(query_vector)
+
+        k = min(k, len(positions))
+        index = vector_store.index
+        if is_flat(index):
+            selector = faiss.IDSelectorBatch(np.array(positions, dtype=np.int64))
+            params = faiss.SearchParameters(sel=selector)
+            _, indices = index.search(query_vector, k, params=params)
+        else:
+            # в графе HNSW / IVF фильтр по малой доле позиций теряет соседей,
+            # поэтому векторы файла достаем из индекса и сравниваем точно
+            ids = np.array(positions, dtype=np.int64)
+            exact = faiss.IndexFlat(index.d, index.metric_type)
+            exact.add(index.reconstruct_batch(ids))
+            _, local = exact.search(query_vector, k)
+            indices = np.where(local >= 0, ids[local], -1)
+
+        return self._docs_at_positions(vector_store, indices[0])
+
+    def _exact_vectors(self, vector_store, chunk_store: ChunkStore, ids: Iterable[int]) -> np.ndarray:
+        """
+        Исходные векторы позиций ids. Flat и HNSW хранят их как есть, а IVF-PQ -
+        только сжатые коды: пересборка из reconstruct с каждым разом теряла бы
+        точность, поэтому векторы заново считаются по текстам чанков (в основном
+        это попадания в кэш эмбеддингов).
+        """
+        ids = np.fromiter(ids, dtype=np.int64)
+        index = vector_store.index
+        if stores_exact_vectors(index):
+            return index.reconstruct_batch(ids)
+
+        logger.info(f"Re-embedding {len(ids)} chunks: {type(index).__name__} keeps only compressed vectors.")
+        vectors = []
+        for start in range(0, len(ids), 512):
+            chunks = chunk_store.read(ids[start:start + 512].tolist())
+            vectors.extend(self.embedding_model.embed_documents([chunk.page_content for chunk in chunks]))
+        vectors = np.array(vectors, dtype=np.float32).reshape(len(ids), index.d)
+        if vector_store._normalize_L2:
+            faiss.normalize_L2(vectors)
+        return vectors
+
+    @staticmethod
+    def _hybrid_ensemble(vector_store, lexical_index: LexicalIndex) -> EnsembleRetriever:
+        # ретриверы здесь не вызываются, объект нужен для слияния RRF
+        return EnsembleRetriever(
+            retrievers=[LexicalRetriever(index=lexical_index, k=HYBRID_K),
+                        vector_store.as_retriever(search_kwargs={"k": HYBRID_K})],
+            weights=[0.5, 0.5]
+        )
+
+    @staticmethod
+    def _fetch_k(dead_ids: frozenset) -> int:
+        return HYBRID_K * 2 if dead_ids else HYBRID_K
+
+    def _hybrid_candidates(self, ensemble: EnsembleRetriever, vector_store, lexical_index: LexicalIndex,
+                           question: str, positions, dead_ids: frozenset) -> list:
+        """
+        Слияние (RRF) выдачи BM25 и найденных FAISS позиций. Мертвые чанки
+        отсеиваются по id, а не по имени файла: чанк удаленного документа, на
+        который ссылается живой, остается в выдаче, и наоборот. Строки BM25 за
+        пределами снимка (их пишет идущая сейчас индексация) тоже отсеиваются.
+        """
+        ntotal = vector_store.index.ntotal
+        faiss_docs = [doc for position, doc in self._hits_at_positions(vector_store, positions)
+                      if position not in dead_ids][:HYBRID_K]
+        bm25_docs = [doc for chunk_id, doc in lexical_index.search_with_ids(question, self._fetch_k(dead_ids))
+                     if chunk_id < ntotal and chunk_id not in dead_ids][:HYBRID_K]
+        return ensemble.weighted_reciprocal_rank([bm25_docs, faiss_docs])
+
+    def _dead_chunk_ids(self, chat_id: int, snapshot: Snapshot, total: int) -> frozenset:
+        """id мертвых чанков снимка (см. DocumentManifest.dead_chunk_ids), с кэшем на версию."""
+        key = (snapshot.token, total)
+        cached = _dead_chunk_ids_cache.get(chat_id)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        dead_ids = frozenset(self._get_manifest(chat_id, snapshot).dead_chunk_ids(total))
+        _dead_chunk_ids_cache[chat_id] = (key, dead_ids)
+        return dead_ids
+
+    @staticmethod
+    def _hits_at_positions(vector_store, positions) -> List[Tuple[int, Document]]:
+        """
+        Пары (позиция, чанк) по результату поиска FAISS (-1 пропускается).
+        Docstore на отсутствующий id возвращает строку-сообщение, а не
+        Document: такие позиции пропускаются с предупреждением.
+        """
+        hits = []
+        for position in positions:
+            if position == -1:
+                continue
+            doc_id = vector_store.index_to_docstore_id.get(int(position))
+            if doc_id is None:
+                continue
+            doc = vector_store.docstore.search(doc_id)
+            if not isinstance(doc, Document):
+                logger.warning(f"Vector at position {position} has no chunk in the docstore: {doc}")
+                continue
+            hits.append((int(position), doc))
+        return hits
+
+    @classmethod
+    def _docs_at_positions(cls, vector_store, positions) -> list:
+        """Чанки по позициям векторов из результата поиска FAISS (-1 пропускается)."""
+        return [doc for _, doc in cls._hits_at_positions(vector_store, positions)]
+
+    def delete_document(self, chat_id: int, file_name: str) -> bool:
+        """
+        Помечает документ чата удаленным (tombstone). Из поиска по файлу он
+        пропадает сразу, из общей выдачи чата - фильтром по id его чанков, а
+        место на диске освобождает компакция (compact_index).
+        """
+        snapshots = self._snapshots(chat_id)
+        with snapshots.lock.hold():
+            manifest = self._get_manifest(chat_id)
+            if not manifest.tombstone(file_name):
+                return False
+            snapshots.publish(manifest)
+        logger.info(f"Document '{file_name}' of chat {chat_id} marked as deleted.")
+        return True
+
+    def chat_index_files(self, chat_id: int) -> List[str]:
+        """Все файлы и папки чата в RAG_INDEXES_DIR (индекс, чанки, BM25, манифест...)."""
+        patterns = [f"chat_{chat_id}", f"chat_{chat_id}_*", f"chat_{chat_id}.*"]
+        return sorted(path for pattern in patterns
+                      for path in glob.glob(os.path.join(RAG_INDEXES_DIR, pattern)))
+
+    @staticmethod
+    def _disk_usage(paths: List[str]) -> int:
+        size = 0
+        for path in paths:
+            if os.path.isdir(path):
+                for root, _, files in os.walk(path):
+                    size += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+            elif os.path.exists(path):
+                size += os.path.getsize(path)
+        return size
+
+    def purge_chat_index(self, chat_id: int, archive_dir: Optional[str] = None,
+                         dry_run: bool = False) -> dict:
+        """
+        Удаляет все файлы индекса чата; если задан archive_dir, предварительно
+        упаковывает их туда в chat_{id}_{время}.tar.gz.
+        """
+        if dry_run:
+            paths = self.chat_index_files(chat_id)
+            return {"chat_id": chat_id, "files": [os.path.basename(p) for p in paths],
+                    "bytes": self._disk_usage(paths), "archive": None}
+
+        with self._snapshots(chat_id).lock.hold():
+            paths = self.chat_index_files(chat_id)
+            report = {"chat_id": chat_id, "files": [os.path.basename(p) for p in paths],
+                      "bytes": self._disk_usage(paths), "archive": None}
+            if not paths:
+                return report
+
+            if archive_dir:
+                os.makedirs(archive_dir, exist_ok=True)
+                archive_path = os.path.join(
+                    archive_dir, f"chat_{chat_id}_{datetime.now():%Y%m%d%H%M%S}.tar.gz")
+                with tarfile.open(archive_path, "w:gz") as tar:
+                    for path in paths:
+                        tar.add(path, arcname=os.path.basename(path))
+                report["archive"] = archive_path
+
+            index_cache.invalidate(chat_id)
+            _lexical_index_cache.pop(chat_id, None)
+            for path in paths:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+        logger.info(
+            f"Purged index of chat {chat_id}: {len(paths)} files, {report['bytes']} bytes"
+            + (f", archived to '{report['archive']}'." if report["archive"] else "."))
+        return report
+
+    def compaction_report(self, chat_id: int, snapshot: Optional[Snapshot] = None) -> dict:
+        snapshot = snapshot or self._snapshots(chat_id).current()
+        manifest = self._get_manifest(chat_id, snapshot)
+        total = len(self._get_chunk_store(chat_id, snapshot))
+        dead = len(manifest.dead_chunk_ids(total))
+        return {
+            "chat_id": chat_id,
+            "chunks": total,
+            "dead_chunks": dead,
+            "dead_ratio": dead / total if total else 0.0,
+            "tombstoned": manifest.tombstoned(),
+        }
+
+    def prune_snapshots(self, chat_id: int) -> List[str]:
+        """Удаляет устаревшие снимки индекса чата (см. ChatSnapshots.prune)."""
+        snapshots = self._snapshots(chat_id)
+        with snapshots.lock.hold():
+            return snapshots.prune(Config.RAG_SNAPSHOT_GRACE_S)
+
+    def compact_index(self, chat_id: int) -> dict:
+        """
+        Переписывает хранилище чанков, FAISS, BM25 и LSH-индекс чата только с
+        чанками живых документов и перенумеровывает их (id чанка == позиция
+        вектора), затем убирает tombstone-записи из манифеста.
+
+        Новые хранилище чанков и FAISS публикуются отдельным снимком, так что
+        читающие запросы до конца работают со старыми файлами.
+        """
+        snapshots = self._snapshots(chat_id)
+        with snapshots.lock.hold():
+            snapshot = snapshots.current()
+            manifest = self._get_manifest(chat_id, snapshot)
+            # индексация держит эту же блокировку, так что недописанный
+            # документ здесь - остаток упавшего процесса, а не идущая загрузка
+            abandoned = manifest.tombstone_incomplete()
+            if abandoned:
+                logger.warning(f"Discarding partially indexed documents of chat {chat_id}: {abandoned}.")
+                snapshot = snapshots.publish(manifest)
+            report = self.compaction_report(chat_id, snapshot)
+            if not report["dead_chunks"] and not report["tombstoned"]:
+                return report
+            if not manifest.live_documents:
+                logger.info(f"All documents of chat {chat_id} are deleted. Removing its index.")
+                self.purge_chat_index(chat_id)
+                return report
+
+            chunk_store = self._get_chunk_store(chat_id, snapshot)
+            vector_store = FAISS.load_local(
+                snapshot.index_path, self.embedding_model, allow_dangerous_deserialization=True)
+            live_ids = sorted(i for i in manifest.live_chunk_ids()
+                              if i < min(len(chunk_store), vector_store.index.ntotal))
+            new_ids = {old: new for new, old in enumerate(live_ids)}
+
+            compact_store = ChunkStore(os.path.join(
+                RAG_INDEXES_DIR, f"chat_{chat_id}_chunks.v{snapshot.version + 1}"))
+            for path in (compact_store.log_path, compact_store.idx_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            for start in range(0, len(live_ids), 512):
+                compact_store.append(chunk_store.read(live_ids[start:start + 512]))
+
+            # исходные векторы живых чанков в новом порядке
+            index = vector_store.index
+            flat = faiss.IndexFlat(index.d, index.metric_type)
+            flat.add(self._exact_vectors(vector_store, chunk_store, live_ids))
+            docstore_ids = {new: vector_store.index_to_docstore_id[old] for old, new in new_ids.items()}
+            compact_vector_store = FAISS(
+                self.embedding_model, flat,
+                InMemoryDocstore({doc_id: vector_store.docstore.search(doc_id)
+                                  for doc_id in docstore_ids.values()}),
+                docstore_ids,
+                normalize_L2=vector_store._normalize_L2,
+                distance_strategy=vector_store.distance_strategy)
+            index_info = maybe_promote(compact_vector_store, {}, lambda: flat.reconstruct_n(0, flat.ntotal)) \
+                or {"type": "flat"}
+
+            for name in manifest.tombstoned():
+                del manifest.documents[name]
+            for entry in manifest.documents.values():
+                ranges = []
+                for chunk_id in DocumentManifest._entry_chunk_ids(entry):
+                    if chunk_id not in new_ids:
+                        continue
+                    chunk_id = new_ids[chunk_id]
+                    if ranges and ranges[-1][1] == chunk_id:
+                        ranges[-1][1] = chunk_id + 1
+                    else:
+                        ranges.append([chunk_id, chunk_id + 1])
+                entry["chunks"] = ranges
+            manifest.index_info = index_info
+
+            # BM25 и LSH заменяются транзакцией каждый до публикации (BM25 отдает
+            # сами чанки, а не их id, а LSH читают только писатели под этой же
+            # блокировкой); если сбой случится до нее, следующий писатель
+            # увидит в них меньше записей, чем векторов, и пересоберет их
+            lexical_index = self._get_lexical_index(chat_id)
+            dedup_index = self._get_dedup_index(chat_id)
+            try:
+                lexical_index.replace_all(compact_store)
+                if dedup_index is not None:
+                    dedup_index.add([(chunk_id, dedup_index.hasher.signature(chunk.page_content))
+                                     for chunk_id, chunk in enumerate(compact_store)], replace_all=True)
+                # чанки, FAISS и манифест - одним снимком
+                snapshots.publish(manifest, compact_vector_store,
+                                  chunks_base=compact_store.idx_path[:-len(".idx")])
+            except Exception:
+                self._align_side_stores(chat_id, vector_store.index.ntotal, chunk_store, lexical_index, dedup_index)
+                raise
+            index_cache.invalidate(chat_id)
+            snapshots.prune(Config.RAG_SNAPSHOT_GRACE_S)
+
+        report["compacted_chunks"] = len(live_ids)
+        logger.info(
+            f"Compacted index of chat {chat_id}: {report['chunks']} -> {len(live_ids)} chunks.")
+        return report
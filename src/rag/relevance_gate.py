@@ -0,0 +1,85 @@
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from src.config.config import Config
+from src.utlis.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+ACCEPT = "accept"
+REJECT = "reject"
+AMBIGUOUS = "ambiguous"
+# шкала оценок реранкера, к которой относятся пороги: оба бэкенда (torch и
+# onnx) отдают sigmoid(logit); пороги, откалиброванные на другой шкале, не годятся
+SCORE_SCALE = "sigmoid"
+
+
+class RelevanceGate:
+    """
+    Решение "использовать ли найденный контекст" по лучшей оценке реранкера
+    (вероятность релевантности пары вопрос-чанк, 0..1) вместо отдельного
+    вызова LLM:
+    - оценка >= accept_score - контекст релевантен;
+    - оценка < reject_score - нерелевантен;
+    - между порогами - неоднозначно: решает LLM (RAG_RELEVANCE_LLM_TIEBREAK)
+      или, без нее, середина полосы.
+
+    Пороги берутся из файла калибровки (src.rag.calibrate_relevance), если он
+    есть, иначе из Config. Каждое решение пишется строкой JSONL в log_path -
+    это данные для следующей калибровки.
+    """
+
+    def __init__(self, accept_score: float, reject_score: float, log_path: Optional[str] = None):
+        if reject_score > accept_score:
+            raise ValueError(
+                f"reject_score ({reject_score}) must not exceed accept_score ({accept_score})")
+        self.accept_score = accept_score
+        self.reject_score = reject_score
+        self.log_path = log_path
+        self._log_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls) -> "RelevanceGate":
+        accept_score = Config.RAG_RELEVANCE_ACCEPT_SCORE
+        reject_score = Config.RAG_RELEVANCE_REJECT_SCORE
+        path = Config.RAG_RELEVANCE_THRESHOLDS_FILE
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                calibrated = json.load(f)
+            if calibrated.get("score_scale") != SCORE_SCALE:
+                logger.warning(
+                    f"Relevance thresholds in '{path}' were calibrated on score scale "
+                    f"'{calibrated.get('score_scale', 'unknown')}', not '{SCORE_SCALE}'. Using defaults from config.")
+            else:
+                accept_score, reject_score = calibrated["accept"], calibrated["reject"]
+                logger.info(
+                    f"Loaded calibrated relevance thresholds from '{path}': "
+                    f"accept >= {accept_score:.4f}, reject < {reject_score:.4f}.")
+        return cls(accept_score, reject_score, Config.RAG_RELEVANCE_LOG or None)
+
+    def decide(self, top_score: float, tiebreak: bool = True) -> str:
+        """ACCEPT / REJECT, или AMBIGUOUS, если tiebreak и оценка в полосе между порогами."""
+        if top_score >= self.accept_score:
+            return ACCEPT
+        if top_score < self.reject_score:
+            return REJECT
+        if tiebreak:
+            return AMBIGUOUS
+        return ACCEPT if top_score >= (self.accept_score + self.reject_score) / 2 else REJECT
+
+    def log(self, record: dict) -> None:
+        if not self.log_path:
+            return
+        record = {"ts": time.time(), "score_scale": SCORE_SCALE, "accept_score": self.accept_score,
+                  "reject_score": self.reject_score, **record}
+        line = json.dumps(record, ensure_ascii=False)
+        with self._log_lock:
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+relevance_gate = RelevanceGate.from_config()
@@ -0,0 +1,75 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Tuple
+
+from langchain_community.cross_encoders import BaseCrossEncoder
+
+from src.utlis.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+def _normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class CachedCrossEncoder(BaseCrossEncoder):
+    """
+    LRU-кэш оценок реранкера по ключу (хэш нормализованного запроса, хэш чанка).
+    Повторные вопросы и перегенерации ответа не гоняют одни и те же пары через модель.
+    """
+
+    def __init__(self, cross_encoder: BaseCrossEncoder, max_entries: int):
+        self.cross_encoder = cross_encoder
+        self.max_entries = max_entries
+        self._scores: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def score(self, text_pairs: List[Tuple[str, str]]) -> List[float]:
+        keys = [(_digest(_normalize_query(query)), _digest(text))
+                for query, text in text_pairs]
+
+        scores = [None] * len(keys)
+        missing = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    scores[i] = self._scores[key]
+                else:
+                    missing.setdefault(key, text_pairs[i])
+            self.hits += len(keys) - sum(1 for s in scores if s is None)
+            self.misses += sum(1 for s in scores if s is None)
+
+        if missing:
+            computed = self.cross_encoder.score(list(missing.values()))
+            computed = dict(zip(missing.keys(), (float(s) for s in computed)))
+            with self._lock:
+                for key, value in computed.items():
+                    self._scores[key] = value
+                    self._scores.move_to_end(key)
+                while len(self._scores) > self.max_entries:
+                    self._scores.popitem(last=False)
+            for i, key in enumerate(keys):
+                if scores[i] is None:
+                    scores[i] = computed[key]
+
+        return scores
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._scores),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
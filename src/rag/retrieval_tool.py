@@ -0,0 +1,59 @@
+import os
+from typing import List
+
+from langchain_core.documents import Document
+from langchain_core.tools import StructuredTool
+
+from src.backend.executors import rag_executor
+from src.rag.relevance_gate import REJECT, relevance_gate
+from src.utlis.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+TOOL_DESCRIPTION = (
+    "Searches the documents uploaded to the current chat and returns the most relevant passages "
+    "with their file names. Use it whenever the question may be answered by the user's documents. "
+    "Pass a standalone search query: resolve pronouns and references using the conversation.")
+
+
+def _format_passages(docs: List[Document]) -> str:
+    return "\n\n".join(
+        f"[{i}] (source: {os.path.basename(doc.metadata.get('source', 'unknown'))})\n{doc.page_content}"
+        for i, doc in enumerate(docs, start=1))
+
+
+def make_chat_retrieval_tool(rag_service, chat_id: int, found_docs: List[Document]) -> StructuredTool:
+    """
+    Инструмент агента "поиск по документам чата". chat_id зашит в замыкание -
+    модель не может искать в чужом чате. Чанки, которые прошли RelevanceGate,
+    добавляются в found_docs: из них строятся контекст ответа и источники.
+    """
+
+    def accept(scored_docs: list) -> str:
+        if not scored_docs:
+            return "No documents are indexed in this chat."
+        top_score = max(score for _, score in scored_docs)
+        # в агентном режиме неоднозначные чанки оценивает сам агент; гейт
+        # только отсекает заведомо нерелевантные, без лишнего вызова LLM
+        if relevance_gate.decide(top_score) == REJECT:
+            logger.info(
+                f"Agent search in chat {chat_id}: top rerank score {top_score:.4f} is below the reject threshold.")
+            return "No relevant passages found in the chat documents."
+        docs = [doc for doc, _ in scored_docs]
+        known = {(doc.metadata.get('source'), doc.page_content) for doc in found_docs}
+        found_docs.extend(doc for doc in docs
+                          if (doc.metadata.get('source'), doc.page_content) not in known)
+        return _format_passages(docs)
+
+    def search_chat_documents(query: str) -> str:
+        return accept(rag_service.query_index(query, chat_id, with_scores=True))
+
+    async def asearch_chat_documents(query: str) -> str:
+        logger.info(f"Agent searches chat {chat_id} documents: '{query[:50]}'")
+        return accept(await rag_executor.run(rag_service.query_index, query, chat_id, with_scores=True))
+
+    return StructuredTool.from_function(
+        func=search_chat_documents,
+        coroutine=asearch_chat_documents,
+        name="search_chat_documents",
+        description=TOOL_DESCRIPTION)
@@ -0,0 +1,279 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from src.utlis.logging_config import get_logger
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+logger = get_logger(__name__)
+
+LOCKS_DIR = ".locks"
+POINTER_FILE = "CURRENT"
+_VERSION_RE = re.compile(r"^v(\d+)$")
+
+
+def _lock_fd(fd: int, blocking: bool) -> bool:
+    if os.name == "nt":
+        mode = msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK
+        while True:
+            try:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, mode, 1)
+                return True
+            except OSError:
+                # LK_LOCK сдается через ~10 секунд - ждем дальше
+                if not blocking:
+                    return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        return True
+    except BlockingIOError:
+        return False
+
+
+def _unlock_fd(fd: int) -> None:
+    if os.name == "nt":
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class FileLock:
+    """
+    Эксклюзивная блокировка на файле, общая для процессов (flock / msvcrt.locking)
+    и потоков одного процесса. Повторный захват тем же потоком не блокирует.
+
+    Файл блокировки никогда не удаляется: иначе процесс, ждущий на старом
+    файле, и процесс, создавший новый, держали бы блокировку одновременно.
+    """
+
+    _registry: Dict[str, "FileLock"] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd: Optional[int] = None
+
+    @classmethod
+    def for_path(cls, path: str) -> "FileLock":
+        path = os.path.abspath(path)
+        with cls._registry_lock:
+            lock = cls._registry.get(path)
+            if lock is None:
+                lock = cls._registry[path] = cls(path)
+            return lock
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if not self._thread_lock.acquire(blocking):
+            return False
+        if self._depth == 0:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            if not _lock_fd(fd, blocking):
+                os.close(fd)
+                self._thread_lock.release()
+                return False
+            self._fd = fd
+        self._depth += 1
+        return True
+
+    def release(self) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            _unlock_fd(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+
+    @contextmanager
+    def hold(self, blocking: bool = True) -> Iterator[bool]:
+        """with lock.hold(blocking=False) as acquired: ..."""
+        acquired = self.acquire(blocking)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self.release()
+
+
+class Snapshot:
+    """Одна версия индекса чата: папка FAISS, манифест и база хранилища чанков."""
+
+    def __init__(self, version: int, token, index_path: str, manifest_path: str, chunks_base: str):
+        self.version = version
+        # токен для IndexCache: версия + время публикации (версии начинаются
+        # заново после удаления индекса чата)
+        self.token = token
+        self.index_path = index_path
+        self.manifest_path = manifest_path
+        self.chunks_base = chunks_base
+
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.index_path, "index.faiss"))
+
+
+class ChatSnapshots:
+    """
+    Версионированные снимки индекса чата.
+
+    Каждая запись (коммит индексации, удаление документа, компакция) пишет
+    новую папку chat_{id}/v{N}/ с index.faiss, index.pkl и manifest.json и
+    затем атомарно (запись во временный файл + os.replace) переключает
+    указатель chat_{id}/CURRENT. Хранилище чанков append-only и общее для
+    версий; компакция заводит новое и переключает его тем же указателем.
+
+    Читатели не берут блокировок: они один раз читают указатель и работают с
+    неизменяемым снимком. Писатели сериализуются блокировкой чата (lock),
+    общей для всех воркеров. Старые снимки удаляются (prune) не раньше чем
+    через grace_s после того, как перестали быть текущими, чтобы не выдернуть
+    их из-под читающих запросов.
+    """
+
+    def __init__(self, indexes_dir: str, chat_id: int):
+        self.indexes_dir = indexes_dir
+        self.chat_id = chat_id
+        self.chat_dir = os.path.join(indexes_dir, f"chat_{chat_id}")
+        self.pointer_path = os.path.join(self.chat_dir, POINTER_FILE)
+        self.lock = FileLock.for_path(os.path.join(indexes_dir, LOCKS_DIR, f"chat_{chat_id}.lock"))
+
+    def _legacy_snapshot(self) -> Snapshot:
+        # чат проиндексирован до появления снимков: индекс лежит прямо в chat_{id}/
+        try:
+            token = (0, os.stat(os.path.join(self.chat_dir, "index.faiss")).st_mtime_ns)
+        except FileNotFoundError:
+            token = None
+        return Snapshot(
+            0, token, self.chat_dir,
+            os.path.join(self.indexes_dir, f"chat_{self.chat_id}_manifest.json"),
+            os.path.join(self.indexes_dir, f"chat_{self.chat_id}_chunks"))
+
+    def _read_pointer(self) -> Optional[dict]:
+        try:
+            with open(self.pointer_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def current(self) -> Snapshot:
+        pointer = self._read_pointer()
+        if pointer is None:
+            return self._legacy_snapshot()
+        version_dir = os.path.join(self.chat_dir, f"v{pointer['version']}")
+        return Snapshot(
+            pointer["version"], (pointer["version"], pointer["created_at"]), version_dir,
+            os.path.join(version_dir, "manifest.json"),
+            os.path.join(self.indexes_dir, pointer["chunks"]))
+
+    def publish(self, manifest, vector_store=None, chunks_base: Optional[str] = None) -> Snapshot:
+        """
+        Записывает новый снимок и делает его текущим. vector_store=None - индекс
+        не менялся, его файлы берутся из текущего снимка (жесткими ссылками).
+        chunks_base - новое хранилище чанков (после компакции).
+
+        Вызывать под self.lock.
+        """
+        current = self.current()
+        pointer = self._read_pointer() or {}
+        version = current.version + 1
+        version_dir = os.path.join(self.chat_dir, f"v{version}")
+        tmp_dir = version_dir + ".tmp"
+        # остатки записи, прерванной до переключения указателя
+        for path in (tmp_dir, version_dir):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+        os.makedirs(tmp_dir)
+
+        if vector_store is not None:
+            vector_store.save_local(tmp_dir)
+        else:
+            for name in ("index.faiss", "index.pkl"):
+                src = os.path.join(current.index_path, name)
+                try:
+                    os.link(src, os.path.join(tmp_dir, name))
+                except OSError:
+                    shutil.copy2(src, os.path.join(tmp_dir, name))
+        manifest.path = os.path.join(tmp_dir, "manifest.json")
+        manifest.save()
+        os.rename(tmp_dir, version_dir)
+        manifest.path = os.path.join(version_dir, "manifest.json")
+
+        now = time.time()
+        new_pointer = {
+            "version": version,
+            "created_at": now,
+            "chunks": os.path.basename(chunks_base or current.chunks_base),
+            # когда сменилось хранилище чанков: прежнее удаляется через grace_s
+            "chunks_since": now if chunks_base else pointer.get("chunks_since", now),
+        }
+        tmp_pointer = self.pointer_path + ".tmp"
+        with open(tmp_pointer, "w", encoding="utf-8") as f:
+            json.dump(new_pointer, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_pointer, self.pointer_path)
+        logger.info(f"Published index snapshot v{version} of chat {self.chat_id}.")
+        return self.current()
+
+    def _versions(self) -> List[int]:
+        if not os.path.isdir(self.chat_dir):
+            return []
+        return sorted(int(match.group(1)) for name in os.listdir(self.chat_dir)
+                      if (match := _VERSION_RE.match(name)))
+
+    def prune(self, grace_s: float) -> List[str]:
+        """
+        Удаляет снимки, хранилища чанков и файлы старого формата, которые
+        перестали быть текущими больше grace_s назад. Вызывать под self.lock.
+        """
+        pointer = self._read_pointer()
+        if pointer is None:
+            return []
+        now = time.time()
+        stale = []
+
+        versions = [v for v in self._versions() if v <= pointer["version"]]
+        # снимок перестал быть текущим, когда был опубликован следующий
+        for older, newer in zip(versions, versions[1:]):
+            if now - os.path.getmtime(os.path.join(self.chat_dir, f"v{newer}")) > grace_s:
+                stale.append(os.path.join(self.chat_dir, f"v{older}"))
+
+        if versions and now - os.path.getmtime(os.path.join(self.chat_dir, f"v{versions[0]}")) > grace_s:
+            legacy = self._legacy_snapshot()
+            stale.extend(path for path in (
+                os.path.join(legacy.index_path, "index.faiss"),
+                os.path.join(legacy.index_path, "index.pkl"),
+                legacy.manifest_path) if os.path.exists(path))
+
+        if now - pointer.get("chunks_since", now) > grace_s:
+            prefix = f"chat_{self.chat_id}_chunks"
+            stale.extend(
+                os.path.join(self.indexes_dir, name) for name in os.listdir(self.indexes_dir)
+                if name.startswith(prefix) and name.endswith((".log", ".idx"))
+                and os.path.splitext(name)[0] != pointer["chunks"])
+
+        removed = []
+        for path in stale:
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                removed.append(path)
+            except OSError as e:
+                # на Windows файл, открытый читателем через mmap, не удалить - до следующего раза
+                logger.warning(f"Could not remove stale index file '{path}': {e}")
+        if removed:
+            logger.info(f"Pruned {len(removed)} stale index files of chat {self.chat_id}.")
+        return removed
@@ -0,0 +1,45 @@
+import inspect
+from typing import List, Optional, Tuple
+
+import numpy as np
+from langchain_community.cross_encoders import BaseCrossEncoder
+
+from src.utlis.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+class TorchCrossEncoder(BaseCrossEncoder):
+    """
+    Cross-encoder sentence-transformers (PyTorch), возвращающий вероятность
+    релевантности 0..1 - ту же шкалу, что и OnnxCrossEncoder.
+
+    Активация CrossEncoder.predict по умолчанию зависит от версии
+    sentence-transformers и конфига модели: у ms-marco в новых версиях это
+    Identity, то есть сырые логиты. Поэтому логиты запрашиваются явно, а
+    sigmoid (softmax для двухклассовых моделей) считается здесь.
+    """
+
+    def __init__(self, model_name: str, model_kwargs: Optional[dict] = None):
+        from sentence_transformers import CrossEncoder
+
+        self.client = CrossEncoder(model_name, **(model_kwargs or {}))
+        parameters = inspect.signature(self.client.predict).parameters
+        # sentence-transformers >= 4: activation_fn, раньше - activation_fct
+        self._activation_arg = "activation_fn" if "activation_fn" in parameters else "activation_fct"
+
+    def score(self, text_pairs: List[Tuple[str, str]]) -> List[float]:
+        import torch
+
+        logits = np.asarray(self.client.predict(
+            text_pairs, convert_to_numpy=True, **{self._activation_arg: torch.nn.Identity()}), dtype=np.float64)
+        return logits_to_probabilities(logits)
+
+
+def logits_to_probabilities(logits: np.ndarray) -> List[float]:
+    """Логиты реранкера -> вероятность "релевантно" для каждой пары."""
+    if logits.ndim > 1 and logits.shape[1] > 1:
+        # двухклассовые модели (не релевантно, релевантно)
+        shifted = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return (shifted[:, 1] / shifted.sum(axis=1)).tolist()
+    return (1 / (1 + np.exp(-logits.reshape(-1)))).tolist()
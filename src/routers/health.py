@@ -1,8 +1,33 @@
 from fastapi import APIRouter
 
+from src.backend import services
+from src.backend.executors import EXECUTORS
+from src.ocr.main_ocr import easyocr_status
+from src.rag.index_cache import index_cache
+from src.rag.ingest_queue import ingestion_queue
+from src.utlis.loop_lag import loop_lag_monitor
+
 router = APIRouter()
 
 
 @router.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    # сервер жив, даже пока модели не загружены: прогрев видно по subsystems
+    subsystems = {service.name: service.status() for service in services.SERVICES}
+    subsystems["ocr"] = easyocr_status()
+
+    stats = {
+        "index_cache": index_cache.stats(),
+        "ingest_queue": ingestion_queue.stats(),
+        "event_loop": loop_lag_monitor.stats(),
+        "executors": {executor.name: executor.stats() for executor in EXECUTORS},
+    }
+    if services.rag_service.is_warm:
+        stats.update(services.rag_service.get().get_stats())
+
+    return {
+        "status": "healthy",
+        "ready": all(service.is_warm for service in services.SERVICES),
+        "subsystems": subsystems,
+        "stats": stats,
+    }
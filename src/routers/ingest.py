@@ -0,0 +1,18 @@
+from fastapi import APIRouter, HTTPException
+from src.backend.models import IngestJobStatus
+from src.rag.ingest_queue import ingestion_queue
+
+router = APIRouter()
+
+
+@router.get("/ingest/{job_id}", response_model=IngestJobStatus)
+def get_ingest_job(job_id: str):
+    """
+    Статус фоновой индексации; job_id возвращает /query (ingest_jobs) и
+    событие ingest в /query/stream. Задачи хранятся в памяти процесса: при
+    нескольких воркерах uvicorn задача другого воркера вернет 404.
+    """
+    status = ingestion_queue.get_status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+    return status
@@ -1,183 +1,106 @@
+import asyncio
+import json
 import os
-from typing import List
+import random
+import time
+from typing import List, Optional, Tuple
 
 import aiohttp
-import requests
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from bs4 import BeautifulSoup
-from src.backend.database import get_db, Message, Chat, Attachment
+from src.backend.database import get_db, Message, Chat, Attachment, PostgresSessionLocal
 from sqlalchemy import and_
-from src.llm.llm import LLMInterface
-from src.backend.models import Query, QueryResponse
+from src.backend.models import Query, QueryResponse, QueryManyRequest, QueryManyResponse
+from src.config.config import Config
 from src.utlis.logging_config import get_logger
-from src.rag.rag_service import RAGService
+from src.backend import services
+from src.backend.executors import io_executor, rag_executor
+from src.backend.pipeline import StageGraph
+from src.rag.ingest_queue import ingestion_queue, IngestQueueFull, IngestJobFailed
+from src.rag.relevance_gate import ACCEPT, AMBIGUOUS, relevance_gate
+from src.rag.retrieval_tool import make_chat_retrieval_tool
+from src.llm.call_counter import count_llm_calls
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers.string import StrOutputParser
+from langchain_core.callbacks import adispatch_custom_event
+from langchain_core.runnables import RunnableLambda
 
 logger = get_logger(__name__)
-llm_interface = LLMInterface()
 router = APIRouter()
 
-rag_service = RAGService()
-
-DOWNLOADS_DIR = "downloads"
-if not os.path.exists(DOWNLOADS_DIR):
-    os.makedirs(DOWNLOADS_DIR)
-
 IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp']
+QUERY_MODES = ("pipeline", "agent")
+# тег вызовов LLM, генерирующих ответ пользователю (см. _answer_stage)
+ANSWER_TAG = "answer"
+
+
+# Синхронные шаги /query: выполняются в пулах из src.backend.executors,
+# чтобы ORM и поиск по индексу не блокировали event loop
+
+def _get_user_chat(db: Session, chat_id: int, user_id: int) -> Optional[Chat]:
+    return db.query(Chat).filter(
+        Chat.id == chat_id,
+        Chat.user_id == user_id,
+        Chat.is_deleted == False
+    ).first()
+
+
+def _get_chat_history(db: Session, chat_id: int) -> List[Message]:
+    return db.query(Message).filter(
+        and_(
+            Message.is_deleted.is_(False),
+            Message.chat_id == chat_id)).order_by(Message.id).all()
+
+
+def _save_exchange(db: Session, query: Query, answer: str, context_for_db: Optional[list]):
+    user_message = Message(
+        chat_id=query.chat_id,
+        text=query.question,
+        role="user",
+        is_deleted=False)
+    db.add(user_message)
+    db.flush()
+
+    if query.attachments:
+        for attachment_data in query.attachments:
+            db_attachment = Attachment(
+                message_id=user_message.id,
+                url=attachment_data.url,
+                file_name=attachment_data.file_name,
+                file_type=attachment_data.file_type,
+                file_size=attachment_data.file_size
+            )
+            db.add(db_attachment)
 
+    assistant_message = Message(
+        chat_id=query.chat_id,
+        text=answer,
+        role="assistant",
+        is_deleted=False,
+        context=context_for_db
+    )
+    db.add(assistant_message)
+    db.commit()
 
-@router.post("/query", response_model=QueryResponse)
-async def process_query(query: Query, db: Session = Depends(get_db)):
-    backup_llm = llm_interface.llm
-    try:
-
-        chat = db.query(Chat).filter(
-            Chat.id == query.chat_id,
-            Chat.user_id == query.user_id,
-            Chat.is_deleted == False
-        ).first()
-        if not chat:
-            raise HTTPException(
-                status_code=404,
-                detail="Chat not found or does not belong to user")
-
-        question = query.question
-        # language = query.language or detect_language(question)
-        chat_history = db.query(Message).filter(
-            and_(
-                Message.is_deleted.is_(False),
-                Message.chat_id == query.chat_id)).order_by(Message.id).all()
-
-        highly_relevant_docs = []
-        attachment_prompts = []
-        no_attachment_prompt = "\n[System note: The user has not attached any new files]"
-        if query.attachments:
-            for attachment in query.attachments:
-                file_type = attachment.file_type or ''
-                file_url = attachment.url
-                file_name = attachment.file_name or 'attached file'
-                is_image_by_url = any(file_url.lower().endswith(ext)
-                                      for ext in IMAGE_EXTENSIONS)
-
-                if file_type.startswith(
-                        "image/") or (file_type == 'url' and is_image_by_url):
-                    prompt = (
-                        f"\n[User has attached an image named '{file_name}'. Analyze it using its URL: {file_url}]")
-                    attachment_prompts.append(prompt)
-
-                elif file_type in ["application/pdf",
-                                   "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                                   'text/plain'] or 'text/' in file_type:
-
-                    # --- ИЗМЕНЕНИЕ: Проверка на существование документа в индексе ---
-                    is_already_processed = rag_service.is_document_in_index(
-                        query.chat_id, file_name)
-                    new_chunks = None
-                    relevant_chunks = None
-                    if is_already_processed:
-                        logger.info(
-                            f"Document '{file_name}' is already indexed for this chat. Skipping download and processing.")
-                        attachment_prompts.append(
-                            f"\n[System note: The document '{file_name}' is already available in the knowledge base.]")
-                        relevant_chunks = rag_service.get_document_chunks(question, query.chat_id, file_name)
-                        # continue
-                    else:
-                        file_path = os.path.join(DOWNLOADS_DIR, file_name)
-                        try:
-                            logger.info(
-                                f"Submitting POST request to {file_url} to trigger download.")
-
-                            with requests.post(file_url, stream=True, timeout=120) as r:
-                                r.raise_for_status()
-                                with open(file_path, 'wb') as f:
-                                    for chunk in r.iter_content(chunk_size=8192):
-                                        f.write(chunk)
-
-                            logger.info(
-                                f"Successfully saved document to {file_path}. Now indexing.")
-                            new_chunks = rag_service.add_document_to_index(
-                                file_path, query.chat_id)
-
-
-                        except requests.RequestException as e:
-                            logger.error(
-                                f"Failed to download document {file_name}: {e}")
-                            attachment_prompts.append(
-                                f"\n[System note: Failed to download attached document '{file_name}'.]")
-                        except Exception as e:
-                            logger.error(
-                                f"An unexpected error occurred during file processing for {file_name}: {e}")
-                            attachment_prompts.append(
-                                f"\n[System note: An error occurred while processing '{file_name}'.]")
-
-                    if new_chunks or relevant_chunks:
-                        highly_relevant_chunks = new_chunks if new_chunks else relevant_chunks
-                        highly_relevant_docs.extend(highly_relevant_chunks)
-                        attachment_prompts.append(
-                            f"\n[System note: The document '{file_name}' is probably highly relevant and its content is available for answering questions.]")
-                    else:
-                        attachment_prompts.append(
-                            f"\n[System note: Failed to process the attached document '{file_name}'. Please inform the user about the error.]")
-
-                else:
-                    attachment_prompts.append(
-                        f"\n[User has attached a file named '{file_name}'. URL: {file_url}]")
-        else:
-            attachment_prompts.append(no_attachment_prompt)
-        final_context_docs = []
-        formatted_history = "\n".join(
-            [f"{msg.role}: {msg.text}" for msg in chat_history[-4:]])
-
-        if highly_relevant_docs:
-            logger.info(
-                f"Using context from HIGHLY (!) relevant document ({len(highly_relevant_docs)} chunks).")
-            final_context_docs = highly_relevant_docs
-        else:
-            logger.info("No new documents. Querying existing index.")
-            search_query = query.question
-            if chat_history:
-                rewrite_prompt = ChatPromptTemplate.from_messages([
-                    ("system", "Given a chat history and a follow up question, rephrase the follow up question to be a standalone question."), # Also give hints if user has attached some files"),
-                    ("user",
-                     "Chat History:\n{chat_history}\n\nFollow Up Input: {question}")
-                ])
-                llm_interface.llm = llm_interface.mistral_llm
-                rewriter_chain = rewrite_prompt | llm_interface.llm | StrOutputParser()
-                question_for_rephrase = query.question
-                """
-                if attachment_prompts[-1] != no_attachment_prompt:
-                    question_for_rephrase = question_for_rephrase + f"  \nKeep in mind that: {attachment_prompts[-1]}"
-                """
-                search_query = await rewriter_chain.ainvoke({"chat_history": formatted_history, "question": question_for_rephrase})
-                logger.info(
-                    f"Original question: '{query.question}' | Rewritten search query: '{search_query}'")
-                llm_interface.llm = backup_llm
-            final_context_docs = rag_service.query_index(
-                search_query, query.chat_id)
 
-        retrieved_context = "\n\n".join(
-            [doc.page_content for doc in final_context_docs])
+def _format_history(chat_history: List[Message]) -> str:
+    return "\n".join(
+        [f"{msg.role}: {msg.text}" for msg in chat_history[-4:]])
 
-        use_rag_context = False
-        if highly_relevant_docs and retrieved_context:
-            use_rag_context = True
-            logger.info(
-                "Got highly relevant document. Assuming first question is relevant, using RAG context directly.")
-        elif retrieved_context:
-            logger.info(
-                "Found context from existing index. Checking for relevance...")
 
-            relevance_prompt = ChatPromptTemplate.from_messages([
-                ("system", """You are a helpful assistant that determines if a retrieved document context is relevant to the user's question, considering the ongoing conversation.
+async def _llm_is_relevant(llm_interface, chat_history: List[Message], question: str, context: str) -> bool:
+    """Проверка релевантности контекста вопросом к LLM (для неоднозначных оценок реранкера)."""
+    relevance_prompt = ChatPromptTemplate.from_messages([
+        ("system", """You are a helpful assistant that determines if a retrieved document context is relevant to the user's question, considering the ongoing conversation.
 Respond with only the word 'yes' or 'no'.
 
 The user is in a conversation. If their new question is a follow-up or on the same topic as the chat history, the context from the document is likely relevant.
 
 Chat History:
 {history}"""),
-                ("user", """User's New Question: {question}
+        ("user", """User's New Question: {question}
 
 Retrieved Context from the document:
 ---
@@ -185,87 +108,524 @@ Retrieved Context from the document:
 ---
 
 Is the retrieved context relevant to the user's new question?""")
-            ])
+    ])
+
+    relevance_chain = relevance_prompt | llm_interface.mistral_llm | StrOutputParser()
 
-            llm_interface.llm = llm_interface.mistral_llm
-            relevance_chain = relevance_prompt | llm_interface.llm | StrOutputParser()
+    relevance_decision = await relevance_chain.ainvoke({
+        "history": _format_history(chat_history),
+        "question": question,
+        "context": context
+    })
+    logger.info(
+        f"Relevance check decision: '{relevance_decision.strip()}'")
+    return 'yes' in relevance_decision.lower()
 
-            relevance_decision = await relevance_chain.ainvoke({
-                "history": formatted_history,
-                "question": query.question,
-                "context": retrieved_context
-            })
-            llm_interface.llm = backup_llm
+
+def _load_chat_history(chat_id: int) -> List[Message]:
+    # своя сессия: история читается параллельно с проверкой чата, а Session
+    # не потокобезопасна; загруженные атрибуты доступны и после close()
+    db = PostgresSessionLocal()
+    try:
+        return _get_chat_history(db, chat_id)
+    finally:
+        db.close()
+
+
+async def _process_attachment(attachment, query: Query, rag_service) -> Tuple[List[str], list, Optional[str]]:
+    """
+    Обрабатывает одно вложение: возвращает системные подсказки для LLM,
+    чанки документа, если он скорее всего отвечает на вопрос, и id задачи
+    индексации, если документ еще индексируется в фоне (GET /ingest/{job_id}).
+    """
+    question = query.question
+    attachment_prompts = []
+    highly_relevant_docs = []
+    file_type = attachment.file_type or ''
+    file_url = attachment.url
+    file_name = attachment.file_name or 'attached file'
+    is_image_by_url = any(file_url.lower().endswith(ext)
+                          for ext in IMAGE_EXTENSIONS)
+
+    if file_type.startswith(
+            "image/") or (file_type == 'url' and is_image_by_url):
+        prompt = (
+            f"\n[User has attached an image named '{file_name}'. Analyze it using its URL: {file_url}]")
+        attachment_prompts.append(prompt)
+
+    elif file_type in ["application/pdf",
+                       "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                       'text/plain'] or 'text/' in file_type:
+
+        # --- ИЗМЕНЕНИЕ: Проверка на существование документа в индексе ---
+        is_already_processed = await rag_executor.run(
+            rag_service.is_document_in_index, query.chat_id, file_name)
+        new_chunks = None
+        relevant_chunks = None
+        if is_already_processed:
             logger.info(
-                f"Relevance check decision: '{relevance_decision.strip()}'")
+                f"Document '{file_name}' is already indexed for this chat. Skipping download and processing.")
+            attachment_prompts.append(
+                f"\n[System note: The document '{file_name}' is already available in the knowledge base.]")
+            relevant_chunks = await rag_executor.run(
+                rag_service.get_document_chunks, question, query.chat_id, file_name)
+        else:
+            # скачивание и индексация идут в пуле процессов ingestion_queue
+            try:
+                # первый submit поднимает пул процессов - это блокирующий вызов
+                job_id = await io_executor.run(
+                    ingestion_queue.submit, query.chat_id, file_url, file_name)
+                if not query.wait_for_ingest:
+                    logger.info(
+                        f"Document '{file_name}' is being indexed in background (job {job_id}).")
+                    attachment_prompts.append(
+                        f"\n[System note: The document '{file_name}' is still being processed and is not available yet. Tell the user it will be available shortly.]")
+                    await _emit_event("ingest", {"job_id": job_id, "file_name": file_name})
+                    return attachment_prompts, highly_relevant_docs, job_id
+                new_chunks = await ingestion_queue.wait(job_id)
+                if not new_chunks and await rag_executor.run(
+                        rag_service.is_document_in_index, query.chat_id, file_name):
+                    # большой документ индексировался потоково - берем
+                    # из него только релевантные вопросу чанки
+                    relevant_chunks = await rag_executor.run(
+                        rag_service.get_document_chunks, question, query.chat_id, file_name)
+
+            except IngestQueueFull as e:
+                logger.error(
+                    f"Could not queue document {file_name}: {e}")
+                attachment_prompts.append(
+                    f"\n[System note: The server is busy and could not process attached document '{file_name}'.]")
+            except asyncio.TimeoutError:
+                logger.warning(
+                    f"Document '{file_name}' is still being indexed after {ingestion_queue.wait_timeout_s}s.")
+                attachment_prompts.append(
+                    f"\n[System note: The document '{file_name}' is still being processed and is not available yet. Tell the user it will be available shortly.]")
+                await _emit_event("ingest", {"job_id": job_id, "file_name": file_name})
+                return attachment_prompts, highly_relevant_docs, job_id
+            except IngestJobFailed as e:
+                logger.error(
+                    f"Failed to download or index document {file_name}: {e}")
+                attachment_prompts.append(
+                    f"\n[System note: Failed to download attached document '{file_name}'.]")
+            except Exception as e:
+                logger.error(
+                    f"An unexpected error occurred during file processing for {file_name}: {e}")
+                attachment_prompts.append(
+                    f"\n[System note: An error occurred while processing '{file_name}'.]")
+
+        if new_chunks or relevant_chunks:
+            highly_relevant_chunks = new_chunks if new_chunks else relevant_chunks
+            highly_relevant_docs.extend(highly_relevant_chunks)
+            attachment_prompts.append(
+                f"\n[System note: The document '{file_name}' is probably highly relevant and its content is available for answering questions.]")
+        else:
+            attachment_prompts.append(
+                f"\n[System note: Failed to process the attached document '{file_name}'. Please inform the user about the error.]")
 
-            if 'yes' in relevance_decision.lower():
-                use_rag_context = True
+    else:
+        attachment_prompts.append(
+            f"\n[User has attached a file named '{file_name}'. URL: {file_url}]")
+    return attachment_prompts, highly_relevant_docs, None
 
-        answer = ""
-        if use_rag_context:
+
+def _query_mode(header_value: Optional[str]) -> str:
+    mode = (header_value or Config.QUERY_MODE).lower()
+    if mode not in QUERY_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown query mode '{mode}', use one of {QUERY_MODES}")
+    return mode
+
+
+def _doc_sources(docs: list) -> List[str]:
+    return [os.path.basename(doc.metadata.get('source', 'unknown')) for doc in docs]
+
+
+async def _emit_event(name: str, data: dict):
+    # промежуточное событие для /query/stream; граф всегда выполняется внутри
+    # runnable (_query_runnable), так что родительский запуск есть, а без
+    # подписчика (обычный /query) событие никуда не уходит
+    await adispatch_custom_event(name, data)
+
+
+def _answer_stage(func):
+    """
+    Оборачивает этап генерации ответа: вложенные вызовы LLM получают тег
+    ANSWER_TAG, по которому /query/stream отличает токены ответа от
+    переформулировки вопроса и проверки релевантности.
+    """
+
+    async def run(args):
+        return await func(*args)
+
+    async def stage(*args):
+        return await RunnableLambda(run, name="generation").ainvoke(args, config={"tags": [ANSWER_TAG]})
+
+    return stage
+
+
+def _build_query_graph(query: Query, db: Session, llm_interface, rag_service, mode: str) -> StageGraph:
+    """
+    Этапы ответа на вопрос (общие для /query и /query/stream): проверка чата
+    и загрузка истории идут параллельно, вложения обрабатываются параллельно
+    друг с другом.
+
+    Режим "pipeline" - отдельные вызовы LLM на переформулировку, проверку
+    релевантности и ответ; "agent" - один проход агента, поиск по документам
+    чата - его инструмент.
+    """
+    graph = StageGraph()
+
+    async def check_chat():
+        chat = await io_executor.run(_get_user_chat, db, query.chat_id, query.user_id)
+        if not chat:
+            raise HTTPException(
+                status_code=404,
+                detail="Chat not found or does not belong to user")
+        # после commit атрибуты истекают, и их чтение снова пошло бы в БД
+        return chat.summary
+
+    async def load_history():
+        return await io_executor.run(_load_chat_history, query.chat_id)
+
+    graph.add("chat", check_chat)
+    graph.add("history", load_history)
+
+    # вложения индексируются в чат только после проверки его владельца
+    attachment_stages = []
+    for i, attachment in enumerate(query.attachments or []):
+        async def process(_chat_summary, attachment=attachment):
+            return await _process_attachment(attachment, query, rag_service)
+        attachment_stages.append(f"attachment_{i}")
+        graph.add(attachment_stages[-1], process, "chat")
+
+    async def collect_attachments(*results):
+        if not query.attachments:
+            return ["\n[System note: The user has not attached any new files]"], []
+        attachment_prompts, highly_relevant_docs = [], []
+        for prompts, docs, _job_id in results:
+            attachment_prompts.extend(prompts)
+            highly_relevant_docs.extend(docs)
+        return attachment_prompts, highly_relevant_docs
+
+    async def collect_ingest_jobs(*results):
+        return [job_id for _, _, job_id in results if job_id]
+
+    graph.add("attachments", collect_attachments, *attachment_stages)
+    graph.add("ingest_jobs", collect_ingest_jobs, *attachment_stages)
+
+    async def rewrite(chat_history, attachments):
+        _, highly_relevant_docs = attachments
+        if highly_relevant_docs or not chat_history:
+            return query.question
+        rewrite_prompt = ChatPromptTemplate.from_messages([
+            ("system", "Given a chat history and a follow up question, rephrase the follow up question to be a standalone question."), # Also give hints if user has attached some files"),
+            ("user",
+             "Chat History:\n{chat_history}\n\nFollow Up Input: {question}")
+        ])
+        # mistral_llm подставляется в цепочку напрямую: общий llm_interface.llm
+        # не переключаем, его одновременно используют другие запросы
+        rewriter_chain = rewrite_prompt | llm_interface.mistral_llm | StrOutputParser()
+        search_query = await rewriter_chain.ainvoke(
+            {"chat_history": _format_history(chat_history), "question": query.question})
+        logger.info(
+            f"Original question: '{query.question}' | Rewritten search query: '{search_query}'")
+        return search_query
+
+    async def retrieve(_chat_summary, search_query, attachments):
+        _, highly_relevant_docs = attachments
+        if highly_relevant_docs:
             logger.info(
-                "Context is relevant. Generating response from context.")
-            answer = await llm_interface.agenerate_response_from_context(
-                question=query.question,
-                context=retrieved_context,
-                history=chat_history[-4:]  # TODO ?? but maybe this is good
-            )
+                f"Using context from HIGHLY (!) relevant document ({len(highly_relevant_docs)} chunks).")
+            context_docs, scores = highly_relevant_docs, None
         else:
+            logger.info("No new documents. Querying existing index.")
+            # пары (чанк, оценка реранкера): оценки нужны RelevanceGate
+            scored_docs = await rag_executor.run(
+                rag_service.query_index, search_query, query.chat_id, with_scores=True)
+            context_docs, scores = [doc for doc, _ in scored_docs], [score for _, score in scored_docs]
+        await _emit_event("retrieval", {"query": search_query, "sources": _doc_sources(context_docs),
+                                        "scores": scores})
+        return context_docs, scores
+
+    async def check_relevance(chat_history, attachments, search_query, retrieval):
+        _, highly_relevant_docs = attachments
+        context_docs, scores = retrieval
+        retrieved_context = "\n\n".join(
+            [doc.page_content for doc in context_docs])
+        if highly_relevant_docs and retrieved_context:
+            logger.info(
+                "Got highly relevant document. Assuming first question is relevant, using RAG context directly.")
+            return True
+        if not retrieved_context:
+            return False
+
+        # решает оценка реранкера; LLM спрашиваем только в неоднозначной полосе
+        # (и на небольшой выборке остальных - как разметку для калибровки)
+        top_score = max(scores)
+        decision = relevance_gate.decide(top_score, tiebreak=Config.RAG_RELEVANCE_LLM_TIEBREAK)
+        llm_decision = None
+        if decision == AMBIGUOUS or random.random() < Config.RAG_RELEVANCE_LLM_SAMPLE_RATE:
             logger.info(
-                "Context is not relevant or not found. Using agentic generation.")
-            question_for_llm = query.question
-            if attachment_prompts:
-                question_for_llm += "\n" + "\n".join(attachment_prompts)
-
-            answer = await llm_interface.agenerate(question_for_llm, chat_history, user_id=query.user_id,
-                                                   context=[], language="")
-
-        user_message = Message(
-            chat_id=query.chat_id,
-            text=query.question,
-            role="user",
-            is_deleted=False)
-        db.add(user_message)
-        db.flush()
-
-        if query.attachments:
-            for attachment_data in query.attachments:
-                db_attachment = Attachment(
-                    message_id=user_message.id,
-                    url=attachment_data.url,
-                    file_name=attachment_data.file_name,
-                    file_type=attachment_data.file_type,
-                    file_size=attachment_data.file_size
-                )
-                db.add(db_attachment)
+                f"Rerank score {top_score:.4f} is {decision}. Asking LLM for relevance...")
+            llm_decision = await _llm_is_relevant(
+                llm_interface, chat_history, query.question, retrieved_context)
+        use_rag_context = decision == ACCEPT or (decision == AMBIGUOUS and bool(llm_decision))
+        logger.info(
+            f"Relevance decision: {decision} (top rerank score {top_score:.4f}), "
+            f"LLM: {llm_decision}, use context: {use_rag_context}.")
+
+        await io_executor.run(relevance_gate.log, {
+            "chat_id": query.chat_id,
+            "question": query.question,
+            "search_query": search_query,
+            "scores": scores,
+            "top_score": top_score,
+            "decision": decision,
+            "llm_decision": llm_decision,
+            "used_context": use_rag_context,
+            "sources": _doc_sources(context_docs),
+        })
+        return use_rag_context
+
+    async def relevance_stage(_chat_summary, *args):
+        use_rag_context = await check_relevance(*args)
+        await _emit_event("relevance", {"use_context": use_rag_context})
+        return use_rag_context
+
+    def question_with_attachments(attachment_prompts):
+        question_for_llm = query.question
+        if attachment_prompts:
+            question_for_llm += "\n" + "\n".join(attachment_prompts)
+        return question_for_llm
+
+    async def answer_from_context(chat_history, context_docs):
+        return await llm_interface.agenerate_response_from_context(
+            question=query.question,
+            context="\n\n".join([doc.page_content for doc in context_docs]),
+            history=chat_history[-4:]  # TODO ?? but maybe this is good
+        )
 
-        context_for_db = None
+    # generation возвращает (ответ, чанки, на которых он основан)
+    async def generate(_chat_summary, chat_history, attachments, retrieval, use_rag_context):
+        attachment_prompts, _ = attachments
+        context_docs, _ = retrieval
         if use_rag_context:
+            logger.info(
+                "Context is relevant. Generating response from context.")
+            return await answer_from_context(chat_history, context_docs), context_docs
+        logger.info(
+            "Context is not relevant or not found. Using agentic generation.")
+        answer = await llm_interface.agenerate(question_with_attachments(attachment_prompts), chat_history,
+                                               user_id=query.user_id, context=[], language="")
+        return answer, []
+
+    async def generate_with_agent(_chat_summary, chat_history, attachments):
+        attachment_prompts, highly_relevant_docs = attachments
+        if highly_relevant_docs:
+            # только что загруженный документ отвечает на вопрос - искать нечего
+            logger.info(
+                f"Using context from HIGHLY (!) relevant document ({len(highly_relevant_docs)} chunks).")
+            return await answer_from_context(chat_history, highly_relevant_docs), highly_relevant_docs
+        found_docs = []
+        retrieval_tool = make_chat_retrieval_tool(rag_service, query.chat_id, found_docs)
+        answer = await llm_interface.agenerate(question_with_attachments(attachment_prompts), chat_history,
+                                               user_id=query.user_id, context=[], language="",
+                                               retrieval_tool=retrieval_tool)
+        logger.info(f"Agent answered using {len(found_docs)} retrieved chunks.")
+        return answer, found_docs
+
+    async def persist(_chat_summary, generation):
+        answer, context_docs = generation
+        context_for_db = None
+        if context_docs:
             source_files = list(
-                set([doc.metadata.get('source', 'unknown') for doc in final_context_docs]))
+                set([doc.metadata.get('source', 'unknown') for doc in context_docs]))
             context_for_db = [os.path.basename(f) for f in source_files]
+        await io_executor.run(_save_exchange, db, query, answer, context_for_db)
 
-        assistant_message = Message(
-            chat_id=query.chat_id,
-            text=answer,
-            role="assistant",
-            is_deleted=False,
-            context=context_for_db
-        )
-        db.add(assistant_message)
-        db.commit()
+    # до проверки владельца чата (этап "chat") можно только готовить запрос:
+    # поиск по индексу чата, события клиенту, ответ и запись в БД ждут ее явно
+    if mode == "agent":
+        graph.add("generation", _answer_stage(generate_with_agent), "chat", "history", "attachments")
+    else:
+        graph.add("rewrite", rewrite, "history", "attachments")
+        graph.add("retrieval", retrieve, "chat", "rewrite", "attachments")
+        graph.add("relevance", relevance_stage, "chat", "history", "attachments", "rewrite", "retrieval")
+        graph.add("generation", _answer_stage(generate), "chat", "history", "attachments", "retrieval",
+                  "relevance")
+    graph.add("persist", persist, "chat", "generation")
+    return graph
 
-        response_context = []
-        if use_rag_context:
-            response_context = [{"text": doc.page_content, "source": doc.metadata.get(
-                'source', 'unknown')} for doc in final_context_docs]
 
-        return QueryResponse(
-            answer=answer, context=response_context, language=chat.summary if chat else "")
+def _query_runnable(graph: StageGraph) -> RunnableLambda:
+    """Граф как runnable LangChain: ainvoke для /query, astream_events для /query/stream."""
+
+    async def run(_):
+        with count_llm_calls() as llm_calls:
+            results = await graph.run()
+        return results, llm_calls.calls
+
+    return RunnableLambda(run, name="query")
+
+
+def _query_response(results: dict) -> QueryResponse:
+    answer, final_context_docs = results["generation"]
+    response_context = [{"text": doc.page_content, "source": doc.metadata.get(
+        'source', 'unknown')} for doc in final_context_docs]
+    return QueryResponse(
+        answer=answer, context=response_context, language=results["chat"],
+        ingest_jobs=results["ingest_jobs"])
+
+
+@router.post("/query", response_model=QueryResponse)
+async def process_query(query: Query, response: Response, db: Session = Depends(get_db),
+                        debug_timings: Optional[str] = Header(None, alias="X-Debug-Timings"),
+                        query_mode: Optional[str] = Header(None, alias="X-Query-Mode")):
+    """
+    Ответ на вопрос в чате (этапы - _build_query_graph). При
+    QUERY_DEBUG_TIMINGS или заголовке X-Debug-Timings: 1 длительности этапов
+    возвращаются в Server-Timing, а число вызовов LLM - в X-LLM-Calls.
+    Режим - QUERY_MODE или заголовок X-Query-Mode.
+    """
+    mode = _query_mode(query_mode)
+    # модели грузятся фоновым прогревом при старте; если он еще не закончился,
+    # запрос дождется инициализации, не блокируя event loop
+    llm_interface = await services.llm_interface.aget()
+    rag_service = await services.rag_service.aget()
+    try:
+        graph = _build_query_graph(query, db, llm_interface, rag_service, mode)
+        results, llm_calls = await _query_runnable(graph).ainvoke(None)
+        if Config.QUERY_DEBUG_TIMINGS or debug_timings == "1":
+            response.headers["Server-Timing"] = graph.server_timing()
+            response.headers["X-LLM-Calls"] = str(llm_calls)
+
+        return _query_response(results)
 
     except Exception as ex:
-        db.rollback()
+        await io_executor.run(db.rollback)
         logger.error(f"Error processing query: {ex}")
         logger.exception("An unhandled exception occurred in process_query:")
         raise HTTPException(status_code=500, detail=str(ex))
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def _chunk_text(chunk) -> str:
+    content = chunk.content
+    if isinstance(content, str):
+        return content
+    # у некоторых провайдеров content - список блоков
+    return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+
+
+# фоновые задачи /query/stream: ссылка держится до их завершения
+_stream_tasks = set()
+
+
+@router.post("/query/stream")
+async def process_query_stream(query: Query, query_mode: Optional[str] = Header(None, alias="X-Query-Mode")):
+    """
+    Потоковый вариант /query (Server-Sent Events). События:
+    - ingest - {"job_id", "file_name"} документа, который индексируется в фоне;
+    - retrieval, relevance - найденный контекст и решение о его использовании;
+    - tool_start, tool_end - шаги агента;
+    - token - очередной фрагмент ответа;
+    - done - то же, что возвращает /query (answer - итоговый текст), и metrics:
+      ttft_ms (время до первого токена), total_ms, llm_calls;
+    - error - {"status", "detail"}.
+
+    Выполняется тот же граф этапов, что и в /query, поэтому сохраненные
+    сообщения и контекст совпадают. Запрос работает в фоновой задаче со своей
+    сессией БД: при обрыве соединения ответ все равно догенерируется и
+    сохранится, как и в /query.
+    """
+    mode = _query_mode(query_mode)
+    llm_interface = await services.llm_interface.aget()
+    rag_service = await services.rag_service.aget()
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def produce():
+        db = PostgresSessionLocal()
+        started = time.perf_counter()
+        ttft_ms = None
+        try:
+            graph = _build_query_graph(query, db, llm_interface, rag_service, mode)
+            async for event in _query_runnable(graph).astream_events(None, version="v2"):
+                kind = event["event"]
+                if kind == "on_chat_model_stream" and ANSWER_TAG in event["tags"]:
+                    text = _chunk_text(event["data"]["chunk"])
+                    if text:
+                        if ttft_ms is None:
+                            ttft_ms = (time.perf_counter() - started) * 1000
+                        events.put_nowait(("token", {"text": text}))
+                elif kind == "on_custom_event":
+                    events.put_nowait((event["name"], event["data"]))
+                elif kind == "on_tool_start":
+                    events.put_nowait(("tool_start", {"tool": event["name"], "input": event["data"].get("input")}))
+                elif kind == "on_tool_end":
+                    events.put_nowait(("tool_end", {"tool": event["name"]}))
+                elif kind == "on_chain_end" and not event["parent_ids"]:
+                    results, llm_calls = event["data"]["output"]
+
+            total_ms = (time.perf_counter() - started) * 1000
+            logger.info(
+                f"Streamed answer for chat {query.chat_id} ({mode}): first token after "
+                f"{f'{ttft_ms:.0f} ms' if ttft_ms is not None else 'n/a'}, total {total_ms:.0f} ms.")
+            events.put_nowait(("done", {
+                **_query_response(results).model_dump(),
+                "metrics": {"ttft_ms": ttft_ms, "total_ms": total_ms, "llm_calls": llm_calls,
+                            "stages_ms": {name: duration * 1000 for name, duration in graph.timings.items()}},
+            }))
+        except Exception as ex:
+            await io_executor.run(db.rollback)
+            logger.error(f"Error processing streamed query: {ex}")
+            logger.exception("An unhandled exception occurred in process_query_stream:")
+            status_code = ex.status_code if isinstance(ex, HTTPException) else 500
+            detail = ex.detail if isinstance(ex, HTTPException) else str(ex)
+            events.put_nowait(("error", {"status": status_code, "detail": detail}))
+        finally:
+            await io_executor.run(db.close)
+            events.put_nowait(None)
+
+    task = asyncio.create_task(produce())
+    _stream_tasks.add(task)
+    task.add_done_callback(_stream_tasks.discard)
+
+    async def stream():
+        while (item := await events.get()) is not None:
+            yield _sse(*item)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.post("/query_many", response_model=QueryManyResponse)
+def process_query_many(request: QueryManyRequest, db: Session = Depends(get_db)):
+    """
+    Только поиск контекста (без генерации ответа) сразу для нескольких вопросов
+    к одному чату: для оценки качества и подсказанных вопросов во фронтенде.
+    """
+    if len(request.questions) > Config.RAG_QUERY_MANY_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many questions (max {Config.RAG_QUERY_MANY_MAX_QUESTIONS})")
+
+    chat = db.query(Chat).filter(
+        Chat.id == request.chat_id,
+        Chat.user_id == request.user_id,
+        Chat.is_deleted == False
+    ).first()
+    if not chat:
+        raise HTTPException(
+            status_code=404,
+            detail="Chat not found or does not belong to user")
+
+    rag_service = services.rag_service.get()
+    results = rag_service.query_many(request.questions, request.chat_id)
+    return QueryManyResponse(results=[
+        {"question": question,
+         "context": [{"text": doc.page_content, "source": doc.metadata.get('source', 'unknown')}
+                     for doc in docs]}
+        for question, docs in zip(request.questions, results)
+    ])
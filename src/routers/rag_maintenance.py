@@ -0,0 +1,25 @@
+from fastapi import APIRouter, HTTPException
+
+from src.backend import services
+from src.rag.maintenance import run_maintenance
+
+router = APIRouter()
+
+
+@router.delete("/rag/{chat_id}/documents/{file_name}")
+def delete_document(chat_id: int, file_name: str):
+    """Помечает документ чата удаленным; место освобождает компакция индекса."""
+    if not services.rag_service.get().delete_document(chat_id, file_name):
+        raise HTTPException(status_code=404, detail="Document not found in chat index")
+    return {"message": f"Document '{file_name}' deleted from chat {chat_id}"}
+
+
+@router.get("/rag/maintenance/report")
+def maintenance_report():
+    """Что сделало бы обслуживание индексов прямо сейчас (dry run)."""
+    return run_maintenance(services.rag_service.get(), dry_run=True)
+
+
+@router.post("/rag/maintenance/run")
+def maintenance_run():
+    return run_maintenance(services.rag_service.get(), dry_run=False)
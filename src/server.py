@@ -1,18 +1,24 @@
 # uvicorn app.main:app --host localhost --port 8000 --reload
 
-from src.routers import health, speed_test, user, chat, message, query, google_calendar_oauth, attachment
+from src.routers import health, speed_test, user, chat, message, query, google_calendar_oauth, attachment, ingest, \
+    rag_maintenance
 from src.utlis.logging_config import get_logger
 from contextlib import asynccontextmanager
-from src.backend.database import engine, get_db, create_postgres_tables
+from src.backend.database import get_db, create_postgres_tables
+from src.backend import services
+from src.backend.executors import EXECUTORS
+from src.rag.ingest_queue import ingestion_queue
+from src.rag.maintenance import maintenance_loop
+from src.utlis.loop_lag import loop_lag_monitor
 from dotenv import load_dotenv
 from src.backend.database import User, Chat, Message, SpeedTestResult
 from src.config.config import Config
-from src.backend import database
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy import and_
 from sqlalchemy.orm import Session
 from typing import List
 from fastapi import FastAPI, HTTPException, Depends
+import asyncio
 import os
 os.environ['PGCLIENTENCODING'] = 'utf-8'
 
@@ -26,14 +32,21 @@ os.environ['PGCLIENTENCODING'] = 'utf-8'
 # from app.speed_database import get_postgres_db, create_postgres_tables
 # from app.speed_database import SpeedTestResult as SpeedTestResultDB
 
-database.Base.metadata.create_all(bind=engine)
-create_postgres_tables()
-
 load_dotenv()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    create_postgres_tables()
+    if Config.LOOP_LAG_INTERVAL_MS > 0:
+        loop_lag_monitor.start()
+    # модели грузятся в фоне: сервер принимает запросы (и /health) сразу
+    if Config.WARMUP_ON_STARTUP:
+        app.state.warmup_task = asyncio.create_task(services.warm_up())
+    if Config.RAG_MAINTENANCE_INTERVAL_S > 0:
+        app.state.maintenance_task = asyncio.create_task(maintenance_loop(
+            services.rag_service.aget, Config.RAG_MAINTENANCE_INTERVAL_S))
+
     # Load RAG DATABASE
     db = next(get_db())
     """
@@ -109,6 +122,16 @@ async def lifespan(app: FastAPI):
             logger.info("MySQL is NOT empty, skipping filling stage")
 
     yield
+    loop_lag_monitor.stop()
+    # фоновые задачи останавливаются раньше пулов, в которых они выполняют работу
+    background_tasks = [task for task in (getattr(app.state, "warmup_task", None),
+                                          getattr(app.state, "maintenance_task", None)) if task is not None]
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    ingestion_queue.shutdown()
+    for executor in EXECUTORS:
+        executor.shutdown()
     # Clean up and release the resources
     # ml_models.clear()
 
@@ -132,11 +155,6 @@ logger = get_logger(__name__)
 # REGION UTILS
 
 
-@app.get("/health")
-async def health_check():
-    return {"status": "healthy"}
-
-
 app.include_router(health.router)
 app.include_router(query.router)
 app.include_router(speed_test.router)
@@ -144,6 +162,8 @@ app.include_router(user.router)
 app.include_router(chat.router)
 app.include_router(message.router)
 app.include_router(attachment.router)
+app.include_router(ingest.router)
+app.include_router(rag_maintenance.router)
 app.include_router(google_calendar_oauth.router)
 
 if __name__ == "__main__":
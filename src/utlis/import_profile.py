@@ -0,0 +1,66 @@
+"""
+Профиль времени импорта API (python -X importtime) для отлова регрессий старта.
+
+Импорт сервера не должен тянуть torch, модели и OCR - они грузятся лениво.
+Скрипт завершается с кодом 1, если импортирован тяжелый модуль или суммарное
+время импорта превысило бюджет.
+
+Запуск (из корня репозитория):
+    python -m src.utlis.import_profile --module src.server --budget-s 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import List, Tuple
+
+# transformers сюда не входит: его импортирует сам langchain_core (ради
+# GPT2TokenizerFast), а без torch это дешево
+HEAVY_MODULES = ["torch", "sentence_transformers", "easyocr", "onnxruntime", "optimum", "unstructured"]
+
+
+def profile_imports(module: str) -> List[Tuple[str, int, int]]:
+    """Возвращает (модуль, собственное время, суммарное время) в микросекундах."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="src.server")
+    parser.add_argument("--budget-s", type=float, default=5.0)
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    rows = profile_imports(args.module)
+    total_s = sum(self_us for _, self_us, _ in rows) / 1e6
+    print(f"{'cumulative, ms':>15}{'self, ms':>10}  module")
+    for name, self_us, cumulative_us in sorted(rows, key=lambda r: -r[2])[:args.top]:
+        print(f"{cumulative_us / 1000:>15.1f}{self_us / 1000:>10.1f}  {name}")
+    print(f"\ntotal import time of {args.module}: {total_s:.2f}s ({len(rows)} modules)")
+
+    failed = False
+    heavy = sorted({name.split(".")[0] for name, _, _ in rows} & set(HEAVY_MODULES))
+    if heavy:
+        print(f"FAIL: heavy modules imported at startup: {', '.join(heavy)}")
+        failed = True
+    if total_s > args.budget_s:
+        print(f"FAIL: import time {total_s:.2f}s exceeds budget {args.budget_s:.2f}s")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Задержка event loop: монитор внутри сервера и нагрузочная проверка снаружи.
+
+Монитор раз в interval засыпает на interval и замеряет, насколько позже
+проснулся: все сверх interval - время, когда loop был занят блокирующим кодом.
+Статистика отдается в /health (stats.event_loop).
+
+Проверка под нагрузкой (сервер должен быть запущен):
+    python -m src.utlis.loop_lag --chat-id 1 --user-id 1 --concurrency 8 --requests 32
+
+отправляет параллельные /query и одновременно опрашивает /health. Пока
+тяжелая работа идет в пулах потоков, /health отвечает быстро; код выхода 1,
+если p99 задержки /health или максимальная задержка loop превысили бюджет.
+Та же проверка без сервера, с заглушками RAG и БД, - tests/test_loop_lag.py.
+"""
+import argparse
+import asyncio
+import sys
+import time
+from collections import deque
+from typing import List, Optional
+
+from src.config.config import Config
+from src.utlis.logging_config import get_logger
+from src.utlis.stats import percentile
+
+logger = get_logger(__name__)
+
+
+class LoopLagMonitor:
+    """Фоновая задача, замеряющая задержку event loop (последние window замеров)."""
+
+    def __init__(self, interval_s: float = 0.1, window: int = 600, warn_ms: float = 500):
+        self.interval_s = interval_s
+        self.warn_ms = warn_ms
+        self._samples: deque = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval_s)
+            lag_ms = max(0.0, (loop.time() - started - self.interval_s) * 1000)
+            self._samples.append(lag_ms)
+            if lag_ms >= self.warn_ms:
+                logger.warning(f"Event loop was blocked for {lag_ms:.0f} ms.")
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        samples = list(self._samples)
+        return {
+            "interval_ms": self.interval_s * 1000,
+            "samples": len(samples),
+            "mean_ms": sum(samples) / len(samples) if samples else 0.0,
+            "p99_ms": percentile(samples, 0.99),
+            "max_ms": max(samples, default=0.0),
+        }
+
+
+# запускается из lifespan сервера, если LOOP_LAG_INTERVAL_MS > 0
+loop_lag_monitor = LoopLagMonitor(interval_s=(Config.LOOP_LAG_INTERVAL_MS or 100) / 1000)
+
+
+async def _load_test(args) -> bool:
+    import aiohttp
+
+    health_latencies: List[float] = []
+    query_latencies: List[float] = []
+    done = asyncio.Event()
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=args.timeout_s)) as session:
+        async def poll_health():
+            while not done.is_set():
+                started = time.perf_counter()
+                async with session.get(f"{args.url}/health") as response:
+                    await response.read()
+                health_latencies.append((time.perf_counter() - started) * 1000)
+                await asyncio.sleep(args.health_interval_s)
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def send_query(i: int):
+            async with semaphore:
+                started = time.perf_counter()
+                payload = {"chat_id": args.chat_id, "user_id": args.user_id,
+                           "question": f"{args.question} ({i})"}
+                async with session.post(f"{args.url}/query", json=payload) as response:
+                    await response.read()
+                    if response.status != 200:
+                        print(f"query {i}: HTTP {response.status}")
+                query_latencies.append((time.perf_counter() - started) * 1000)
+
+        poller = asyncio.create_task(poll_health())
+        await asyncio.gather(*(send_query(i) for i in range(args.requests)))
+        done.set()
+        await poller
+
+        async with session.get(f"{args.url}/health") as response:
+            loop_stats = (await response.json())["stats"].get("event_loop", {})
+
+    health_p99 = percentile(health_latencies, 0.99)
+    print(f"/query:  {len(query_latencies)} requests, concurrency {args.concurrency}, "
+          f"p50 {percentile(query_latencies, 0.5):.0f} ms, p99 {percentile(query_latencies, 0.99):.0f} ms")
+    print(f"/health: {len(health_latencies)} probes, p50 {percentile(health_latencies, 0.5):.1f} ms, "
+          f"p99 {health_p99:.1f} ms")
+    print(f"server event loop lag: {loop_stats or 'not reported'}")
+
+    ok = health_p99 <= args.budget_ms
+    if not ok:
+        print(f"FAIL: /health p99 {health_p99:.1f} ms exceeds budget {args.budget_ms:.0f} ms")
+    if loop_stats and loop_stats["max_ms"] > args.budget_ms:
+        print(f"FAIL: event loop lag {loop_stats['max_ms']:.1f} ms exceeds budget {args.budget_ms:.0f} ms")
+        ok = False
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--chat-id", type=int, required=True)
+    parser.add_argument("--user-id", type=int, required=True)
+    parser.add_argument("--question", default="What is this document about?")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--health-interval-s", type=float, default=0.05)
+    parser.add_argument("--budget-ms", type=float, default=100)
+    parser.add_argument("--timeout-s", type=float, default=300)
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(_load_test(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
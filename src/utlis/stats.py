@@ -0,0 +1,10 @@
+"""Простые статистики по замерам для мониторинга и бенчмарков."""
+from typing import List
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль q (0..1) по ближайшему рангу; для пустого списка - 0."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
@@ -0,0 +1,37 @@
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+# Config собирает URL базы из окружения при импорте; движок SQLAlchemy к базе
+# не подключается, пока ее не используют, так что тестам хватает заглушек
+for name, value in {"POSTGRES_USER": "test", "POSTGRES_PASSWORD": "test", "POSTGRES_HOST": "localhost",
+                    "POSTGRES_PORT": "5432", "POSTGRES_DB": "test"}.items():
+    os.environ.setdefault(name, value)
+
+from src.backend import services  # noqa: E402
+from src.routers import query as query_router  # noqa: E402
+from tests.fakes import FakeLLMInterface, FakeRag, FakeSession  # noqa: E402
+
+
+@pytest.fixture
+def stubs(monkeypatch):
+    """Чат 1 принадлежит пользователю 1; БД, RAG и LLM заменены заглушками."""
+    state = SimpleNamespace(saved=[], rag=FakeRag())
+
+    def get_user_chat(db, chat_id, user_id):
+        # владелец проверяется дольше, чем идут остальные этапы
+        time.sleep(0.2)
+        return SimpleNamespace(summary="en") if user_id == 1 else None
+
+    monkeypatch.setattr(query_router, "_get_user_chat", get_user_chat)
+    monkeypatch.setattr(query_router, "_load_chat_history",
+                        lambda chat_id: [SimpleNamespace(role="user", text="hi")])
+    monkeypatch.setattr(query_router, "_save_exchange",
+                        lambda db, query, answer, context: state.saved.append((query.chat_id, answer, context)))
+    monkeypatch.setattr(query_router, "PostgresSessionLocal", FakeSession)
+    monkeypatch.setattr(query_router.relevance_gate, "log_path", None)
+    monkeypatch.setattr(services.rag_service, "_instance", state.rag)
+    monkeypatch.setattr(services.llm_interface, "_instance", FakeLLMInterface())
+    return state
@@ -0,0 +1,92 @@
+"""Заглушки RAG, LLM, эмбеддера, реранкера, токенизатора и сессии БД для тестов."""
+import time
+
+from langchain_community.cross_encoders import BaseCrossEncoder
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding, Embeddings
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.output_parsers.string import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+
+class FakeRag:
+    def __init__(self, delay_s: float = 0.0):
+        self.searches = []
+        self.delay_s = delay_s
+
+    def is_document_in_index(self, chat_id, file_name):
+        return False
+
+    def query_index(self, question, chat_id, with_scores=False):
+        self.searches.append((question, chat_id))
+        # блокирует поток, как настоящие эмбеддинг, FAISS и реранкер
+        time.sleep(self.delay_s)
+        doc = Document(page_content="the answer is 42", metadata={"source": "notes.txt"})
+        return [(doc, 0.9)] if with_scores else [doc]
+
+
+class FakeLLMInterface:
+    def __init__(self):
+        self.mistral_llm = FakeListChatModel(responses=["standalone question?"])
+
+    @staticmethod
+    async def _answer(text):
+        chain = ChatPromptTemplate.from_messages([("user", "{q}")]) | FakeListChatModel(responses=[text]) \
+            | StrOutputParser()
+        return await chain.ainvoke({"q": "question"})
+
+    async def agenerate_response_from_context(self, question, context, history):
+        return await self._answer(f"From context: {context}")
+
+    async def agenerate(self, question, history, user_id, context, language, retrieval_tool=None):
+        found = await retrieval_tool.ainvoke({"query": question}) if retrieval_tool else ""
+        return await self._answer(f"Agent: {found[:40]}")
+
+
+class FakeSession:
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class CountingEmbeddings(Embeddings):
+    """Детерминированный эмбеддер, запоминающий тексты каждого вызова модели."""
+
+    def __init__(self, size: int = 8, delay_s: float = 0.0):
+        self.model = DeterministicFakeEmbedding(size=size)
+        self.delay_s = delay_s
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        time.sleep(self.delay_s)
+        return self.model.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class CountingCrossEncoder(BaseCrossEncoder):
+    """Реранкер с оценкой по длине чанка, запоминающий пары каждого вызова модели."""
+
+    def __init__(self):
+        self.calls = []
+
+    def score(self, text_pairs):
+        self.calls.append(list(text_pairs))
+        return [float(len(text)) for _, text in text_pairs]
+
+
+def word_tokenizer():
+    """HF-токенизатор без словаря модели: токен - слово через пробел, плюс [CLS] и [SEP]."""
+    from tokenizers import Tokenizer, models, pre_tokenizers, processors
+    from transformers import PreTrainedTokenizerFast
+
+    tokenizer = Tokenizer(models.WordLevel({"[UNK]": 0, "[CLS]": 1, "[SEP]": 2}, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single="[CLS] $A [SEP]", special_tokens=[("[CLS]", 1), ("[SEP]", 2)])
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, unk_token="[UNK]",
+                                   cls_token="[CLS]", sep_token="[SEP]")
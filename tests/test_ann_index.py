@@ -0,0 +1,109 @@
+from types import SimpleNamespace
+
+import faiss
+import numpy as np
+import pytest
+
+from src.config.config import Config
+from src.rag.ann_index import build_ann_index, is_flat, maybe_promote, measure_recall, recall_queries
+
+
+def _vectors(n: int, d: int = 16, seed: int = 0) -> np.ndarray:
+    # кластеры, как у эмбеддингов документов на несколько тем
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((8, d))
+    vectors = centers[rng.integers(0, 8, n)] + 0.3 * rng.standard_normal((n, d))
+    return vectors.astype(np.float32)
+
+
+def _flat_store(vectors: np.ndarray) -> SimpleNamespace:
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    return SimpleNamespace(index=index)
+
+
+@pytest.fixture
+def ann_config(monkeypatch):
+    monkeypatch.setattr(Config, "RAG_ANN_THRESHOLD", 500)
+    monkeypatch.setattr(Config, "RAG_ANN_INDEX_TYPE", "hnsw")
+    monkeypatch.setattr(Config, "RAG_ANN_MIN_RECALL", 0.5)
+    monkeypatch.setattr(Config, "RAG_ANN_RECALL_SAMPLES", 50)
+    monkeypatch.setattr(Config, "RAG_ANN_REBUILD_FACTOR", 2.0)
+
+
+def test_small_index_stays_flat(ann_config):
+    store = _flat_store(_vectors(499))
+
+    assert maybe_promote(store, {}, lambda: pytest.fail("vectors are not needed")) is None
+    assert is_flat(store.index)
+
+
+def test_large_index_is_promoted(ann_config):
+    vectors = _vectors(600)
+    store = _flat_store(vectors)
+
+    info = maybe_promote(store, {}, lambda: vectors)
+
+    assert info["type"] == "hnsw" and info["ann_attempt_ntotal"] == 600
+    assert isinstance(store.index, faiss.IndexHNSWFlat) and store.index.ntotal == 600
+
+
+def test_failed_promotion_is_retried_after_growth(ann_config, monkeypatch):
+    monkeypatch.setattr(Config, "RAG_ANN_MIN_RECALL", 1.01)
+    vectors = _vectors(800)
+    store = _flat_store(vectors[:600])
+
+    info = maybe_promote(store, {}, lambda: vectors[:600])
+    assert info == {"type": "flat", "ann_attempt_ntotal": 600, "recall": pytest.approx(info["recall"])}
+    assert is_flat(store.index)
+
+    store = _flat_store(vectors[:700])
+    assert maybe_promote(store, info, lambda: vectors[:700]) is None
+    store = _flat_store(vectors[:750])
+    assert maybe_promote(store, info, lambda: vectors[:750])["ann_attempt_ntotal"] == 750
+
+
+def test_recall_queries_are_not_stored_vectors():
+    vectors = _vectors(300)
+    exact = _flat_store(vectors).index
+
+    queries = recall_queries(exact, vectors, samples=50)
+
+    distances, _ = exact.search(queries, 1)
+    assert (distances[:, 0] > 1e-6).all()
+    # по самим сохраненным векторам recall плохого индекса выглядел бы лучше
+    coarse = build_ann_index(vectors, faiss.METRIC_L2, "ivfpq")
+    coarse.nprobe = 1
+    assert measure_recall(exact, coarse, queries) < measure_recall(exact, coarse, vectors[:50])
+
+
+def test_promoted_index_is_retrained_after_growth(ann_config, monkeypatch):
+    monkeypatch.setattr(Config, "RAG_ANN_INDEX_TYPE", "ivfpq")
+    monkeypatch.setattr(Config, "RAG_ANN_MIN_RECALL", 0.0)
+    vectors = _vectors(1300)
+    store = SimpleNamespace(index=build_ann_index(vectors[:600], faiss.METRIC_L2, "ivfpq"))
+    info = {"type": "ivfpq", "ann_attempt_ntotal": 600, "recall": 0.9}
+
+    store.index.add(vectors[600:1100])
+    assert maybe_promote(store, info, lambda: pytest.fail("not grown enough")) is None
+
+    store.index.add(vectors[1100:])
+    requested = []
+    info = maybe_promote(store, info, lambda: requested.append(True) or vectors)
+
+    assert requested
+    assert info["type"] == "ivfpq" and info["ann_attempt_ntotal"] == 1300
+    # центроидов больше: nlist растет с числом векторов
+    assert store.index.nlist == int(4 * np.sqrt(1300)) and store.index.ntotal == 1300
+
+
+def test_rebuilt_index_with_low_recall_falls_back_to_exact(ann_config, monkeypatch):
+    vectors = _vectors(1200)
+    store = SimpleNamespace(index=build_ann_index(vectors, faiss.METRIC_L2, "hnsw"))
+    monkeypatch.setattr(Config, "RAG_ANN_MIN_RECALL", 1.01)
+
+    info = maybe_promote(store, {"type": "hnsw", "ann_attempt_ntotal": 600}, lambda: vectors)
+
+    assert info["type"] == "flat"
+    assert is_flat(store.index)
+    np.testing.assert_array_equal(store.index.reconstruct_n(0, 1200), vectors)
@@ -0,0 +1,75 @@
+import pytest
+
+from src.rag.dedup import MinHasher, NearDuplicateIndex
+
+BASE = " ".join(f"word{i}" for i in range(60))
+
+
+def _index(tmp_path, threshold=0.8):
+    return NearDuplicateIndex(str(tmp_path / "minhash.sqlite"), num_perm=64, bands=16,
+                              threshold=threshold, shingle_size=3)
+
+
+def test_signature_estimates_jaccard_similarity():
+    hasher = MinHasher(num_perm=256, shingle_size=3)
+    same = hasher.signature(BASE)
+
+    # регистр и пунктуация не влияют на шинглы
+    assert (hasher.signature(BASE.upper() + "!") == same).all()
+    edited = hasher.signature(BASE.replace("word30", "other"))
+    unrelated = hasher.signature(" ".join(f"term{i}" for i in range(60)))
+    # замена одного слова убивает 3 шингла из 58: Жаккар 55/61
+    assert (edited == same).mean() == pytest.approx(55 / 61, abs=0.1)
+    assert (unrelated == same).mean() < 0.1
+
+
+def test_near_duplicates_map_to_the_original_chunk(tmp_path):
+    index = _index(tmp_path)
+    chunk_ids, is_new, signatures = index.deduplicate([BASE, "something else entirely"], next_id=0)
+    assert (chunk_ids, is_new) == ([0, 1], [True, True])
+    index.add(signatures)
+
+    chunk_ids, is_new, signatures = index.deduplicate(
+        [BASE.replace("word59", "end"), "a new unrelated chunk of text"], next_id=2)
+
+    assert (chunk_ids, is_new) == ([0, 2], [False, True])
+    assert [chunk_id for chunk_id, _ in signatures] == [2]
+    assert index.count() == 2
+
+
+def test_duplicates_within_one_batch_are_found_before_saving(tmp_path):
+    index = _index(tmp_path)
+
+    chunk_ids, is_new, signatures = index.deduplicate([BASE, "other text here", BASE], next_id=5)
+
+    assert (chunk_ids, is_new) == ([5, 6, 5], [True, True, False])
+    assert len(signatures) == 2
+
+
+def test_truncate_forgets_unpublished_chunks(tmp_path):
+    index = _index(tmp_path)
+    _, _, signatures = index.deduplicate([BASE, "second chunk text"], next_id=0)
+    index.add(signatures)
+
+    assert index.truncate(1) == 1
+    assert index.count() == 1
+    chunk_ids, is_new, _ = index.deduplicate(["second chunk text"], next_id=1)
+    assert (chunk_ids, is_new) == ([1], [True])
+
+
+def test_add_replace_all_rebuilds_signatures(tmp_path):
+    index = _index(tmp_path)
+    _, _, signatures = index.deduplicate([BASE, "second chunk text"], next_id=0)
+    index.add(signatures)
+
+    index.add([(0, index.hasher.signature("second chunk text"))], replace_all=True)
+
+    assert index.count() == 1
+    assert index.deduplicate([BASE], next_id=1)[:2] == ([1], [True])
+    assert index.deduplicate(["second chunk text"], next_id=1)[:2] == ([0], [False])
+
+
+def test_bands_must_divide_signature(tmp_path):
+    with pytest.raises(ValueError):
+        NearDuplicateIndex(str(tmp_path / "minhash.sqlite"), num_perm=64, bands=10,
+                           threshold=0.8, shingle_size=3)
@@ -0,0 +1,91 @@
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+from src.rag import embedding_cache as cache_module
+from src.rag.embedding_cache import CachedEmbeddings, EmbeddingCache
+from tests.fakes import CountingEmbeddings
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Время, которое идет вперед на секунду при каждом обращении."""
+    state = SimpleNamespace(now=0.0)
+
+    def tick():
+        state.now += 1
+        return state.now
+
+    monkeypatch.setattr(cache_module, "time", SimpleNamespace(time=tick))
+    return state
+
+
+def _cached(tmp_path, max_entries=100, model_name="model"):
+    model = CountingEmbeddings()
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_entries=max_entries)
+    return model, CachedEmbeddings(model, cache, model_name=model_name)
+
+
+def test_repeated_texts_are_embedded_once(tmp_path):
+    model, embeddings = _cached(tmp_path)
+
+    first = embeddings.embed_documents(["a", "b", "a"])
+    second = embeddings.embed_documents(["b", "c"])
+
+    assert model.calls == [["a", "b"], ["c"]]
+    assert first[0] == first[2] == pytest.approx(model.model.embed_query("a"))
+    assert second[0] == pytest.approx(first[1])
+    # повтор внутри одного вызова тоже считается промахом: текст еще не в кэше
+    assert (embeddings.stats()["hits"], embeddings.stats()["misses"]) == (1, 4)
+
+
+def test_cache_is_shared_across_instances_but_not_models(tmp_path):
+    _, embeddings = _cached(tmp_path)
+    embeddings.embed_documents(["shared chunk"])
+
+    model, same_model = _cached(tmp_path)
+    same_model.embed_documents(["shared chunk"])
+    assert model.calls == []
+
+    model, other_model = _cached(tmp_path, model_name="model@onnx-int8")
+    other_model.embed_documents(["shared chunk"])
+    assert model.calls == [["shared chunk"]]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_entries=3)
+    for key in ("a", "b", "c"):
+        cache.put_many({key: [1.0]})
+    cache.get_many(["a"])
+
+    cache.put_many({"d": [1.0]})
+
+    assert set(cache.get_many(["a", "b", "c", "d"])) == {"a", "c", "d"}
+
+
+def test_size_is_checked_once_per_percent_of_capacity(tmp_path, clock):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_entries=200)
+    cache.put_many({f"k{i}": [1.0] for i in range(200)})
+    # лимит превышен на одну запись - меньше шага проверки (2 записи)
+    cache.put_many({"k200": [1.0]})
+    assert len(cache.get_many([f"k{i}" for i in range(201)])) == 201
+
+    cache.put_many({"k201": [1.0]})
+    assert len(cache.get_many([f"k{i}" for i in range(202)])) == 200
+
+
+def test_connections_are_closed(tmp_path, monkeypatch):
+    connections = []
+    connect = sqlite3.connect
+    monkeypatch.setattr(cache_module.sqlite3, "connect",
+                        lambda *args, **kwargs: connections.append(connect(*args, **kwargs)) or connections[-1])
+
+    _, embeddings = _cached(tmp_path)
+    embeddings.embed_documents(["a", "b"])
+    embeddings.embed_documents(["a"])
+
+    assert connections
+    for conn in connections:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
@@ -0,0 +1,62 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.rag.embedding_scheduler import BatchingEmbeddings
+from tests.fakes import CountingEmbeddings
+
+
+def _embed_concurrently(scheduler, texts):
+    with ThreadPoolExecutor(max_workers=len(texts)) as pool:
+        return list(pool.map(scheduler.embed_query, texts))
+
+
+def test_concurrent_queries_are_embedded_in_one_batch():
+    model = CountingEmbeddings()
+    # окно ожидания с запасом: батч закрывается по размеру, а не по таймеру
+    scheduler = BatchingEmbeddings(model, max_batch_size=4, max_wait_ms=2000)
+    texts = ["a", "b", "c", "d"]
+
+    vectors = _embed_concurrently(scheduler, texts)
+
+    assert len(model.calls) == 1
+    assert sorted(model.calls[0]) == texts
+    assert vectors == [pytest.approx(model.model.embed_query(text)) for text in texts]
+    stats = scheduler.stats()
+    assert (stats["batches"], stats["requests"], stats["texts"]) == (1, 4, 4)
+
+
+def test_batch_does_not_grow_past_max_batch_size():
+    model = CountingEmbeddings(delay_s=0.01)
+    scheduler = BatchingEmbeddings(model, max_batch_size=2, max_wait_ms=50)
+    texts = [f"text {i}" for i in range(6)]
+
+    vectors = _embed_concurrently(scheduler, texts)
+
+    assert all(len(call) <= 2 for call in model.calls)
+    assert sorted(text for call in model.calls for text in call) == sorted(texts)
+    assert vectors == [pytest.approx(model.model.embed_query(text)) for text in texts]
+
+
+def test_documents_of_one_request_stay_together_and_in_order():
+    model = CountingEmbeddings()
+    scheduler = BatchingEmbeddings(model, max_batch_size=2, max_wait_ms=1)
+    texts = ["x", "y", "z"]
+
+    # запрос больше max_batch_size не режется: батч закрывается после него целиком
+    assert scheduler.embed_documents(texts) == [pytest.approx(v) for v in model.model.embed_documents(texts)]
+    assert model.calls == [texts]
+    assert scheduler.embed_documents([]) == []
+
+
+def test_model_error_fails_the_batch_but_not_the_scheduler(monkeypatch):
+    model = CountingEmbeddings()
+    scheduler = BatchingEmbeddings(model, max_batch_size=4, max_wait_ms=1)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(model, "embed_documents", lambda texts: (_ for _ in ()).throw(RuntimeError("oom")))
+        with pytest.raises(RuntimeError, match="oom"):
+            scheduler.embed_query("a")
+
+    assert scheduler.embed_query("a") == pytest.approx(model.model.embed_query("a"))
+    assert scheduler.stats()["batches"] == 1
@@ -0,0 +1,62 @@
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from src.rag.index_cache import IndexCache, estimate_vector_store_size
+
+
+def test_least_recently_used_index_is_evicted_over_budget():
+    cache = IndexCache(max_bytes=100)
+    cache.put(1, "one", token="v1", size=40)
+    cache.put(2, "two", token="v1", size=40)
+    # обращение к 1 делает самым старым индекс 2
+    assert cache.get(1, "v1") == "one"
+
+    cache.put(3, "three", token="v1", size=40)
+
+    assert cache.get(2, "v1") is None
+    assert cache.get(1, "v1") == "one"
+    assert cache.get(3, "v1") == "three"
+    stats = cache.stats()
+    assert (stats["entries"], stats["size_bytes"], stats["evictions"]) == (2, 80, 1)
+    assert (stats["hits"], stats["misses"]) == (3, 1)
+
+
+def test_index_larger_than_budget_is_not_cached():
+    cache = IndexCache(max_bytes=100)
+    cache.put(1, "one", token="v1", size=60)
+
+    cache.put(2, "huge", token="v1", size=101)
+
+    assert cache.get(2, "v1") is None
+    assert cache.get(1, "v1") == "one"
+    assert cache.stats()["size_bytes"] == 60
+
+
+def test_new_token_invalidates_entry():
+    cache = IndexCache(max_bytes=100)
+    cache.put(1, "old", token="v1", size=10)
+
+    assert cache.get(1, "v2") is None
+    assert cache.get(1, "v1") is None
+    stats = cache.stats()
+    assert (stats["entries"], stats["size_bytes"], stats["invalidations"]) == (0, 0, 1)
+
+
+def test_put_replaces_entry_without_double_counting():
+    cache = IndexCache(max_bytes=100)
+    cache.put(1, "old", token="v1", size=30)
+    cache.put(1, "new", token="v2", size=50)
+
+    assert cache.get(1, "v2") == "new"
+    assert cache.stats()["size_bytes"] == 50
+
+    cache.invalidate(1)
+    assert cache.stats()["size_bytes"] == 0
+
+
+def test_size_estimate_counts_vectors_and_chunk_texts():
+    texts = ["a" * 100, "b" * 300]
+    vector_store = FAISS.from_texts(texts, DeterministicFakeEmbedding(size=16))
+
+    # два float32-вектора размерности 16 + тексты с оверхедом на объект
+    assert estimate_vector_store_size(vector_store) == 2 * 16 * 4 + 400 + 2 * 256
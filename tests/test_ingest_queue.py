@@ -0,0 +1,168 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+import requests
+
+from src.rag import ingest_queue as ingest_module
+from src.rag.ingest_queue import IngestionQueue
+
+
+class BrokenPool:
+    """Пул, воркер которого умер: как ProcessPoolExecutor, отказывает в submit."""
+
+    def submit(self, *args, **kwargs):
+        raise BrokenProcessPool("A process in the process pool was terminated abruptly")
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+class FakeManager:
+    def __init__(self):
+        self.stopped = False
+
+    def shutdown(self):
+        self.stopped = True
+
+
+class ThreadQueue(IngestionQueue):
+    """Очередь на потоках вместо процессов; первым выдается пул из pools, если он есть."""
+
+    def __init__(self, pools=(), wait_timeout_s=5.0):
+        super().__init__(max_workers=1, max_pending=2, job_ttl_s=60, wait_timeout_s=wait_timeout_s)
+        self._manager = FakeManager()
+        self._progress = {}
+        self.pools = list(pools)
+        self.created = 0
+
+    def _create_executor(self, ctx):
+        self.created += 1
+        return self.pools.pop(0) if self.pools else ThreadPoolExecutor(max_workers=1)
+
+
+@pytest.fixture
+def release(monkeypatch):
+    """Задачи индексации ждут release.set() и возвращают один чанк."""
+    event = threading.Event()
+
+    def run_job(job_id, chat_id, file_url, file_name, progress):
+        event.wait(5)
+        return [file_name]
+
+    monkeypatch.setattr(ingest_module, "_run_ingest_job", run_job)
+    yield event
+    event.set()
+
+
+@pytest.mark.asyncio
+async def test_broken_pool_is_recreated(release):
+    queue = ThreadQueue(pools=[BrokenPool()])
+    queue._ensure_started()
+    release.set()
+
+    job_id = queue.submit(1, "http://files/doc.txt", "doc.txt")
+
+    assert await queue.wait(job_id) == ["doc.txt"]
+    assert queue.created == 2
+    assert queue.get_status(job_id)["status"] == "done"
+
+
+@pytest.mark.asyncio
+async def test_rejected_job_is_not_left_queued(release):
+    queue = ThreadQueue(pools=[BrokenPool(), BrokenPool()])
+
+    with pytest.raises(BrokenProcessPool):
+        queue.submit(1, "http://files/doc.txt", "doc.txt")
+
+    assert queue.stats()["queued"] == 0
+    release.set()
+    assert await queue.wait(queue.submit(1, "http://files/doc.txt", "doc.txt")) == ["doc.txt"]
+
+
+@pytest.mark.asyncio
+async def test_wait_times_out_without_cancelling_the_job(release):
+    queue = ThreadQueue(wait_timeout_s=0.05)
+    running = queue.submit(1, "http://files/a.txt", "a.txt")
+    # вторая задача еще стоит в очереди пула - ее отмена прошла бы успешно
+    queued = queue.submit(1, "http://files/b.txt", "b.txt")
+
+    for job_id in (running, queued):
+        with pytest.raises(asyncio.TimeoutError):
+            await queue.wait(job_id)
+
+    release.set()
+    assert await queue.wait(queued, timeout=5) == ["b.txt"]
+    assert queue.get_status(running)["status"] == "done"
+
+
+@pytest.mark.asyncio
+async def test_resubmitted_document_reuses_running_job(release):
+    queue = ThreadQueue()
+    job_id = queue.submit(1, "http://files/doc.txt", "doc.txt")
+
+    assert queue.submit(1, "http://files/doc.txt", "doc.txt") == job_id
+    other = queue.submit(2, "http://files/doc.txt", "doc.txt")
+    assert other != job_id
+
+    release.set()
+    assert await queue.wait(job_id, timeout=5) == ["doc.txt"]
+    # готовый документ можно отправить заново - это уже новая задача
+    assert queue.submit(1, "http://files/doc.txt", "doc.txt") != job_id
+
+
+def test_shutdown_stops_pool_and_manager(release):
+    queue = ThreadQueue()
+    manager = queue._manager
+    running = queue.submit(1, "http://files/a.txt", "a.txt")
+    queued = queue.submit(1, "http://files/b.txt", "b.txt")
+
+    queue.shutdown(wait=False)
+
+    assert manager.stopped
+    assert queue.get_status(queued)["status"] == "failed"
+    release.set()
+    assert queue.get_status(running)["job_id"] == running
+
+
+class FakeResponse:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+
+def test_download_replaces_document_only_when_complete(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest_module, "DOWNLOADS_DIR", str(tmp_path))
+    indexed = []
+    monkeypatch.setattr(ingest_module, "_worker_rag_service", type("Rag", (), {
+        "add_document_to_index": staticmethod(lambda path, chat_id: indexed.append(path) or ["chunk"])})())
+    file_path = tmp_path / "chat_1" / "doc.txt"
+
+    monkeypatch.setattr(requests, "post", lambda *args, **kwargs: FakeResponse([b"new ", b"text"]))
+    assert ingest_module._run_ingest_job("a", 1, "http://files/doc.txt", "doc.txt", {}) == ["chunk"]
+    assert file_path.read_bytes() == b"new text"
+
+    monkeypatch.setattr(requests, "post", lambda *args, **kwargs: FakeResponse(
+        [b"partial", requests.ConnectionError("connection reset")]))
+    with pytest.raises(requests.ConnectionError):
+        ingest_module._run_ingest_job("b", 1, "http://files/doc.txt", "doc.txt", {})
+    assert file_path.read_bytes() == b"new text"
+    assert os.listdir(file_path.parent) == ["doc.txt"]
+    assert indexed == [str(file_path)]
@@ -0,0 +1,43 @@
+import time
+
+import pytest
+
+from src.rag import loaders
+from src.rag.loaders import iter_documents, loader_stats
+
+
+@pytest.fixture
+def text_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(loaders, "TEXT_SECTION_CHARS", 10)
+    path = tmp_path / "doc.txt"
+    path.write_text("".join(f"line {i:05d}\n" for i in range(5)), encoding="utf-8")
+    return str(path)
+
+
+def _plain_text_stats() -> dict:
+    return loader_stats().get("plain_text", {"files": 0, "sections": 0, "seconds": 0.0})
+
+
+def test_loader_time_excludes_consumer_work(text_file):
+    before = _plain_text_stats()
+
+    for _ in iter_documents(text_file):
+        # эмбеддинг и запись в индекс между секциями
+        time.sleep(0.05)
+
+    after = _plain_text_stats()
+    assert after["files"] - before["files"] == 1
+    assert after["sections"] - before["sections"] == 5
+    assert after["seconds"] - before["seconds"] < 0.05
+
+
+def test_stats_are_recorded_when_consumer_stops_early(text_file):
+    before = _plain_text_stats()
+
+    documents = iter_documents(text_file)
+    next(documents)
+    documents.close()
+
+    after = _plain_text_stats()
+    assert after["files"] - before["files"] == 1
+    assert after["sections"] - before["sections"] == 1
@@ -0,0 +1,54 @@
+import asyncio
+import gc
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi import Response
+
+from src.backend.models import Query
+from src.routers import query as query_router
+from src.utlis.loop_lag import LoopLagMonitor
+from tests.fakes import FakeSession
+
+# каждый блокирующий шаг заглушек дольше бюджета: если хоть один попадет в
+# event loop, монитор это увидит
+BLOCKING_S = 0.15
+BUDGET_MS = 100
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["pipeline", "agent"])
+async def test_concurrent_queries_do_not_block_event_loop(stubs, monkeypatch, mode):
+    stubs.rag.delay_s = BLOCKING_S
+
+    def load_chat_history(chat_id):
+        time.sleep(BLOCKING_S)
+        return [SimpleNamespace(role="user", text="hi")]
+
+    def save_exchange(db, query, answer, context):
+        time.sleep(BLOCKING_S)
+        stubs.saved.append((query.chat_id, answer, context))
+
+    monkeypatch.setattr(query_router, "_load_chat_history", load_chat_history)
+    monkeypatch.setattr(query_router, "_save_exchange", save_exchange)
+
+    # полная сборка мусора по всем модулям, импортированным тестами, тоже
+    # останавливает loop (~150 мс), но к блокирующим вызовам /query отношения не имеет
+    gc.collect()
+    gc.freeze()
+    monitor = LoopLagMonitor(interval_s=0.01)
+    monitor.start()
+    try:
+        await asyncio.gather(*(
+            query_router.process_query(Query(question=f"what {i}?", user_id=1, chat_id=1), Response(),
+                                       FakeSession(), debug_timings=None, query_mode=mode)
+            for i in range(8)))
+    finally:
+        monitor.stop()
+        gc.unfreeze()
+
+    stats = monitor.stats()
+    assert len(stubs.saved) == 8
+    assert stats["samples"] > 10
+    assert stats["max_ms"] < BUDGET_MS, stats
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+from fastapi import HTTPException, Response
+
+from src.backend.models import AttachmentCreate, Query
+from src.routers import query as query_router
+from tests.fakes import FakeSession
+
+
+async def _run_query(user_id: int, mode: str):
+    return await query_router.process_query(Query(question="what?", user_id=user_id, chat_id=1), Response(),
+                                            FakeSession(), debug_timings=None, query_mode=mode)
+
+
+async def _stream_events(user_id: int, mode: str):
+    response = await query_router.process_query_stream(Query(question="what?", user_id=user_id, chat_id=1),
+                                                       query_mode=mode)
+    events = []
+    async for chunk in response.body_iterator:
+        event, data = chunk.strip().split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["pipeline", "agent"])
+async def test_query_answers_and_saves_exchange(stubs, mode):
+    result = await _run_query(user_id=1, mode=mode)
+
+    assert [item.source for item in result.context] == ["notes.txt"]
+    assert stubs.saved == [(1, result.answer, ["notes.txt"])]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["pipeline", "agent"])
+async def test_foreign_chat_is_not_searched_or_saved(stubs, mode):
+    with pytest.raises(HTTPException) as error:
+        await _run_query(user_id=2, mode=mode)
+
+    assert "Chat not found" in error.value.detail
+    assert stubs.rag.searches == []
+    assert stubs.saved == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["pipeline", "agent"])
+async def test_stream_for_foreign_chat_emits_only_error(stubs, mode):
+    events = await _stream_events(user_id=2, mode=mode)
+
+    assert events == [("error", {"status": 404, "detail": "Chat not found or does not belong to user"})]
+    assert stubs.saved == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["pipeline", "agent"])
+async def test_stream_saves_same_exchange_as_query(stubs, mode):
+    result = await _run_query(user_id=1, mode=mode)
+    events = await _stream_events(user_id=1, mode=mode)
+
+    names = [name for name, _ in events]
+    assert names[-1] == "done"
+    done = events[-1][1]
+    tokens = "".join(data["text"] for name, data in events if name == "token")
+    # токены переформулировки и проверки релевантности в поток не попадают
+    assert tokens == done["answer"] == result.answer
+    assert stubs.saved[0] == stubs.saved[1]
+
+
+@pytest.mark.asyncio
+async def test_background_ingest_job_is_returned(stubs, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(query_router.ingestion_queue, "submit",
+                        lambda chat_id, url, file_name: submitted.append(file_name) or f"job-{len(submitted)}")
+    query = Query(question="what?", user_id=1, chat_id=1, wait_for_ingest=False,
+                  attachments=[AttachmentCreate(url="http://files/report.pdf", file_name="report.pdf",
+                                                file_type="application/pdf")])
+
+    result = await query_router.process_query(query, Response(), FakeSession(), debug_timings=None,
+                                              query_mode="pipeline")
+    assert result.ingest_jobs == ["job-1"]
+
+    response = await query_router.process_query_stream(query, query_mode="pipeline")
+    events = [chunk async for chunk in response.body_iterator]
+    assert events[0] == 'event: ingest\ndata: {"job_id": "job-2", "file_name": "report.pdf"}\n\n'
+    assert '"ingest_jobs": ["job-2"]' in events[-1]
@@ -0,0 +1,333 @@
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from src.config.config import Config
+from src.rag import rag_service as rag_module
+from src.rag.embedding_scheduler import BatchingEmbeddings
+from src.rag import chunk_store as chunk_store_module
+from src.rag import lexical_index as lexical_module
+from src.rag.dedup import dedup_stats
+from src.rag.index_cache import index_cache
+from src.rag.manifest import DocumentManifest
+from src.rag.mmap_index import load_mmap_vector_store
+from src.rag.rag_service import RAGService
+
+CHAT_ID = 1
+
+
+def _paragraphs(name: str, count: int) -> str:
+    return "\n\n".join(f"{name} paragraph {i}: " + " ".join(f"{name}{i}w{j}" for j in range(8))
+                       for i in range(count))
+
+
+@pytest.fixture
+def rag(tmp_path, monkeypatch):
+    """RAGService с настоящими FAISS / хранилищами в tmp_path и фиктивным эмбеддером."""
+    monkeypatch.setattr(rag_module, "RAG_INDEXES_DIR", str(tmp_path / "indexes"))
+    monkeypatch.setattr(Config, "RAG_INGEST_BATCH_SIZE", 4)
+    (tmp_path / "indexes").mkdir()
+    index_cache.invalidate(CHAT_ID)
+
+    service = RAGService.__new__(RAGService)
+    service.embedding_model = DeterministicFakeEmbedding(size=16)
+    service.embedding_scheduler = BatchingEmbeddings(service.embedding_model, max_batch_size=8, max_wait_ms=1)
+    service.text_splitter = RecursiveCharacterTextSplitter(chunk_size=120, chunk_overlap=0)
+    service.reranker = SimpleNamespace(score=lambda pairs: [0.5] * len(pairs))
+    service.docs_dir = tmp_path / "docs"
+    service.docs_dir.mkdir()
+    yield service
+    index_cache.invalidate(CHAT_ID)
+
+
+def _ingest(rag, name: str, paragraphs: int = 6, text: str = None) -> list:
+    path = rag.docs_dir / name
+    path.write_text(text or _paragraphs(name.split(".")[0], paragraphs), encoding="utf-8")
+    return rag.add_document_to_index(str(path), CHAT_ID)
+
+
+def _assert_aligned(rag):
+    """Хранилище чанков, BM25 и LSH содержат ровно по чанку на вектор опубликованного FAISS."""
+    snapshot = rag._snapshots(CHAT_ID).current()
+    vector_store = FAISS.load_local(snapshot.index_path, rag.embedding_model, allow_dangerous_deserialization=True)
+    chunk_store = rag._get_chunk_store(CHAT_ID, snapshot)
+    ntotal = vector_store.index.ntotal
+    assert len(chunk_store) == ntotal
+    assert rag._get_lexical_index(CHAT_ID).count() == ntotal
+    assert rag._get_dedup_index(CHAT_ID).count() == ntotal
+
+    manifest = rag._get_manifest(CHAT_ID, snapshot)
+    for name in manifest.live_documents:
+        chunk_ids = manifest.get_chunk_ids(name)
+        assert {chunk.metadata["source"].rsplit("/", 1)[-1] for chunk in chunk_store.read(chunk_ids)} == {name}
+        docs = rag._docs_at_positions(vector_store, chunk_ids)
+        assert [doc.page_content for doc in docs] == [chunk.page_content for chunk in chunk_store.read(chunk_ids)]
+
+
+def test_failed_faiss_add_does_not_shift_later_chunks(rag, monkeypatch):
+    assert _ingest(rag, "first.txt")
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("disk full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(FAISS, "add_embeddings", fail)
+        with pytest.raises(RuntimeError):
+            _ingest(rag, "broken.txt")
+    _assert_aligned(rag)
+
+    assert _ingest(rag, "second.txt")
+    assert not rag.is_document_in_index(CHAT_ID, "broken.txt")
+    _assert_aligned(rag)
+
+
+def test_unpublished_tail_left_by_a_crash_is_dropped(rag):
+    assert _ingest(rag, "first.txt")
+    # процесс умер после записи в хранилища, но до публикации снимка
+    chunk_store = rag._get_chunk_store(CHAT_ID)
+    orphans = chunk_store.read([0, 1])
+    start, _ = chunk_store.append(orphans)
+    rag._get_lexical_index(CHAT_ID).add_documents(orphans, start)
+
+    assert _ingest(rag, "second.txt")
+    _assert_aligned(rag)
+
+
+def test_interrupted_compaction_rebuilds_side_stores(rag):
+    assert _ingest(rag, "first.txt")
+    assert _ingest(rag, "second.txt")
+    # компакция заменила BM25 и LSH, но упала до публикации снимка
+    chunk_store = rag._get_chunk_store(CHAT_ID)
+    rag._get_lexical_index(CHAT_ID).replace_all(chunk_store.read([0]))
+    rag._get_dedup_index(CHAT_ID).truncate(1)
+
+    assert _ingest(rag, "third.txt")
+    _assert_aligned(rag)
+
+
+def _stream_then_fail(file_path):
+    """Потоковый загрузчик, который падает на середине файла."""
+    for i in range(6):
+        yield Document(page_content=_paragraphs(f"page{i}", 4), metadata={"source": file_path})
+    raise OSError("truncated PDF")
+
+
+def test_failed_streaming_ingest_is_rolled_back(rag, monkeypatch):
+    assert _ingest(rag, "first.txt")
+    monkeypatch.setattr(Config, "RAG_STREAMING_MIN_BYTES", 0)
+    monkeypatch.setattr(Config, "RAG_INGEST_COMMIT_EVERY", 1)
+    monkeypatch.setattr(rag_module, "iter_documents", _stream_then_fail)
+
+    with pytest.raises(OSError):
+        _ingest(rag, "big.txt")
+
+    manifest = rag._get_manifest(CHAT_ID)
+    assert manifest.tombstoned() == ["big.txt"]
+    assert not rag.is_document_in_index(CHAT_ID, "big.txt")
+    _assert_aligned(rag)
+
+    report = rag.compact_index(CHAT_ID)
+    assert "skipped" not in report
+    assert list(rag._get_manifest(CHAT_ID).documents) == ["first.txt"]
+    _assert_aligned(rag)
+
+
+def test_partial_entry_left_by_a_crash_is_not_indexed(rag):
+    assert _ingest(rag, "first.txt")
+    assert _ingest(rag, "big.txt")
+    # процесс умер между промежуточными коммитами потоковой индексации
+    snapshots = rag._snapshots(CHAT_ID)
+    manifest = rag._get_manifest(CHAT_ID)
+    manifest.documents["big.txt"]["complete"] = False
+    snapshots.publish(manifest)
+
+    assert not rag.is_document_in_index(CHAT_ID, "big.txt")
+    report = rag.compact_index(CHAT_ID)
+    assert report["compacted_chunks"] == len(rag._get_manifest(CHAT_ID).get_chunk_ids("first.txt"))
+    assert list(rag._get_manifest(CHAT_ID).documents) == ["first.txt"]
+    _assert_aligned(rag)
+
+
+def test_deleted_document_sharing_a_chunk_is_not_searchable(rag, monkeypatch):
+    shared = "shared paragraph: " + " ".join(f"common{j}" for j in range(8))
+    assert _ingest(rag, "alpha.txt", text=_paragraphs("alpha", 3) + "\n\n" + shared)
+    # общий абзац beta.txt ссылается на чанк-оригинал из alpha.txt
+    assert _ingest(rag, "beta.txt", text=shared + "\n\n" + _paragraphs("beta", 3))
+    assert rag.delete_document(CHAT_ID, "alpha.txt")
+
+    parsed = []
+    dead_chunk_ids = DocumentManifest.dead_chunk_ids
+    monkeypatch.setattr(DocumentManifest, "dead_chunk_ids",
+                        lambda self, total: parsed.append(total) or dead_chunk_ids(self, total))
+
+    questions = ["alpha0w1 alpha1w2 alpha2w3 common1", "alpha paragraph common2"]
+    results = [rag.query_index(question, CHAT_ID) for question in questions] + rag.query_many(questions, CHAT_ID)
+    assert len(results) == 4
+    for docs in results:
+        contents = [doc.page_content for doc in docs]
+        assert shared in contents
+        assert not [text for text in contents if text.startswith("alpha")]
+    # мертвые чанки считаются один раз на версию индекса
+    assert len(parsed) == 1
+
+
+def test_legacy_chunks_are_migrated_once_under_concurrency(rag):
+    assert _ingest(rag, "old.txt")
+    # чат, проиндексированный до хранилища чанков и BM25: только pickle
+    chunk_store = rag._get_chunk_store(CHAT_ID)
+    chunks = list(chunk_store)
+    with open(rag._get_chunks_path(CHAT_ID), "wb") as f:
+        pickle.dump(chunks, f)
+    for path in (chunk_store.log_path, chunk_store.idx_path, rag._get_lexical_index_path(CHAT_ID)):
+        os.remove(path)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        counts = list(pool.map(lambda _: rag._get_lexical_index(CHAT_ID).count(), range(8)))
+
+    assert counts == [len(chunks)] * 8
+    assert not os.path.exists(rag._get_chunks_path(CHAT_ID))
+    assert [chunk.page_content for chunk in rag._get_chunk_store(CHAT_ID)] == [chunk.page_content for chunk in chunks]
+    _assert_aligned(rag)
+
+
+def test_positions_without_a_chunk_are_skipped(rag):
+    assert _ingest(rag, "short.txt")
+    snapshot = rag._snapshots(CHAT_ID).current()
+    chunk_store = rag._get_chunk_store(CHAT_ID, snapshot)
+    vector_store = load_mmap_vector_store(snapshot.index_path, chunk_store, rag.embedding_model)
+    count = len(chunk_store)
+    # вектор без записи в хранилище чанков (недописанный хвост)
+    vector_store.index_to_docstore_id.size = count + 1
+
+    docs = rag._docs_at_positions(vector_store, [0, count, -1])
+
+    assert docs == chunk_store.read([0])
+
+
+def test_legacy_manifest_is_built_once_under_concurrency(rag, monkeypatch):
+    assert _ingest(rag, "old.txt")
+    # чат, проиндексированный до появления манифеста
+    os.remove(rag._snapshots(CHAT_ID).current().manifest_path)
+
+    saved = []
+    save = DocumentManifest.save
+    monkeypatch.setattr(DocumentManifest, "save", lambda self: saved.append(self.path) or save(self))
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        found = list(pool.map(lambda _: rag.is_document_in_index(CHAT_ID, "old.txt"), range(8)))
+
+    assert found == [True] * 8
+    assert len(saved) == 1
+
+
+def test_lexical_index_is_reused_between_queries(rag, monkeypatch):
+    assert _ingest(rag, "first.txt")
+    lexical_index = rag._get_lexical_index(CHAT_ID)
+
+    connections = []
+    connect = lexical_module.sqlite3.connect
+    monkeypatch.setattr(lexical_module.sqlite3, "connect",
+                        lambda *args, **kwargs: connections.append(args[0]) or connect(*args, **kwargs))
+    for question in ("first0w1", "first1w2", "first2w3"):
+        assert rag.query_index(question, CHAT_ID)
+    assert rag._get_lexical_index(CHAT_ID) is lexical_index
+    # одно соединение для чтения на поток, без пересоздания схемы на запрос
+    assert len(connections) <= 1
+
+    # замененный файл базы (пересборка) открывается заново
+    os.remove(rag._get_lexical_index_path(CHAT_ID))
+    rebuilt = rag._get_lexical_index(CHAT_ID)
+    assert rebuilt is not lexical_index
+    assert rebuilt.count() == len(rag._get_chunk_store(CHAT_ID))
+
+
+def test_mmap_docstore_maps_chunk_files_once(rag, monkeypatch):
+    assert _ingest(rag, "first.txt")
+    snapshot = rag._snapshots(CHAT_ID).current()
+    chunk_store = rag._get_chunk_store(CHAT_ID, snapshot)
+    vector_store = load_mmap_vector_store(snapshot.index_path, chunk_store, rag.embedding_model)
+
+    positions = list(range(len(chunk_store)))
+    expected = [chunk.page_content for chunk in chunk_store.read(positions)]
+
+    mapped = []
+    mmap_cls = chunk_store_module.mmap.mmap
+    monkeypatch.setattr(chunk_store_module.mmap, "mmap",
+                        lambda *args, **kwargs: mapped.append(args[0]) or mmap_cls(*args, **kwargs))
+    for _ in range(3):
+        assert [doc.page_content for doc in rag._docs_at_positions(vector_store, positions)] == expected
+
+    # .idx и .log снимка отображаются один раз на докстор, а не на каждый чанк
+    assert len(mapped) == 2
+
+
+def test_ivfpq_chat_is_compacted_from_exact_vectors(rag, monkeypatch):
+    monkeypatch.setattr(Config, "RAG_ANN_THRESHOLD", 20)
+    monkeypatch.setattr(Config, "RAG_ANN_INDEX_TYPE", "ivfpq")
+    monkeypatch.setattr(Config, "RAG_ANN_MIN_RECALL", 0.0)
+    monkeypatch.setattr(Config, "RAG_ANN_RECALL_SAMPLES", 10)
+    assert _ingest(rag, "first.txt", paragraphs=20)
+    assert rag._get_manifest(CHAT_ID).index_info["type"] == "ivfpq"
+    # вдвое больше векторов - IVF-PQ переобучается на исходных векторах
+    assert _ingest(rag, "second.txt", paragraphs=20)
+    assert rag._get_manifest(CHAT_ID).index_info["ann_attempt_ntotal"] == 40
+
+    assert rag.delete_document(CHAT_ID, "first.txt")
+    monkeypatch.setattr(Config, "RAG_ANN_THRESHOLD", 1000)
+    rag.compact_index(CHAT_ID)
+
+    snapshot = rag._snapshots(CHAT_ID).current()
+    vector_store = FAISS.load_local(snapshot.index_path, rag.embedding_model, allow_dangerous_deserialization=True)
+    texts = [chunk.page_content for chunk in rag._get_chunk_store(CHAT_ID, snapshot)]
+    # векторы после компакции - исходные эмбеддинги, а не восстановленные из кодов PQ
+    np.testing.assert_allclose(vector_store.index.reconstruct_n(0, vector_store.index.ntotal),
+                               np.array(rag.embedding_model.embed_documents(texts), dtype=np.float32), atol=1e-6)
+    _assert_aligned(rag)
+
+
+def test_index_is_loaded_once_per_snapshot(rag, monkeypatch):
+    _ingest(rag, "first.txt")
+    index_cache.invalidate(CHAT_ID)
+    loads = []
+    original = rag_module.load_mmap_vector_store
+    monkeypatch.setattr(Config, "RAG_MMAP_INDEXES", True)
+    monkeypatch.setattr(rag_module, "load_mmap_vector_store",
+                        lambda *args, **kwargs: loads.append(args[0]) or original(*args, **kwargs))
+
+    first = rag._load_vector_store(CHAT_ID)
+    assert rag._load_vector_store(CHAT_ID) is first
+    assert len(loads) == 1
+
+    # новый снимок меняет токен - кэш отдает уже не старый индекс
+    _ingest(rag, "second.txt")
+    reloaded = rag._load_vector_store(CHAT_ID)
+    assert reloaded is not first
+    assert reloaded.index.ntotal > first.index.ntotal
+
+
+def test_edited_copy_of_a_document_reuses_its_chunks(rag):
+    text = _paragraphs("report", 5)
+    assert _ingest(rag, "report.txt", text=text)
+    ntotal = rag._load_vector_store(CHAT_ID).index.ntotal
+    before = dedup_stats()
+
+    # файл отличается, поэтому обходит проверку по хэшу и дедуплицируется по чанкам
+    appendix = "appendix: " + " ".join(f"extra{j}" for j in range(8))
+    assert _ingest(rag, "report_v2.txt", text=text + "\n\n" + appendix)
+
+    assert rag._load_vector_store(CHAT_ID).index.ntotal == ntotal + 1
+    manifest = rag._get_manifest(CHAT_ID, rag._snapshots(CHAT_ID).current())
+    assert manifest.get_chunk_ids("report_v2.txt") == manifest.get_chunk_ids("report.txt") + [ntotal]
+    after = dedup_stats()
+    assert (after["chunks"] - before["chunks"], after["duplicates"] - before["duplicates"]) == (ntotal + 1, ntotal)
+    assert after["bytes_saved"] - before["bytes_saved"] >= len(text) - ntotal * 2
+    # дубликаты не попадают ни в одно хранилище
+    assert len(rag._get_chunk_store(CHAT_ID)) == rag._get_dedup_index(CHAT_ID).count() == ntotal + 1
@@ -0,0 +1,76 @@
+import json
+
+import numpy as np
+import pytest
+
+from src.config.config import Config
+from src.rag.calibrate_relevance import accept_threshold, labeled_scores, reject_threshold
+from src.rag.relevance_gate import ACCEPT, AMBIGUOUS, REJECT, SCORE_SCALE, RelevanceGate
+from src.rag.torch_backend import logits_to_probabilities
+
+
+def test_reject_threshold_keeps_allowed_share_of_relevant_below():
+    samples = [(score / 100, True) for score in range(10, 110, 10)] + [(0.01, False), (0.05, False)]
+
+    # из 10 релевантных можно отсечь 10% - одну оценку
+    assert reject_threshold(samples, max_false_reject=0.1) == 0.2
+    assert reject_threshold(samples, max_false_reject=0.0) == 0.1
+    assert reject_threshold([(0.3, False)], max_false_reject=0.1) == 0.0
+
+
+def test_accept_threshold_is_lowest_score_with_required_precision():
+    samples = [(0.9, True), (0.8, True), (0.7, False), (0.6, True), (0.5, False), (0.4, False)]
+
+    assert accept_threshold(samples, min_precision=1.0) == 0.8
+    # на 0.6: три релевантных из четырех
+    assert accept_threshold(samples, min_precision=0.75) == 0.6
+    assert accept_threshold([(0.9, False)], min_precision=0.5) is None
+
+
+def test_accept_threshold_is_not_placed_between_equal_scores():
+    samples = [(0.9, True), (0.5, True), (0.5, False)]
+
+    assert accept_threshold(samples, min_precision=1.0) == 0.9
+
+
+def test_gate_decides_by_thresholds():
+    gate = RelevanceGate(accept_score=0.6, reject_score=0.2)
+
+    assert gate.decide(0.6) == ACCEPT
+    assert gate.decide(0.19) == REJECT
+    assert gate.decide(0.2) == AMBIGUOUS
+    # без LLM неоднозначная полоса делится посередине
+    assert gate.decide(0.4, tiebreak=False) == ACCEPT
+    assert gate.decide(0.39, tiebreak=False) == REJECT
+    with pytest.raises(ValueError):
+        RelevanceGate(accept_score=0.2, reject_score=0.6)
+
+
+def test_thresholds_from_another_score_scale_are_ignored(tmp_path, monkeypatch):
+    path = tmp_path / "thresholds.json"
+    monkeypatch.setattr(Config, "RAG_RELEVANCE_THRESHOLDS_FILE", str(path))
+    monkeypatch.setattr(Config, "RAG_RELEVANCE_LOG", "")
+
+    path.write_text(json.dumps({"accept": 3.5, "reject": -2.0}), encoding="utf-8")
+    gate = RelevanceGate.from_config()
+    assert (gate.accept_score, gate.reject_score) == (Config.RAG_RELEVANCE_ACCEPT_SCORE,
+                                                      Config.RAG_RELEVANCE_REJECT_SCORE)
+
+    path.write_text(json.dumps({"accept": 0.7, "reject": 0.1, "score_scale": SCORE_SCALE}), encoding="utf-8")
+    gate = RelevanceGate.from_config()
+    assert (gate.accept_score, gate.reject_score) == (0.7, 0.1)
+
+
+def test_calibration_skips_decisions_logged_on_another_scale():
+    records = [{"top_score": 4.2, "llm_decision": True},
+               {"top_score": 0.9, "llm_decision": True, "score_scale": SCORE_SCALE},
+               {"top_score": 0.1, "label": False, "llm_decision": True, "score_scale": SCORE_SCALE}]
+
+    assert labeled_scores(records) == [(0.9, True), (0.1, False)]
+
+
+def test_reranker_logits_become_probabilities():
+    assert logits_to_probabilities(np.array([0.0, 10.0, -10.0])) == pytest.approx([0.5, 1.0, 0.0], abs=1e-4)
+    assert logits_to_probabilities(np.array([[0.5], [-0.5]])) == pytest.approx([0.6225, 0.3775], abs=1e-4)
+    # двухклассовая модель: вероятность второго класса
+    assert logits_to_probabilities(np.array([[0.0, 0.0], [0.0, np.log(3)]])) == pytest.approx([0.5, 0.75])
@@ -0,0 +1,40 @@
+from src.rag.rerank_cache import CachedCrossEncoder
+from tests.fakes import CountingCrossEncoder
+
+
+def test_repeated_pairs_are_scored_once():
+    model = CountingCrossEncoder()
+    reranker = CachedCrossEncoder(model, max_entries=100)
+
+    first = reranker.score([("q", "aa"), ("q", "bbb"), ("q", "aa")])
+    second = reranker.score([("q", "bbb"), ("q", "c")])
+
+    assert model.calls == [[("q", "aa"), ("q", "bbb")], [("q", "c")]]
+    assert first == [2.0, 3.0, 2.0]
+    assert second == [3.0, 1.0]
+    stats = reranker.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"]) == (3, 1, 4)
+
+
+def test_query_is_normalized_for_the_cache_key():
+    model = CountingCrossEncoder()
+    reranker = CachedCrossEncoder(model, max_entries=100)
+
+    reranker.score([("What is  RAG?", "chunk")])
+    assert reranker.score([("  what is rag? ", "chunk")]) == [5.0]
+
+    assert len(model.calls) == 1
+
+
+def test_least_recently_used_pairs_are_evicted():
+    model = CountingCrossEncoder()
+    reranker = CachedCrossEncoder(model, max_entries=2)
+    reranker.score([("q", "a"), ("q", "b")])
+    # обращение к "a" делает самой старой пару с "b"
+    reranker.score([("q", "a")])
+
+    reranker.score([("q", "c")])
+    reranker.score([("q", "a"), ("q", "b")])
+
+    assert model.calls[-1] == [("q", "b")]
+    assert reranker.stats()["entries"] == 2
@@ -0,0 +1,54 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from src.utlis.import_profile import HEAVY_MODULES, profile_imports
+
+
+@pytest.mark.parametrize("module", ["src.server", "src.routers.query"])
+def test_app_import_does_not_load_heavy_modules(module):
+    # импорт в отдельном процессе: в этом модули мог уже загрузить другой тест
+    imported = {name.split(".")[0] for name, _, _ in profile_imports(module)}
+
+    assert imported, f"import of {module} was not profiled"
+    assert not imported & set(HEAVY_MODULES)
+
+
+def test_services_are_cold_after_import():
+    from src.backend import services
+
+    for service in (services.rag_service, services.llm_interface):
+        assert not service.is_warm, f"{service.name} was created on import"
+
+
+@pytest.mark.asyncio
+async def test_shutdown_cancels_background_tasks_before_pools(monkeypatch):
+    from src import server
+
+    events = []
+
+    async def background(name):
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            events.append(f"{name} cancelled")
+            raise
+
+    monkeypatch.setattr(server, "create_postgres_tables", lambda: None)
+    monkeypatch.setattr(server, "get_db", lambda: iter([None]))
+    monkeypatch.setattr(server.Config, "FILL_MYSQL_IF_EMPTY", False)
+    monkeypatch.setattr(server.Config, "LOOP_LAG_INTERVAL_MS", 0)
+    monkeypatch.setattr(server.Config, "WARMUP_ON_STARTUP", True)
+    monkeypatch.setattr(server.Config, "RAG_MAINTENANCE_INTERVAL_S", 60)
+    monkeypatch.setattr(server.services, "warm_up", lambda: background("warmup"))
+    monkeypatch.setattr(server, "maintenance_loop", lambda get_rag, interval: background("maintenance"))
+    monkeypatch.setattr(server, "ingestion_queue", SimpleNamespace(shutdown=lambda: events.append("ingestion pool")))
+    monkeypatch.setattr(server, "EXECUTORS", [SimpleNamespace(shutdown=lambda: events.append("executor"))])
+
+    async with server.lifespan(server.app):
+        await asyncio.sleep(0)
+
+    assert events == ["warmup cancelled", "maintenance cancelled", "ingestion pool", "executor"]
+    assert server.app.state.warmup_task.cancelled()
+    assert server.app.state.maintenance_task.cancelled()
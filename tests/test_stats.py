@@ -0,0 +1,10 @@
+from src.utlis.stats import percentile
+
+
+def test_percentile_uses_nearest_rank():
+    values = [float(value) for value in range(100, 0, -1)]
+
+    assert percentile(values, 0.5) == 51.0
+    assert percentile(values, 0.99) == 100.0
+    assert percentile(values, 1.0) == 100.0
+    assert percentile([], 0.95) == 0.0
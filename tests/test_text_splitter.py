@@ -0,0 +1,72 @@
+from langchain_core.documents import Document
+
+from src.config.config import Config
+from src.rag import chunk_report
+from src.rag import rag_service as rag_module
+from src.rag.chunk_store import ChunkStore
+from src.rag.rag_service import EMBEDDING_MAX_TOKENS, RAGService
+from tests.fakes import word_tokenizer
+
+TEXT = "\n\n".join(" ".join(f"p{i}w{j}" for j in range(30)) for i in range(10))
+
+
+def _splitter(monkeypatch, chunk_tokens, overlap_tokens=0):
+    monkeypatch.setattr(Config, "RAG_CHUNK_TOKENS", chunk_tokens)
+    monkeypatch.setattr(Config, "RAG_CHUNK_OVERLAP_TOKENS", overlap_tokens)
+    monkeypatch.setattr(rag_module, "load_embedding_tokenizer", word_tokenizer)
+    return RAGService._create_text_splitter()
+
+
+def test_chunks_fit_the_token_budget(monkeypatch):
+    splitter = _splitter(monkeypatch, chunk_tokens=50)
+    tokenizer = word_tokenizer()
+
+    chunks = splitter.split_text(TEXT)
+
+    # 300 слов по 50 токенов; по символам (~1600) это был бы один-два чанка
+    assert len(chunks) >= 6
+    assert all(len(tokenizer.tokenize(chunk)) <= 50 for chunk in chunks)
+    assert " ".join(chunks).split() == TEXT.split()
+
+
+def test_chunks_overlap_by_tokens(monkeypatch):
+    splitter = _splitter(monkeypatch, chunk_tokens=20, overlap_tokens=5)
+
+    chunks = splitter.split_text(" ".join(f"w{i}" for i in range(60)))
+
+    assert all(len(chunk.split()) <= 20 for chunk in chunks)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert 0 < len(set(previous.split()) & set(chunk.split())) <= 5
+
+
+def test_zero_token_budget_keeps_the_character_splitter(monkeypatch):
+    monkeypatch.setattr(Config, "RAG_CHUNK_TOKENS", 0)
+    # токенизатор эмбеддера в этом режиме не нужен
+    monkeypatch.setattr(rag_module, "load_embedding_tokenizer", lambda: (_ for _ in ()).throw(AssertionError))
+    splitter = RAGService._create_text_splitter()
+
+    assert all(len(chunk) <= 1000 for chunk in splitter.split_text(TEXT))
+    assert splitter._chunk_size == 1000
+
+
+def test_budget_over_the_embedder_window_is_reported(monkeypatch):
+    warnings = []
+    monkeypatch.setattr(rag_module.logger, "warning", warnings.append)
+
+    _splitter(monkeypatch, chunk_tokens=EMBEDDING_MAX_TOKENS - 2)
+    assert warnings == []
+    _splitter(monkeypatch, chunk_tokens=EMBEDDING_MAX_TOKENS)
+    assert len(warnings) == 1
+
+
+def test_chunk_report_counts_truncated_tokens(tmp_path):
+    chunk_store = ChunkStore(str(tmp_path / "chunks"))
+    long_chunk = " ".join(f"w{i}" for i in range(EMBEDDING_MAX_TOKENS + 8))
+    chunk_store.append([Document(page_content="short chunk"), Document(page_content=long_chunk)])
+
+    stats = chunk_report.truncation_stats(chunk_store, word_tokenizer())
+
+    # со служебными токенами: 2 + 2 и 136 + 2, из окна 128 выпадает 10
+    assert (stats["chunks"], stats["truncated_chunks"]) == (2, 1)
+    assert stats["avg_tokens"] == (4 + EMBEDDING_MAX_TOKENS + 10) / 2
+    assert stats["truncated_token_rate"] == 10 / (4 + EMBEDDING_MAX_TOKENS + 10)